@@ -7,44 +7,75 @@ import {
 } from "@aws-sdk/client-location";
 import { logger } from "../commons/powertools";
 import type { BatchUpdateDevicePositionCommandInput } from "@aws-sdk/client-location";
-import type { Event } from "./types";
+import type { Event, LocationEvent } from "./types";
 
 const locationClient = new LocationClient({});
 
-export const handler = async (event: Event) => {
-  const {
-    deviceId,
-    longitude,
-    latitude,
-    timestamp,
-    accuracy: { horizontal },
-    positionProperties: { batteryLevel },
-  } = event;
+// BatchUpdateDevicePosition accepts at most 10 updates per call
+const MAX_UPDATES = 10;
+
+const toUpdate = ({
+  deviceId,
+  longitude,
+  latitude,
+  timestamp,
+  accuracy: { horizontal },
+  positionProperties: { batteryLevel },
+}: LocationEvent): NonNullable<
+  BatchUpdateDevicePositionCommandInput["Updates"]
+>[number] => ({
+  DeviceId: deviceId,
+  SampleTime: new Date(timestamp),
+  Position: [longitude, latitude],
+  PositionProperties: {
+    batteryLevel: `${batteryLevel}`,
+  },
+  Accuracy: {
+    Horizontal: horizontal,
+  },
+});
 
+/**
+ * Updates the tracker with a single position, or with every position of a
+ * `{ positions: [...] }` envelope published by the uplink Lambdas.
+ */
+export const handler = async (event: Event) => {
   logger.debug("event", { event });
 
-  const updates: BatchUpdateDevicePositionCommandInput["Updates"] = [
-    {
-      DeviceId: deviceId,
-      SampleTime: new Date(timestamp),
-      Position: [longitude, latitude],
-      PositionProperties: {
-        batteryLevel: `${batteryLevel}`,
-      },
-      Accuracy: {
-        Horizontal: horizontal,
-      },
-    },
-  ];
+  const positions = "positions" in event ? event.positions : [event];
+  const updates = positions.map(toUpdate);
+
   try {
-    await locationClient.send(
-      new BatchUpdateDevicePositionCommand({
-        TrackerName: process.env.TRACKER_NAME,
-        Updates: updates,
-      })
-    );
-
-    logger.info("Successfully updated device position", { details: updates });
+    let failed = 0;
+    for (let start = 0; start < updates.length; start += MAX_UPDATES) {
+      const chunk = updates.slice(start, start + MAX_UPDATES);
+      const { Errors: errors } = await locationClient.send(
+        new BatchUpdateDevicePositionCommand({
+          TrackerName: process.env.TRACKER_NAME,
+          Updates: chunk,
+        })
+      );
+      // the call succeeds even when some of its updates were rejected
+      for (const { DeviceId, SampleTime, Error: error } of errors ?? []) {
+        failed++;
+        logger.error("Unable to update device position", {
+          deviceId: DeviceId,
+          sampleTime: SampleTime,
+          error,
+        });
+      }
+    }
+
+    if (failed > 0) {
+      logger.error("Unable to update some device positions", {
+        failed,
+        updated: updates.length - failed,
+      });
+    } else {
+      logger.info("Successfully updated device position", {
+        details: updates,
+      });
+    }
   } catch (err) {
     logger.error("Unable to update tracker", err as Error);
     throw err;
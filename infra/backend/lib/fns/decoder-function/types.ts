@@ -14,6 +14,16 @@ type LocationEvent = {
   };
 };
 
-type Event = Extract<IoTEvent<LocationEvent>, { type: "location" }>;
+/**
+ * Envelope of up to 10 positions, published by the uplink Lambdas when
+ * coalescing positions (PUBLISH_BATCH_SIZE > 1).
+ */
+type PositionsEvent = {
+  positions: LocationEvent[];
+};
+
+type Event =
+  | Extract<IoTEvent<LocationEvent>, { type: "location" }>
+  | Extract<IoTEvent<PositionsEvent>, { positions: unknown }>;
 
-export type { Event, LocationEvent };
+export type { Event, LocationEvent, PositionsEvent };
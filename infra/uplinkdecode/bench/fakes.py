@@ -0,0 +1,389 @@
+"""
+In-process stand-ins for the AWS services used by the uplink Lambdas.
+
+Every fake accepts a `latency` in seconds that is slept on each call to model
+the network round trip, and counts its calls per operation.
+"""
+import io
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+def deserialize(value: Dict[str, Any]):
+    (kind, raw), = value.items()
+    if kind == 'S':
+        return raw
+    if kind == 'N':
+        return Decimal(raw)
+    if kind == 'B':
+        return bytes(raw)
+    if kind == 'BOOL':
+        return raw
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {k: deserialize(v) for k, v in raw.items()}
+    if kind == 'L':
+        return [deserialize(v) for v in raw]
+    if kind == 'SS':
+        return frozenset(raw)
+    raise ValueError(f'Unsupported attribute type {kind}')
+
+
+def serialize(value):
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, (set, frozenset)):
+        return {'SS': sorted(value)}
+    if isinstance(value, dict):
+        return {'M': {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(v) for v in value]}
+    raise ValueError(f'Unsupported value {value!r}')
+
+
+class ServiceError(Exception):
+    """Raised like botocore's ClientError, with its `response`."""
+
+    def __init__(self, code: str, status: int, operation: str):
+        super().__init__(f'An error occurred ({code}) when calling the {operation} operation')
+        self.response = {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+class FakeService:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeDynamoDB(FakeService):
+    """
+    Low-level DynamoDB client over in-memory tables keyed on
+    (WirelessDeviceId, timestamp), like at-payloads.
+
+    Every write to a table is also appended to its stream as a NEW_IMAGE
+    record, read back with read_stream().
+    """
+
+    def __init__(self, latency: float = 0.0, hash_key: str = 'WirelessDeviceId', range_key: str = 'timestamp'):
+        super().__init__(latency)
+        self.hash_key = hash_key
+        self.range_key = range_key
+        # table name -> hash key value -> range key value -> item (deserialized)
+        self.tables: Dict[str, Dict[Any, Dict[Any, Dict[str, Any]]]] = defaultdict(lambda: defaultdict(dict))
+        self.streams: Dict[str, list] = defaultdict(list)
+        self.page_size = 100
+        self._sequence = 0
+
+    def _store(self, table_name: str, item: Dict[str, Any]):
+        values = {name: deserialize(value) for name, value in item.items()}
+        with self._lock:
+            table = self.tables[table_name][values[self.hash_key]]
+            event_name = 'MODIFY' if values.get(self.range_key) in table else 'INSERT'
+            table[values.get(self.range_key)] = values
+            self._sequence += 1
+            keys = {name: item[name] for name in (self.hash_key, self.range_key) if name in item}
+            self.streams[table_name].append({
+                'eventName': event_name,
+                'eventSource': 'aws:dynamodb',
+                'dynamodb': {
+                    'Keys': keys,
+                    'NewImage': item,
+                    'SequenceNumber': str(self._sequence),
+                    'StreamViewType': 'NEW_IMAGE',
+                },
+            })
+
+    def read_stream(self, table_name: str):
+        """Returns and removes every stream record written so far."""
+        with self._lock:
+            records, self.streams[table_name] = self.streams[table_name], []
+        return records
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._call('put_item')
+        self._store(TableName, Item)
+        return {}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call('get_item')
+        values = {name: deserialize(value) for name, value in Key.items()}
+        with self._lock:
+            item = self.tables[TableName].get(values[self.hash_key], {}).get(values.get(self.range_key))
+        if item is None:
+            return {}
+        return {'Item': {name: serialize(value) for name, value in item.items()}}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        """Supports 'SET a = :v, #b = :w' update expressions only."""
+        self._call('update_item')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        keys = {name: deserialize(value) for name, value in Key.items()}
+        action, _, assignments = UpdateExpression.strip().partition(' ')
+        if action.upper() != 'SET':
+            raise ValueError(f'Unsupported update expression {UpdateExpression}')
+        with self._lock:
+            item = self.tables[TableName][keys[self.hash_key]].get(keys.get(self.range_key))
+        item = {name: serialize(value) for name, value in (item or keys).items()}
+        for assignment in assignments.split(','):
+            name, _, value = (part.strip() for part in assignment.partition('='))
+            item[names.get(name, name)] = values[value]
+        self._store(TableName, item)
+        return {}
+
+    def batch_write_item(self, RequestItems):
+        self._call('batch_write_item')
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise ValueError('Too many items requested for the BatchWriteItem call')
+            for request in requests:
+                self._store(table_name, request['PutRequest']['Item'])
+        return {'UnprocessedItems': {}}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              IndexName=None, ExclusiveStartKey=None, Limit=None, **kwargs):
+        """
+        Supports '<hash> = :v [AND <range> = :w | BETWEEN :a AND :b]' key
+        conditions. An index is sparse on its range key attribute, pages hold
+        at most `Limit` or `page_size` items.
+        """
+        self._call('query')
+        names = ExpressionAttributeNames or {}
+        values = {name: deserialize(value) for name, value in ExpressionAttributeValues.items()}
+        conditions = {}
+        for term in re.finditer(r'([#\w]+) (?:= (:\w+)|BETWEEN (:\w+) AND (:\w+))', KeyConditionExpression):
+            name = names.get(term.group(1), term.group(1))
+            conditions[name] = (values[term.group(2)],) * 2 if term.group(2) else (values[term.group(3)],
+                                                                                     values[term.group(4)])
+        devid = conditions[self.hash_key][0]
+        sort_key = next((name for name in conditions if name != self.hash_key), self.range_key)
+        if IndexName is not None and sort_key == self.range_key:
+            raise ValueError(f'Unsupported key condition {KeyConditionExpression}')
+        with self._lock:
+            candidates = list(self.tables[TableName].get(devid, {}).values())
+        items = sorted((item for item in candidates if sort_key in item and (
+            sort_key not in conditions or conditions[sort_key][0] <= item[sort_key] <= conditions[sort_key][1])),
+            key=lambda item: (item[sort_key], item.get(self.range_key)))
+        if ExclusiveStartKey:
+            start = (deserialize(ExclusiveStartKey[sort_key]), deserialize(ExclusiveStartKey[self.range_key]))
+            items = [item for item in items if (item[sort_key], item.get(self.range_key)) > start]
+        page = items[:Limit or self.page_size]
+        response = {'Items': [{name: serialize(value) for name, value in item.items()} for item in page],
+                    'Count': len(page)}
+        if len(page) < len(items):
+            last = page[-1]
+            response['LastEvaluatedKey'] = {name: serialize(last[name]) for name in {self.hash_key, self.range_key,
+                                                                                       sort_key}}
+        return response
+
+    def batch_get_item(self, RequestItems):
+        """Applies ProjectionExpression, never leaves keys unprocessed."""
+        self._call('batch_get_item')
+        responses = {}
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise ValueError('Too many items requested for the BatchGetItem call')
+            names = request.get('ExpressionAttributeNames', {})
+            projection = request.get('ProjectionExpression')
+            projected = projection and {names.get(name.strip(), name.strip()) for name in projection.split(',')}
+            found = []
+            for key in request['Keys']:
+                values = {name: deserialize(value) for name, value in key.items()}
+                with self._lock:
+                    item = self.tables[table_name].get(values[self.hash_key], {}).get(values.get(self.range_key))
+                if item is not None:
+                    found.append({name: serialize(value) for name, value in item.items()
+                                  if not projected or name in projected})
+            responses[table_name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def items(self, table_name: str, devid=None):
+        table = self.tables[table_name]
+        devices = [devid] if devid is not None else list(table)
+        return [item for d in devices for _, item in sorted(table[d].items())]
+
+
+class FakeIotData(FakeService):
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.messages = []
+
+    def publish(self, topic, qos=0, payload=b''):
+        self._call('publish')
+        with self._lock:
+            self.messages.append((topic, json.loads(payload)))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+class FakeIotWireless(FakeService):
+    """
+    Resolves every Wi-Fi scan or GNSS payload to a position derived from its input.
+
+    Each access point sits at a fixed spot derived from its MAC within a
+    site of about 100 m, a scan resolves to the RSSI weighted centroid of
+    its access points like a real solver would.
+    """
+
+    SITE = (47.6, -122.3)
+
+    def access_point_location(self, mac: str):
+        seed = zlib.crc32(mac.lower().encode())
+        return self.SITE[0] + (seed % 1000) / 1e6, self.SITE[1] + (seed // 1000 % 1000) / 1e6
+
+    def get_position_estimate(self, WiFiAccessPoints=None, Gnss=None, **kwargs):
+        self._call('get_position_estimate')
+        if WiFiAccessPoints:
+            weights = [10 ** (ap['Rss'] / 20) for ap in WiFiAccessPoints]
+            locations = [self.access_point_location(ap['MacAddress']) for ap in WiFiAccessPoints]
+            latitude = sum(w * lat for w, (lat, _) in zip(weights, locations)) / sum(weights)
+            longitude = sum(w * lon for w, (_, lon) in zip(weights, locations)) / sum(weights)
+        else:
+            seed = zlib.crc32(json.dumps(Gnss, default=str).encode())
+            longitude = -180 + (seed % 36000) / 100
+            latitude = -80 + ((seed // 36000) % 16000) / 100
+        payload = {
+            'coordinates': [longitude, latitude],
+            'type': 'Point',
+            'properties': {'horizontalAccuracy': 20, 'timestamp': time.time()},
+        }
+        return {'GeoJsonPayload': io.BytesIO(json.dumps(payload).encode())}
+
+
+class FaultyIotWireless(FakeIotWireless):
+    """
+    FakeIotWireless with injected faults, replayable from `seed`.
+
+    At most `quota` calls per second of `clock` are accepted, the others
+    raise ThrottlingException like the account quota would. During the
+    `outages`, (start, end) seconds after the first call, every call fails
+    with ServiceUnavailableException, and otherwise `error_rate` of the calls
+    fail with InternalServerException. Outcomes are counted per second in
+    `timeline`.
+    """
+
+    def __init__(self, latency: float = 0.0, quota: float = None, outages: Iterable[Tuple[float, float]] = (),
+                 error_rate: float = 0.0, seed: int = 0, clock: Callable[[], float] = time.monotonic):
+        super().__init__(latency)
+        self.quota = quota
+        self.outages = list(outages)
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.outcomes = Counter()
+        self.timeline: Dict[int, Counter] = defaultdict(Counter)
+        self._started = None
+        self._window = (None, 0)
+
+    def _fault(self):
+        with self._lock:
+            now = self.clock()
+            if self._started is None:
+                self._started = now
+            elapsed = now - self._started
+            second = int(elapsed)
+            if any(start <= elapsed < end for start, end in self.outages):
+                fault = ServiceError('ServiceUnavailableException', 503, 'GetPositionEstimate')
+            elif self.error_rate and self.rng.random() < self.error_rate:
+                fault = ServiceError('InternalServerException', 500, 'GetPositionEstimate')
+            else:
+                window, used = self._window
+                used = used + 1 if window == second else 1
+                self._window = (second, used)
+                fault = ServiceError('ThrottlingException', 429, 'GetPositionEstimate') \
+                    if self.quota is not None and used > self.quota else None
+            outcome = fault.response['Error']['Code'] if fault else 'ok'
+            self.outcomes[outcome] += 1
+            self.timeline[second][outcome] += 1
+        return fault
+
+    def get_position_estimate(self, **kwargs):
+        fault = self._fault()
+        if fault is not None:
+            self._call('get_position_estimate')
+            raise fault
+        return super().get_position_estimate(**kwargs)
+
+
+class FakeSQS(FakeService):
+    """SQS queues, messages are taken back as the Records of a Lambda event with records()."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.messages: Dict[str, List[Dict]] = defaultdict(list)
+        self._sequence = 0
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        self._call('send_message')
+        with self._lock:
+            self._sequence += 1
+            message_id = f'msg-{self._sequence}'
+            self.messages[QueueUrl].append({'messageId': message_id, 'body': MessageBody,
+                                            'delay': DelaySeconds, 'attributes': {}})
+        return {'MessageId': message_id}
+
+    def records(self, queue_url: str, max_messages: int = 10) -> List[Dict]:
+        """Removes up to max_messages messages from a queue, ignoring their delay."""
+        with self._lock:
+            records = self.messages[queue_url][:max_messages]
+            del self.messages[queue_url][:max_messages]
+        return records
+
+    def requeue(self, queue_url: str, records: List[Dict]):
+        """Puts back records whose processing failed, as their visibility timeout would."""
+        with self._lock:
+            self.messages[queue_url].extend(records)
+
+
+class FakeEvents(FakeService):
+    """EventBridge, keeping the detail of every event put."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.events = []
+
+    def put_events(self, Entries):
+        self._call('put_events')
+        if len(Entries) > 10:
+            raise ValueError('Too many entries requested for the PutEvents call')
+        with self._lock:
+            self.events.extend(json.loads(entry['Detail']) for entry in Entries)
+        return {'FailedEntryCount': 0, 'Entries': [{'EventId': str(i)} for i in range(len(Entries))]}
+
+
+def install(db: FakeDynamoDB = None, iot_data: FakeIotData = None, iot_wireless: FakeIotWireless = None,
+            events: FakeEvents = None, sqs: FakeSQS = None):
+    """Registers the fakes with at_common.clients, creating any that are not given."""
+    from at_common import clients
+    db = db or FakeDynamoDB()
+    iot_data = iot_data or FakeIotData()
+    iot_wireless = iot_wireless or FakeIotWireless()
+    clients.set_client('dynamodb', db)
+    clients.set_client('iot-data', iot_data)
+    clients.set_client('iotwireless', iot_wireless)
+    clients.set_client('events', events or FakeEvents())
+    clients.set_client('sqs', sqs or FakeSQS())
+    return db, iot_data, iot_wireless
@@ -0,0 +1,33 @@
+"""
+Loads the uplink Lambda handlers and the UplinkCommon layer outside of Lambda.
+
+The handler files are named after their Lambda handlers (at-decode.py,
+at-defrag.py, at-rollup.py) and cannot be imported with a plain import statement.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER_PATH = os.path.join(ROOT, 'lambda', 'at_common', 'python')
+HANDLERS = {
+    'decode': os.path.join(ROOT, 'lambda', 'at_decode', 'at-decode.py'),
+    'defrag': os.path.join(ROOT, 'lambda', 'at_defrag', 'at-defrag.py'),
+    'rollup': os.path.join(ROOT, 'lambda', 'at_rollup', 'at-rollup.py'),
+}
+
+if LAYER_PATH not in sys.path:
+    sys.path.insert(0, LAYER_PATH)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+def load_handler(name: str):
+    """Imports at-<name>.py as module `at_<name>` and returns it."""
+    module_name = f'at_{name}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, HANDLERS[name])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,239 @@
+"""
+Offline replay benchmark for the uplink decode and defrag Lambdas.
+
+Uplinks from a trace are fed one by one to at-decode.lambda_handler (or in
+groups to batch_handler with --batch). Writes to the fake payloads table land
+on its stream; records passing the FragEventSourceDDBTableStream filter are
+delivered to at-defrag.lambda_handler in batches, as the event source mapping
+would. All AWS calls go to the in-process fakes with the injected latencies.
+With --wireless-quota or --wireless-errors, position estimates go to
+FaultyIotWireless; solves deferred by the resolver are then drained through
+at-decode.resolve_handler once the trace is done.
+
+Traces are JSON lines holding one at_uplink event (or bare uplink) per line.
+Without --trace a trace is generated with bench/traffic.py.
+
+    python bench/replay.py --uplinks 2000 --save baseline.json
+    python bench/replay.py --uplinks 2000 --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PAYLOADS_TABLE = 'at-payloads'
+# BatchSize of FragEventSourceDDBTableStream in template.yml
+STREAM_BATCH_SIZE = 100
+DEFERRED_QUEUE = 'https://sqs.us-east-1.amazonaws.com/000000000000/at-deferred-solves'
+# BatchSize of DeferredSolveEventSource in template.yml
+DEFERRED_BATCH_SIZE = 10
+
+
+def load_trace(path: str) -> Iterator[Dict]:
+    with open(path) as trace:
+        for line in trace:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                yield event if 'at_uplink' in event else {'at_uplink': event}
+
+
+def _chunks(events: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for event in events:
+        chunk.append(event)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_filter(record: Dict) -> bool:
+    """The FilterCriteria of FragEventSourceDDBTableStream."""
+    image = record['dynamodb']['NewImage']
+    return image.get('type', {}).get('S') in ('WIFI_END', 'GNSS_END') and 'location' not in image
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    from at_common.instrumentation import percentile
+    values = sorted(values)
+    return {'count': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95),
+            'p99': percentile(values, 99)}
+
+
+def replay(events: Iterable[Dict], batch: int = 0, ddb_latency: float = 0.005, iot_latency: float = 0.010,
+           wireless_latency: float = 0.080, wireless_quota: float = None, wireless_errors: float = 0.0,
+           max_rounds: int = 100) -> Dict:
+    """Replays a trace and returns the report as a dict."""
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('METRICS_FLUSH_INTERVAL', '1e9')
+    os.environ.setdefault('DEFERRED_SOLVE_QUEUE', DEFERRED_QUEUE)
+    # deferred solves are drained right after the trace, not minutes later
+    os.environ.setdefault('RESOLVER_BREAKER_RESET', '1')
+    # the fake only has a quota with --wireless-quota, calls are paced to it
+    if wireless_quota is None:
+        os.environ.setdefault('RESOLVER_RATE', '1e6')
+        os.environ.setdefault('RESOLVER_BURST', '1e6')
+    else:
+        os.environ.setdefault('RESOLVER_RATE', str(wireless_quota))
+    import fakes
+    from handlers import load_handler
+    from at_common.frames import FrameError, decode_frame, decode_payload
+    from at_common.instrumentation import metrics
+
+    decode = load_handler('decode')
+    defrag = load_handler('defrag')
+    if wireless_quota is not None or wireless_errors:
+        iot_wireless = fakes.FaultyIotWireless(wireless_latency, quota=wireless_quota, error_rate=wireless_errors)
+    else:
+        iot_wireless = fakes.FakeIotWireless(wireless_latency)
+    sqs = fakes.FakeSQS()
+    db, iot_data, iot_wireless = fakes.install(
+        fakes.FakeDynamoDB(ddb_latency), fakes.FakeIotData(iot_latency), iot_wireless, sqs=sqs)
+
+    latencies = defaultdict(list)
+    pending_records = []
+    uplinks = 0
+    failed = 0
+    defrag_invocations = 0
+
+    def deliver_stream(force=False):
+        nonlocal defrag_invocations
+        pending_records.extend(r for r in db.read_stream(PAYLOADS_TABLE) if stream_filter(r))
+        while pending_records and (force or len(pending_records) >= STREAM_BATCH_SIZE):
+            records = pending_records[:STREAM_BATCH_SIZE]
+            del pending_records[:STREAM_BATCH_SIZE]
+            start = time.perf_counter()
+            defrag.lambda_handler({'Records': records}, None)
+            latencies['DEFRAG'].append((time.perf_counter() - start) * 1000)
+            defrag_invocations += 1
+
+    started = time.perf_counter()
+    if batch:
+        for chunk in _chunks(events, batch):
+            start = time.perf_counter()
+            failed += len(decode.batch_handler({'Records': chunk}, None)['batchItemFailures'])
+            latencies['BATCH'].append((time.perf_counter() - start) * 1000)
+            uplinks += len(chunk)
+            deliver_stream()
+    else:
+        for event in events:
+            try:
+                uplink_type = decode_frame(decode_payload(event['at_uplink']['PayloadData'])).type
+            except FrameError:
+                uplink_type = 'INVALID'
+            start = time.perf_counter()
+            try:
+                decode.lambda_handler(event, None)
+            except Exception:
+                failed += 1
+            latencies[uplink_type].append((time.perf_counter() - start) * 1000)
+            uplinks += 1
+            deliver_stream()
+    deliver_stream(force=True)
+    elapsed = time.perf_counter() - started
+
+    # deferred solves, redelivered until they resolve
+    rounds = 0
+    while sqs.messages[DEFERRED_QUEUE] and rounds < max_rounds:
+        records = sqs.records(DEFERRED_QUEUE, DEFERRED_BATCH_SIZE)
+        failures = {f['itemIdentifier'] for f in decode.resolve_handler({'Records': records}, None)['batchItemFailures']}
+        sqs.requeue(DEFERRED_QUEUE, [record for record in records if record['messageId'] in failures])
+        if failures:
+            rounds += 1
+            time.sleep(0.2)
+
+    calls = {}
+    for fake in (db, iot_data, iot_wireless, sqs):
+        for operation, count in fake.calls.items():
+            calls[operation] = count / max(uplinks, 1)
+
+    return {
+        'uplinks': uplinks,
+        'seconds': elapsed,
+        'throughput': uplinks / elapsed if elapsed else 0.0,
+        'defrag_invocations': defrag_invocations,
+        'failed': failed,
+        'deferred': sqs.calls['send_message'],
+        'unresolved': len(sqs.messages[DEFERRED_QUEUE]),
+        'resolver': decode.position_resolver.stats(),
+        'estimates': dict(getattr(iot_wireless, 'outcomes', {})),
+        'published': sum(len(message.get('positions', [message])) for _, message in iot_data.messages),
+        'latency': {key: percentiles(values) for key, values in sorted(latencies.items())},
+        'stages': {f'{stage}/{uplink_type}': summary
+                   for (stage, uplink_type), summary in sorted(metrics.summary().items())},
+        'calls_per_uplink': dict(sorted(calls.items())),
+    }
+
+
+def _delta(current: float, baseline: float) -> str:
+    if not baseline:
+        return ''
+    return f' ({(current - baseline) / baseline * 100:+.1f}%)'
+
+
+def print_report(report: Dict, baseline: Dict = None):
+    baseline = baseline or {}
+    print(f'uplinks {report["uplinks"]} in {report["seconds"]:.2f}s, '
+          f'{report["throughput"]:.1f} uplinks/s{_delta(report["throughput"], baseline.get("throughput"))}, '
+          f'{report["defrag_invocations"]} defrag invocations, {report["published"]} positions published')
+    if report.get('failed') or report.get('deferred'):
+        print(f'{report["failed"]} uplinks failed, {report["deferred"]} solves deferred, '
+              f'{report["unresolved"]} left unresolved')
+    if report.get('estimates'):
+        print('position estimates', report['estimates'], 'resolver', report['resolver'])
+
+    for title, section in (('handler latency (ms)', 'latency'), ('stage latency (ms)', 'stages')):
+        print(f'\n{title:<28} {"count":>7} {"p50":>9} {"p95":>9} {"p99":>9}')
+        for key, values in report[section].items():
+            base = baseline.get(section, {}).get(key, {})
+            print(f'{key:<28} {values["count"]:>7} ' + ' '.join(
+                f'{values[p]:>9.2f}' for p in ('p50', 'p95', 'p99')) + _delta(values['p95'], base.get('p95')))
+
+    print(f'\n{"calls per uplink":<28}')
+    for operation, value in report['calls_per_uplink'].items():
+        print(f'{operation:<28} {value:>7.3f}{_delta(value, baseline.get("calls_per_uplink", {}).get(operation))}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help='JSON lines file of recorded at_uplink events')
+    parser.add_argument('--uplinks', type=int, default=1000, help='synthetic trace length')
+    parser.add_argument('--devices', type=int, default=50, help='synthetic trace devices')
+    parser.add_argument('--motion', type=float, default=0.3, help='synthetic trace probability of motion')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=0, help='drive batch_handler with this many uplinks per call')
+    parser.add_argument('--ddb-latency', type=float, default=5, help='ms per DynamoDB call')
+    parser.add_argument('--iot-latency', type=float, default=10, help='ms per IoT Data publish')
+    parser.add_argument('--wireless-latency', type=float, default=80, help='ms per position estimate')
+    parser.add_argument('--wireless-quota', type=float, help='position estimates accepted per second')
+    parser.add_argument('--wireless-errors', type=float, default=0.0, help='share of position estimates failing')
+    parser.add_argument('--save', help='write the report as JSON, e.g. as a baseline')
+    parser.add_argument('--baseline', help='compare against a report written with --save')
+    args = parser.parse_args()
+
+    if args.trace:
+        events = load_trace(args.trace)
+    else:
+        import traffic
+        events = traffic.events(devices=args.devices, uplinks=args.uplinks, motion=args.motion, seed=args.seed)
+    report = replay(events, args.batch, args.ddb_latency / 1000, args.iot_latency / 1000,
+                    args.wireless_latency / 1000, args.wireless_quota, args.wireless_errors)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
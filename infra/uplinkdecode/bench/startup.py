@@ -0,0 +1,127 @@
+"""
+Cold start benchmark for the uplink Lambda handlers.
+
+Every run starts a fresh interpreter that imports one handler and invokes it
+twice against stubbed clients, reporting:
+
+  import   time to import the handler module (Lambda init phase)
+  clients  with --real-clients, time to build the boto3 clients the case needs
+  first    first invocation, including lazily imported modules
+  warm     second invocation with the same event
+
+    python bench/startup.py --runs 10
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+EVENTS = {
+    # NOLOC uplink: no position solve, a single table write
+    'decode-noloc': ('decode', {'at_uplink': {
+        'WirelessDeviceId': 'bench-device',
+        'WirelessMetadata': {'Seq': 1},
+        'PayloadData': base64.b64encode(bytes([0x48, 80, 21, 40, 0x83]).hex().encode()).decode(),
+    }}),
+    # single message WIFI uplink: solve, write and publish
+    'decode-wifi': ('decode', {'at_uplink': {
+        'WirelessDeviceId': 'bench-device',
+        'WirelessMetadata': {'Seq': 2},
+        'PayloadData': base64.b64encode(bytes(
+            [0x88, 80, 21, 40, 0x83, 0xC4, 1, 2, 3, 4, 5, 6, 0xB0, 7, 8, 9, 10, 11, 12]).hex().encode()).decode(),
+    }}),
+    # WIFI_END stream record
+    'defrag-wifi': ('defrag', {'Records': [{'dynamodb': {
+        'SequenceNumber': '1',
+        'Keys': {'WirelessDeviceId': {'S': 'bench-device'}},
+        'NewImage': {'WirelessDeviceId': {'S': 'bench-device'}, 'timestamp': {'N': '4'},
+                     'type': {'S': 'WIFI_END'}, 'seq': {'N': '4'}, 'frag cnt': {'N': '2'}},
+    }}]}),
+}
+
+
+# clients an uplink of each case needs
+SERVICES = {
+    'decode-noloc': ('dynamodb',),
+    'decode-wifi': ('dynamodb', 'iotwireless', 'iot-data'),
+    'defrag-wifi': ('iotwireless', 'iot-data'),
+}
+
+
+def child(case: str, real_clients: bool):
+    start = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from handlers import load_handler
+    handler_name, event = EVENTS[case]
+    module = load_handler(handler_name)
+    imported = time.perf_counter()
+
+    import fakes
+    from at_common import clients
+    setup = constructed = time.perf_counter()
+    if real_clients:
+        # what the first uplink of a cold container pays to build its clients
+        for service in SERVICES[case]:
+            clients.get_client(service)
+        constructed = time.perf_counter()
+    db, iot_data, iot_wireless = fakes.install()
+
+    if handler_name == 'defrag':
+        # fragments the WIFI_END record refers to
+        now = int(time.time() * 1000)
+        for seq, kind in ((3, 'WIFI_F'), (4, 'WIFI_END')):
+            db.put_item(TableName='at-payloads', Item={
+                'WirelessDeviceId': {'S': 'bench-device'}, 'timestamp': {'N': str(now + seq)},
+                'seq': {'N': str(seq)}, 'type': {'S': kind}, 'frag cnt': {'N': '2'},
+                'wifidata': {'S': json.dumps([{'MacAddress': f'00:00:00:00:00:0{seq}', 'Rss': -60}])},
+            })
+
+    sys.stdout = open(os.devnull, 'w')
+    t0 = time.perf_counter()
+    module.lambda_handler(event, None)
+    first = time.perf_counter()
+    module.lambda_handler(event, None)
+    warm = time.perf_counter()
+    sys.stdout = sys.__stdout__
+    print(json.dumps({
+        'import': (imported - start) * 1000,
+        'clients': (constructed - setup) * 1000,
+        'first': (first - t0) * 1000,
+        'warm': (warm - first) * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--case', choices=sorted(EVENTS), action='append')
+    parser.add_argument('--real-clients', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.real_clients)
+        return
+
+    env = dict(os.environ, LOG_LEVEL='ERROR', METRICS_FLUSH_INTERVAL='3600')
+    print(f'{"case":<14} {"import ms":>10} {"clients ms":>11} {"first ms":>10} {"warm ms":>10}'
+          f'   (median of {args.runs} runs)')
+    for case in args.case or sorted(EVENTS):
+        samples = []
+        for _ in range(args.runs):
+            command = [sys.executable, os.path.abspath(__file__), '--child', case]
+            if args.real_clients:
+                command.append('--real-clients')
+            output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        median = {key: statistics.median(s[key] for s in samples) for key in ('import', 'clients', 'first', 'warm')}
+        print(f'{case:<14} {median["import"]:>10.1f} {median["clients"]:>11.1f} '
+              f'{median["first"]:>10.1f} {median["warm"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
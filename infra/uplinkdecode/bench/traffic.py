@@ -0,0 +1,255 @@
+"""
+Synthetic Sidewalk uplink traffic for load testing the uplink Lambdas.
+
+Frames are encoded byte for byte in the asset tracker format parsed by
+at_common.frames and wrapped in the at_uplink envelope the IoT rule delivers.
+The generator simulates a fleet of devices with configurable loss,
+duplication, reordering and bursty arrival; sequence numbers start at random
+points so they wrap around. Events are produced lazily, memory only grows with
+the number of devices and the reorder depth.
+
+    python bench/traffic.py --devices 20000 --uplinks 1000000 --loss 0.01 --out trace.jsonl
+    python bench/replay.py --trace trace.jsonl
+"""
+import argparse
+import base64
+import heapq
+import json
+import random
+import sys
+from array import array
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from handlers import LAYER_PATH  # noqa: F401, puts the UplinkCommon layer on sys.path
+from at_common.frames import (
+    AP_RECORD, CONFIG, CONFIG_BLOCK, GNSS, GNSS_INFO, GNSS_LAST_FRAG, NOLOC, RESOLVE_POLICIES, REPORTING_MODES, SENSOR,
+    WIFI,
+)
+
+# Nav message bytes carried by one GNSS_F/GNSS_END frame
+NAV_FRAG_SIZE = 18
+# num_msg is 3 bits wide, a GNSS message has at most 6 nav fragments
+MAX_NAV_SIZE = 6 * NAV_FRAG_SIZE
+SEQ_MODULUS = 1 << 16
+
+DEFAULT_MIX = {'NOLOC': 4, 'WIFI': 3, 'WIFI_F': 2, 'GNSS': 1, 'CONFIG': 0}
+
+
+def header(uplink_t: int, num_msg: int = 1, frag_num: int = 0) -> bytes:
+    return bytes([uplink_t << 6 | (num_msg & 0x7) << 3 | frag_num & 0x7])
+
+
+def sensor_block(battery: int, temperature: int, humidity: int, motion: bool, max_accel: float) -> bytes:
+    return SENSOR.pack(battery, temperature, humidity, (0x80 if motion else 0) | min(int(max_accel * 10), 0x7F))
+
+
+def ap_records(access_points) -> bytes:
+    """access_points: iterable of (mac bytes, rssi)."""
+    return b''.join(AP_RECORD.pack(rssi, mac) for mac, rssi in access_points)
+
+
+def gnss_info(nav_size: int, capture_time: int) -> bytes:
+    return GNSS_INFO.pack(nav_size, capture_time >> 32 & 0xFFFF, capture_time & 0xFFFFFFFF)
+
+
+def noloc_frames(sensor: bytes):
+    return [header(NOLOC) + sensor]
+
+
+def settings_block(reporting_mode: int, report_interval: int, wifi_fragments: int, gnss_fragments: int,
+                   resolve_policy: int) -> bytes:
+    return CONFIG_BLOCK.pack(reporting_mode, report_interval, wifi_fragments, gnss_fragments, resolve_policy)
+
+
+def config_frames(settings: bytes = b''):
+    """A CONFIG frame, a bare header without settings as sent by older firmware."""
+    return [header(CONFIG) + settings]
+
+
+def wifi_frames(sensor: bytes, access_points) -> list:
+    """A single WIFI frame for up to 2 access points, WIFI_F + WIFI_END for 3 or 4."""
+    if len(access_points) <= 2:
+        return [header(WIFI) + sensor + ap_records(access_points)]
+    return [header(WIFI, 2, 0) + sensor + ap_records(access_points[:2]),
+            header(WIFI, 2, 1) + ap_records(access_points[2:4])]
+
+
+def gnss_frames(sensor: bytes, nav: bytes, capture_time: int) -> list:
+    """GNSS + GNSS_F... + GNSS_END, num_msg carries the total frame count."""
+    chunks = [nav[i:i + NAV_FRAG_SIZE] for i in range(0, len(nav), NAV_FRAG_SIZE)]
+    count = len(chunks) + 1
+    frames = [header(GNSS, count, 0) + sensor + gnss_info(len(nav), capture_time)]
+    for index, chunk in enumerate(chunks, 1):
+        frames.append(header(GNSS, count, GNSS_LAST_FRAG if index == count - 1 else index) + chunk)
+    return frames
+
+
+def envelope(devid: str, seq: int, frame: bytes) -> Dict:
+    """The at_uplink event of the IoT rule, PayloadData being base64 encoded ASCII hex."""
+    return {'at_uplink': {
+        'WirelessDeviceId': devid,
+        'WirelessMetadata': {'Seq': seq},
+        'PayloadData': base64.b64encode(frame.hex().encode()).decode(),
+    }}
+
+
+class Arrival(NamedTuple):
+    at: float      # seconds since the start of the trace
+    event: Dict
+
+
+class Fleet:
+    """
+    Per-device state, kept in flat arrays so tens of thousands of devices cost
+    a few bytes each. Access points are derived from the device index, every
+    device sees the same neighbourhood on each scan.
+    """
+
+    def __init__(self, devices: int, rng: random.Random, seq_start: Optional[int] = None, motion: float = 0.3):
+        self.size = devices
+        self.rng = rng
+        self.motion = motion
+        self.seqs = array('H', (rng.randrange(SEQ_MODULUS) if seq_start is None else seq_start
+                                for _ in range(devices)))
+        self.battery = array('B', (rng.randint(20, 100) for _ in range(devices)))
+
+    @staticmethod
+    def devid(device: int) -> str:
+        return f'sim-{device:08d}'
+
+    def next_seq(self, device: int) -> int:
+        seq = self.seqs[device] = (self.seqs[device] + 1) % SEQ_MODULUS
+        return seq
+
+    def sensor(self, device: int) -> bytes:
+        rng = self.rng
+        if self.battery[device] > 1 and rng.random() < 0.01:
+            self.battery[device] -= 1
+        motion = rng.random() < self.motion
+        return sensor_block(self.battery[device], rng.randint(-10, 40), rng.randint(10, 90), motion,
+                            rng.uniform(0.5, 4.0) if motion else 0.0)
+
+    def access_points(self, device: int, count: int):
+        # locally administered MACs unique per device and AP
+        return [((0x0200 | i).to_bytes(2, 'big') + device.to_bytes(4, 'big'), self.rng.randint(-90, -40))
+                for i in range(count)]
+
+    def message(self, device: int, kind: str) -> list:
+        if kind == 'NOLOC':
+            return noloc_frames(self.sensor(device))
+        if kind == 'WIFI':
+            return wifi_frames(self.sensor(device), self.access_points(device, self.rng.randint(1, 2)))
+        if kind == 'WIFI_F':
+            return wifi_frames(self.sensor(device), self.access_points(device, self.rng.randint(3, 4)))
+        if kind == 'GNSS':
+            nav = self.rng.randbytes(self.rng.randint(NAV_FRAG_SIZE + 1, MAX_NAV_SIZE))
+            return gnss_frames(self.sensor(device), nav, self.rng.getrandbits(40))
+        if kind == 'CONFIG':
+            # Wi-Fi scans of 3 or 4 access points span 2 fragments, GNSS messages vary
+            return config_frames(settings_block(
+                self.rng.randrange(len(REPORTING_MODES)), self.rng.choice((60, 300, 900)), 2, 0,
+                self.rng.randrange(len(RESOLVE_POLICIES))))
+        raise ValueError(f'Unknown message kind {kind}')
+
+
+def generate(devices: int = 10000, uplinks: int = 100000, mix: Dict[str, float] = None,
+             loss: float = 0.0, duplicate: float = 0.0, reorder: float = 0.0, reorder_depth: int = 16,
+             rate: float = 1000.0, burst: float = 0.0, burst_size: int = 200, burst_speedup: float = 20.0,
+             seq_start: Optional[int] = None, motion: float = 0.3, seed: int = 1) -> Iterator[Arrival]:
+    """
+    Yields up to `uplinks` arrivals.
+
+    Args:
+    devices (int): Fleet size.
+    uplinks (int): Frames to generate, before loss and duplication.
+    mix (dict): Relative weights of NOLOC, WIFI (single frame), WIFI_F
+        (WIFI_F + WIFI_END), GNSS (GNSS + GNSS_F... + GNSS_END) and CONFIG messages.
+    loss (float): Probability a frame is dropped, its sequence number is still consumed.
+    duplicate (float): Probability a frame is delivered twice.
+    reorder (float): Probability a frame is held back behind up to `reorder_depth` later frames.
+    rate (float): Mean arrival rate in uplinks per second, arrivals are Poisson.
+    burst (float): Probability a message starts a burst of `burst_size` uplinks
+        arriving `burst_speedup` times faster.
+    seq_start (int): First sequence number of every device, random when None.
+    motion (float): Probability an uplink reports motion.
+    seed (int): Seed of the generator, traces are reproducible.
+    """
+    rng = random.Random(seed)
+    fleet = Fleet(devices, rng, seq_start, motion)
+    kinds, weights = zip(*(mix or DEFAULT_MIX).items())
+    held = []  # (release index, order, event) of reordered frames
+    emitted = 0
+    order = 0
+    clock = 0.0
+    burst_left = 0
+
+    def arrive():
+        nonlocal clock, burst_left
+        speedup = burst_speedup if burst_left > 0 else 1.0
+        burst_left -= 1
+        clock += rng.expovariate(rate * speedup)
+        return clock
+
+    while emitted < uplinks:
+        device = rng.randrange(devices)
+        if burst and burst_left <= 0 and rng.random() < burst:
+            burst_left = burst_size
+        devid = fleet.devid(device)
+        for frame in fleet.message(device, rng.choices(kinds, weights)[0]):
+            seq = fleet.next_seq(device)
+            emitted += 1
+            if rng.random() < loss:
+                continue
+            copies = 2 if rng.random() < duplicate else 1
+            for _ in range(copies):
+                event = envelope(devid, seq, frame)
+                if reorder and rng.random() < reorder:
+                    order += 1
+                    heapq.heappush(held, (emitted + rng.randint(1, reorder_depth), order, event))
+                else:
+                    yield Arrival(arrive(), event)
+            while held and held[0][0] <= emitted:
+                yield Arrival(arrive(), heapq.heappop(held)[2])
+            if emitted >= uplinks:
+                break
+    while held:
+        yield Arrival(arrive(), heapq.heappop(held)[2])
+
+
+def events(**kwargs) -> Iterator[Dict]:
+    """generate() without arrival times, e.g. for bench/replay.py."""
+    return (arrival.event for arrival in generate(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--uplinks', type=int, default=100000)
+    parser.add_argument('--mix', type=json.loads, help='message weights as JSON, e.g. \'{"NOLOC": 1, "GNSS": 1}\'')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--duplicate', type=float, default=0.0)
+    parser.add_argument('--reorder', type=float, default=0.0)
+    parser.add_argument('--reorder-depth', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=1000.0, help='mean uplinks per second')
+    parser.add_argument('--burst', type=float, default=0.0, help='probability a message starts a burst')
+    parser.add_argument('--burst-size', type=int, default=200)
+    parser.add_argument('--burst-speedup', type=float, default=20.0)
+    parser.add_argument('--seq-start', type=int, help='first sequence number of every device (default random)')
+    parser.add_argument('--motion', type=float, default=0.3, help='probability an uplink reports motion')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='JSON lines output file (default stdout)')
+    args = parser.parse_args()
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        for arrival in generate(args.devices, args.uplinks, args.mix, args.loss, args.duplicate, args.reorder,
+                                args.reorder_depth, args.rate, args.burst, args.burst_size, args.burst_speedup,
+                                args.seq_start, args.motion, args.seed):
+            out.write(json.dumps(dict(arrival.event, arrival=round(arrival.at, 6))) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
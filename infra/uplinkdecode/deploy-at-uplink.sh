@@ -10,8 +10,10 @@ aws s3 mb s3://$BUCKET_NAME --region $AWS_REGION
 # Upload the required artifacts for deployment and package the cloudformation template.
 aws cloudformation package --template template.yml --s3-bucket $BUCKET_NAME --output-template-file packaged-template.yaml
 
-# Deploy stack
-aws cloudformation deploy --template-file packaged-template.yaml --stack-name AssetTrackerUplinkDecode --capabilities CAPABILITY_NAMED_IAM --region $AWS_REGION
+# Deploy stack. Set GEOFENCE_EVENT_FUNCTION to the ARN of the backend's appsyncSendGeofenceEventFn
+# to route the geofence events of the decode function to it
+aws cloudformation deploy --template-file packaged-template.yaml --stack-name AssetTrackerUplinkDecode --capabilities CAPABILITY_NAMED_IAM --region $AWS_REGION \
+    ${GEOFENCE_EVENT_FUNCTION:+--parameter-overrides GeofenceEventFunctionArn=$GEOFENCE_EVENT_FUNCTION}
 
 #Display outputs
 aws cloudformation describe-stacks --stack-name AssetTrackerUplinkDecode --region $AWS_REGION --query "Stacks[0].Outputs"
@@ -0,0 +1,150 @@
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from at_common.instrumentation import metrics
+
+# Metres per degree of latitude, and of longitude at the equator
+METRES_PER_DEGREE = 111_320.0
+
+
+def rssi_weight(rss: float) -> float:
+    """Linear signal amplitude, a stronger access point is closer to the device."""
+    return 10 ** (rss / 20)
+
+
+class _AccessPoint:
+    __slots__ = ('weight', 'latitude', 'longitude', 'accuracy', 'observations')
+
+    def __init__(self):
+        self.weight = 0.0
+        self.latitude = 0.0
+        self.longitude = 0.0
+        self.accuracy = 0.0
+        self.observations = 0
+
+    def add(self, latitude: float, longitude: float, accuracy: float, weight: float):
+        """Moves the running weighted means towards one more observation."""
+        self.weight += weight
+        share = weight / self.weight
+        self.latitude += (latitude - self.latitude) * share
+        self.longitude += (longitude - self.longitude) * share
+        self.accuracy += (accuracy - self.accuracy) * share
+        self.observations += 1
+
+
+class AccessPointIndex:
+    """
+    Locations of Wi-Fi access points, used to solve scans in-process.
+
+    Every cloud solve of a scan teaches the index where the scanned access
+    points are: each one moves towards the solved position, weighted by its
+    RSSI. Known locations can also be seeded from a JSON lines file. A scan is
+    solved locally as the RSSI weighted centroid of its known access points
+    when at least `min_aps` of them are known and the estimated accuracy is
+    within `max_accuracy` metres, otherwise the cloud is asked. Estimates have
+    the shape of a GetPositionEstimate GeoJSON payload.
+
+    Kept at module level the index persists across warm invocations. It holds
+    up to `max_entries` access points, least recently seen first out;
+    max_entries=0 disables local solving.
+    """
+
+    def __init__(self, max_entries: int = 65536, min_aps: int = 2, max_accuracy: float = 100.0):
+        self.max_entries = max_entries
+        self.min_aps = min_aps
+        self.max_accuracy = max_accuracy
+        self.local = 0
+        self.remote = 0
+        self._entries: 'OrderedDict[str, _AccessPoint]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def learn(self, access_points: Iterable[Dict[str, Any]], location: Dict[str, Any]):
+        """Records the cloud solved `location` (GeoJSON payload) of a scan."""
+        if not self.max_entries:
+            return
+        longitude, latitude = location['coordinates'][:2]
+        accuracy = float(location.get('properties', {}).get('horizontalAccuracy') or self.max_accuracy)
+        with self._lock:
+            for ap in access_points:
+                self._add(ap['MacAddress'].lower(), latitude, longitude, accuracy, rssi_weight(ap['Rss']))
+
+    def seed(self, entries: Iterable[Dict[str, Any]], weight: float = 1.0):
+        """Adds known locations, entries being {'mac', 'latitude', 'longitude', 'accuracy'}."""
+        if not self.max_entries:
+            return
+        with self._lock:
+            for entry in entries:
+                self._add(entry['mac'].lower(), entry['latitude'], entry['longitude'],
+                          entry.get('accuracy', 0.0), weight)
+
+    def load(self, path: str):
+        """Seeds the index from a JSON lines file of seed() entries."""
+        with open(path) as f:
+            self.seed(json.loads(line) for line in f if line.strip())
+
+    def _add(self, mac: str, latitude: float, longitude: float, accuracy: float, weight: float):
+        entry = self._entries.get(mac)
+        if entry is None:
+            entry = self._entries[mac] = _AccessPoint()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(mac)
+        entry.add(latitude, longitude, accuracy, weight)
+
+    def estimate(self, access_points: Iterable[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Solves a scan from known access points.
+
+        Returns:
+        Optional[Dict[str, Any]]: A GeoJSON point with 'horizontalAccuracy' in
+        metres, or None when too few access points are known or the estimate
+        is not accurate enough.
+        """
+        with self._lock:
+            known = [(entry.latitude, entry.longitude, entry.accuracy, rssi_weight(ap['Rss']))
+                     for ap in access_points if (entry := self._entries.get(ap['MacAddress'].lower()))]
+        if len(known) < max(self.min_aps, 1):
+            return None
+
+        total = sum(weight for *_, weight in known)
+        latitude = sum(lat * weight for lat, _, _, weight in known) / total
+        longitude = sum(lon * weight for _, lon, _, weight in known) / total
+        # spread of the access points around the estimate, plus their own uncertainty
+        scale = math.cos(math.radians(latitude))
+        spread = math.sqrt(sum(
+            weight * ((lat - latitude) ** 2 + ((lon - longitude) * scale) ** 2)
+            for lat, lon, _, weight in known
+        ) / total) * METRES_PER_DEGREE
+        uncertainty = sum(accuracy * weight for _, _, accuracy, weight in known) / total
+        accuracy = math.hypot(spread, uncertainty)
+        if accuracy > self.max_accuracy:
+            return None
+        return {
+            'coordinates': [longitude, latitude],
+            'type': 'Point',
+            'properties': {'horizontalAccuracy': round(accuracy, 1), 'source': 'local'},
+        }
+
+    def get_or_solve(self, access_points: List[Dict[str, Any]], solve: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Returns the local estimate of a scan, or calls solve() and learns from its result."""
+        location = self.estimate(access_points)
+        if location is not None:
+            with self._lock:
+                self.local += 1
+            metrics.count('local_solve', uplink_type='WIFI')
+            return location
+        location = solve()
+        with self._lock:
+            self.remote += 1
+        self.learn(access_points, location)
+        return location
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'local': self.local, 'remote': self.remote}
@@ -0,0 +1,135 @@
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from at_common.frames import (
+    AccessPoint, Frame, FrameError, GnssInfo, LAYOUTS, Sensor,
+    decode_frame, frame_position,
+)
+
+# Smallest group worth handing to numpy, below that the struct codec is faster
+MIN_VECTOR_GROUP = 8
+
+# Fixed length layouts, keyed by (layout type, frame length). Filled on first
+# use: numpy is optional and slow to import, single uplink invocations never
+# need it. Empty when numpy is not installed, all frames are then decoded
+# one by one.
+DTYPES = {}
+np = None
+_numpy_loaded = False
+
+
+def _load_numpy():
+    global np, _numpy_loaded
+    if _numpy_loaded:
+        return
+    _numpy_loaded = True
+    try:
+        import numpy
+    except ImportError:
+        return
+    np = numpy
+    header = [('header', 'u1'), ('battery', 'u1'), ('temperature', 'i1'), ('humidity', 'u1'), ('accel', 'u1')]
+    wifi = np.dtype(header + [('rssi1', 'i1'), ('mac1', 'u1', (6,)), ('rssi2', 'i1'), ('mac2', 'u1', (6,))])
+    DTYPES.update({
+        ('NOLOC', 5): np.dtype(header),
+        ('WIFI', 19): wifi,
+        ('WIFI_F', 19): wifi,
+        ('GNSS', 12): np.dtype(header + [('nav_size', 'u1'), ('time_hi', '>u2'), ('time_lo', '>u4')]),
+    })
+
+
+def layout_type(data: bytes) -> str:
+    header = data[0]
+    uplink_t = (header & 0xC0) >> 6
+    return LAYOUTS[(uplink_t, frame_position(uplink_t, (header & 0x38) >> 3, header & 0x7))].type
+
+
+def _mac_column(macs) -> List[str]:
+    raw = memoryview(macs.tobytes())
+    return [raw[i:i + 6].hex(':') for i in range(0, len(raw), 6)]
+
+
+def decode_columns(key: Tuple[str, int], group: Sequence[bytes]):
+    """
+    Decodes a group of frames sharing one fixed length layout in a single pass.
+
+    Args:
+    key (Tuple[str, int]): Layout type and frame length, a key of DTYPES.
+    group (Sequence[bytes]): Raw frames, all of that layout and length.
+
+    Returns:
+    Dict[str, list]: One Python list per decoded column.
+    """
+    rows = np.frombuffer(b''.join(group), dtype=DTYPES[key])
+    accel = rows['accel']
+    columns = {
+        'num_msg': ((rows['header'] & 0x38) >> 3).tolist(),
+        'frag_num': (rows['header'] & 0x7).tolist(),
+        'battery': rows['battery'].tolist(),
+        'temperature': rows['temperature'].tolist(),
+        'humidity': rows['humidity'].tolist(),
+        'motion': (accel & 0x80).astype(bool).tolist(),
+        'max_accel': ((accel & 0x7F) / 10).tolist(),
+    }
+    if 'mac1' in rows.dtype.names:
+        columns['rssi1'] = rows['rssi1'].tolist()
+        columns['mac1'] = _mac_column(rows['mac1'])
+        columns['rssi2'] = rows['rssi2'].tolist()
+        columns['mac2'] = _mac_column(rows['mac2'])
+    if 'nav_size' in rows.dtype.names:
+        columns['nav_size'] = rows['nav_size'].tolist()
+        columns['capture_time'] = ((rows['time_hi'].astype(np.uint64) << 32) | rows['time_lo']).tolist()
+    return columns
+
+
+def _frames_from_columns(layout: str, columns, group: Sequence[bytes]) -> List[Frame]:
+    sensors = map(Sensor, columns['battery'], columns['temperature'], columns['humidity'],
+                  columns['motion'], columns['max_accel'])
+    n = len(group)
+    aps = [()] * n
+    gnss = [None] * n
+    if 'mac1' in columns:
+        aps = zip(map(AccessPoint, columns['mac1'], columns['rssi1']),
+                  map(AccessPoint, columns['mac2'], columns['rssi2']))
+    if 'nav_size' in columns:
+        gnss = map(GnssInfo, columns['nav_size'], columns['capture_time'])
+    return list(map(Frame, [layout] * n, columns['num_msg'], columns['frag_num'], sensors, aps, gnss, group))
+
+
+def decode_batch(payloads: Sequence[bytes]) -> List[object]:
+    """
+    Decodes a batch of raw frames, vectorizing homogeneous fixed length groups.
+
+    Variable length frames (WIFI_END, GNSS_F, GNSS_END) and small groups go
+    through decode_frame. The result is in input order and holds a Frame, or
+    the FrameError raised for that payload.
+    """
+    _load_numpy()
+    results: List[object] = [None] * len(payloads)
+    groups: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+    for i, data in enumerate(payloads):
+        if not data:
+            results[i] = FrameError('Empty frame')
+            continue
+        key = (layout_type(data), len(data))
+        if key in DTYPES:
+            groups[key].append(i)
+        else:
+            results[i] = _decode_one(data)
+
+    for key, indexes in groups.items():
+        group = [payloads[i] for i in indexes]
+        if len(group) < MIN_VECTOR_GROUP:
+            frames = [decode_frame(data) for data in group]
+        else:
+            frames = _frames_from_columns(key[0], decode_columns(key, group), group)
+        for i, frame in zip(indexes, frames):
+            results[i] = frame
+    return results
+
+
+def _decode_one(data: bytes):
+    try:
+        return decode_frame(data)
+    except FrameError as e:
+        return e
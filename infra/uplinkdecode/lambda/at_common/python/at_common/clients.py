@@ -0,0 +1,49 @@
+import os
+import threading
+
+# Size of the HTTP connection pool of every client, one per I/O worker thread
+MAX_POOL_CONNECTIONS = int(os.environ.get('IO_WORKERS', 16))
+# Position estimates are retried by at_common.resolver, retries of botocore
+# underneath would multiply the calls made while throttled
+CLIENT_CONFIG = {
+    'iotwireless': {'retries': {'total_max_attempts': 1}},
+}
+
+_clients = {}
+_lock = threading.Lock()
+_session = None
+
+
+def _boto3_session():
+    # boto3 is only imported once a client is needed, so it stays off the
+    # import path of handlers and of invocations that make no AWS call
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service: str):
+    """Returns the shared client for a service, creating it on first use. Clients are thread safe."""
+    client = _clients.get(service)
+    if client is None:
+        with _lock:
+            client = _clients.get(service)
+            if client is None:
+                from botocore.config import Config
+                config = Config(max_pool_connections=MAX_POOL_CONNECTIONS, **CLIENT_CONFIG.get(service, {}))
+                client = _boto3_session().client(service, config=config)
+                _clients[service] = client
+    return client
+
+
+def set_client(service: str, client):
+    """Overrides the client of a service, e.g. with a stub in benchmarks."""
+    _clients[service] = client
+
+
+def reset():
+    global _session
+    _clients.clear()
+    _session = None
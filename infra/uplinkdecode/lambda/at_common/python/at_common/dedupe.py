@@ -0,0 +1,240 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+from at_common.reassembly import SEQ_MODULUS
+
+
+class SequenceWindow:
+    """
+    Sequence numbers seen from one device, as a bitmap of the `size` numbers
+    up to the highest one seen.
+
+    Bit i of `bits` is set when `top - i` was seen. Numbers are compared
+    modulo `seq_modulus`, so the window slides across a wraparound: a number
+    less than half the modulus ahead of `top` moves the window forward.
+    Numbers further behind than the window are stale: whether they were seen
+    is unknown, and the window is left as it is, so one late duplicate
+    cannot make the numbers in the window look new again.
+    """
+
+    __slots__ = ('size', 'seq_modulus', 'top', 'bits')
+
+    def __init__(self, seq: int, size: int = 256, seq_modulus: int = SEQ_MODULUS):
+        self.size = size
+        self.seq_modulus = seq_modulus
+        self.top = seq
+        self.bits = 1
+
+    def add(self, seq: int) -> Optional[bool]:
+        """Records a sequence number, returns False when it was already seen, None when it is stale."""
+        ahead = (seq - self.top) % self.seq_modulus
+        if ahead == 0:
+            # the top number was seen unless it was discarded since
+            seen = self.bits & 1
+            self.bits |= 1
+            return not seen
+        if ahead < self.seq_modulus // 2:
+            self.bits = (self.bits << ahead | 1) & ((1 << self.size) - 1) if ahead < self.size else 1
+            self.top = seq
+            return True
+        behind = self.seq_modulus - ahead
+        if behind >= self.size:
+            return None
+        if self.bits >> behind & 1:
+            return False
+        self.bits |= 1 << behind
+        return True
+
+    def discard(self, seq: int):
+        behind = (self.top - seq) % self.seq_modulus
+        if behind < self.size:
+            self.bits &= ~(1 << behind)
+
+
+class DynamoDBSeqBackend:
+    """
+    Claims (device, sequence number) pairs with conditional writes, for
+    duplicates delivered to another container.
+
+    A claim is a lease that expires after `lease` seconds, about the
+    function timeout, so an uplink whose invocation times out or crashes
+    before releasing it is processed on retry. Once the uplink is processed
+    the claim is promoted to expire after `ttl` seconds. Items expire through
+    the table's TTL attribute 'expires'; an expired item not yet deleted by
+    DynamoDB counts as free.
+    """
+
+    def __init__(self, table_name: str = 'at-dedupe', ttl: int = 86400, lease: int = 60, client=None):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.lease = lease
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def claim(self, devid: str, seq: int) -> bool:
+        """Returns False when the pair was already claimed."""
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'WirelessDeviceId': {'S': devid},
+                    'seq': {'N': str(seq)},
+                    'expires': {'N': str(now + self.lease)},
+                },
+                ConditionExpression='attribute_not_exists(seq) OR expires < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}},
+            )
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def promote(self, devid: str, seq: int):
+        """Keeps the claim of a processed uplink for `ttl` seconds."""
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={'WirelessDeviceId': {'S': devid}, 'seq': {'N': str(seq)}},
+            UpdateExpression='SET expires = :expires',
+            ExpressionAttributeValues={':expires': {'N': str(int(time.time()) + self.ttl)}},
+        )
+
+    def release(self, devid: str, seq: int):
+        self.client.delete_item(
+            TableName=self.table_name,
+            Key={'WirelessDeviceId': {'S': devid}, 'seq': {'N': str(seq)}},
+        )
+
+
+class DuplicateFilter:
+    """
+    Drops uplinks whose sequence number was already processed.
+
+    Each device has a SequenceWindow in a bounded LRU kept across warm
+    invocations, so a duplicate reaching the same container is dropped
+    without any I/O. With a `backend`, numbers new to this container are
+    also claimed there (see DynamoDBSeqBackend) when confirm is set, which
+    catches duplicates delivered to other containers. Claims run on the
+    executor when one is given. A claim that errors lets the uplink through.
+    Stale numbers, further behind than the window, are let through, and
+    claimed in the backend when confirm is set.
+
+    Sequence numbers of uplinks that fail must be released, so the retry
+    is not dropped as a duplicate, and those of uplinks processed must be
+    completed, so their claims outlive the lease.
+    """
+
+    def __init__(self, window: int = 256, max_devices: int = 100000, backend=None, executor=None,
+                 seq_modulus: int = SEQ_MODULUS):
+        self.window = window
+        self.max_devices = max_devices
+        self.backend = backend
+        self.executor = executor
+        self.seq_modulus = seq_modulus
+        self.duplicates = 0
+        self.remote_duplicates = 0
+        self.stale = 0
+        self._windows: 'OrderedDict[str, SequenceWindow]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _add(self, devid: str, seq: int) -> Optional[bool]:
+        with self._lock:
+            window = self._windows.get(devid)
+            if window is None:
+                self._windows[devid] = SequenceWindow(seq, self.window, self.seq_modulus)
+                while len(self._windows) > self.max_devices:
+                    self._windows.popitem(last=False)
+                return True
+            self._windows.move_to_end(devid)
+            fresh = window.add(seq)
+            if fresh is None:
+                self.stale += 1
+            elif not fresh:
+                self.duplicates += 1
+            return fresh
+
+    def _claim(self, devid: str, seq: int) -> bool:
+        try:
+            with metrics.timer('dedupe_claim'):
+                claimed = self.backend.claim(devid, seq)
+        except Exception as e:
+            logger.warning('Unable to claim sequence number', devid=devid, seq=seq, error=str(e))
+            return True
+        if not claimed:
+            with self._lock:
+                self.remote_duplicates += 1
+        return claimed
+
+    def check_many(self, uplinks: Sequence[Tuple[str, int, bool]]) -> List[bool]:
+        """
+        Records (devid, seq, confirm) uplinks.
+
+        Returns:
+        List[bool]: Per uplink, False when it is a duplicate.
+        """
+        fresh = [self._add(devid, seq) for devid, seq, _ in uplinks]
+        if self.backend is None:
+            return [seen is not False for seen in fresh]
+        fresh = [seen is not False for seen in fresh]
+        claims = [i for i, (_, _, confirm) in enumerate(uplinks) if fresh[i] and confirm]
+        if self.executor is not None and len(claims) > 1:
+            results = list(self.executor.map(lambda i: self._claim(*uplinks[i][:2]), claims))
+        else:
+            results = [self._claim(*uplinks[i][:2]) for i in claims]
+        for i, claimed in zip(claims, results):
+            fresh[i] = claimed
+        return fresh
+
+    def check(self, devid: str, seq: int, confirm: bool = True) -> bool:
+        """Records an uplink, returns False when it is a duplicate."""
+        return self.check_many([(devid, seq, confirm)])[0]
+
+    def _promote(self, devid: str, seq: int):
+        try:
+            with metrics.timer('dedupe_promote'):
+                self.backend.promote(devid, seq)
+        except Exception as e:
+            # the lease expires and a later duplicate is processed again
+            logger.warning('Unable to promote sequence number', devid=devid, seq=seq, error=str(e))
+
+    def complete_many(self, uplinks: Sequence[Tuple[str, int, bool]]):
+        """Keeps the claims of (devid, seq, confirm) uplinks processed, checked before."""
+        if self.backend is None:
+            return
+        claims = [uplink[:2] for uplink in uplinks if uplink[2]]
+        if self.executor is not None and len(claims) > 1:
+            list(self.executor.map(lambda claim: self._promote(*claim), claims))
+        else:
+            for claim in claims:
+                self._promote(*claim)
+
+    def complete(self, devid: str, seq: int, confirmed: bool = True):
+        """Keeps the claim of an uplink processed."""
+        self.complete_many([(devid, seq, confirmed)])
+
+    def release(self, devid: str, seq: int, confirmed: bool = True):
+        """Forgets a sequence number whose uplink failed, so its retry gets through."""
+        with self._lock:
+            window = self._windows.get(devid)
+            if window is not None:
+                window.discard(seq)
+        if self.backend is not None and confirmed:
+            try:
+                self.backend.release(devid, seq)
+            except Exception as e:
+                logger.warning('Unable to release sequence number', devid=devid, seq=seq, error=str(e))
+
+    def stats(self) -> Dict[str, int]:
+        return {'devices': len(self._windows), 'duplicates': self.duplicates,
+                'remote_duplicates': self.remote_duplicates, 'stale': self.stale}
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from at_common.clients import get_client
+from at_common.frames import Settings
+from at_common.instrumentation import logger, metrics
+
+# Map attribute holding the settings in an at-config item, next to the device state
+CONFIG_ATTRIBUTE = 'config'
+# BatchGetItem accepts at most 100 keys per call
+MAX_KEYS = 100
+
+
+class DeviceConfig(NamedTuple):
+    reporting_mode: str = 'PERIODIC'
+    report_interval: int = 0             # s
+    wifi_fragments: int = 0              # 0 when not fixed
+    gnss_fragments: int = 0              # 0 when not fixed
+    resolve_policy: Optional[str] = None  # None follows DEVICE_STATE_POLICY
+    updated: Optional[int] = None        # ms, timestamp of the CONFIG uplink
+
+    @classmethod
+    def from_settings(cls, settings: Settings, timestamp: int) -> 'DeviceConfig':
+        return cls(*settings, updated=timestamp)
+
+    def expected_fragments(self, frame_type: str) -> int:
+        """Fragments a message of that frame type is configured to span, 0 when not fixed."""
+        return self.wifi_fragments if frame_type.startswith('WIFI') else self.gnss_fragments
+
+
+def encode_config(config: DeviceConfig) -> Dict:
+    fields = {}
+    for name, value in config._asdict().items():
+        if isinstance(value, str):
+            fields[name] = {'S': value}
+        elif value is not None:
+            fields[name] = {'N': str(value)}
+    return {'M': fields}
+
+
+def decode_config(value: Dict) -> DeviceConfig:
+    """Settings from the map attribute, fields missing in it keep their defaults."""
+    return DeviceConfig(**{
+        name: field['S'] if 'S' in field else int(field['N'])
+        for name, field in value['M'].items() if name in DeviceConfig._fields
+    })
+
+
+class LocalConfigBackend:
+    """In-memory stand-in for the at-config table, e.g. for benchmarks or without a table."""
+
+    def __init__(self):
+        self.configs: Dict[str, DeviceConfig] = {}
+        self._lock = threading.Lock()
+
+    def load_many(self, devids: Iterable[str]) -> Dict[str, DeviceConfig]:
+        with self._lock:
+            return {devid: self.configs[devid] for devid in devids if devid in self.configs}
+
+    def save(self, devid: str, config: DeviceConfig) -> bool:
+        with self._lock:
+            current = self.configs.get(devid)
+            if current is not None and current.updated is not None and current.updated >= config.updated:
+                return False
+            self.configs[devid] = config
+            return True
+
+
+class DynamoDBConfigBackend:
+    """
+    Keeps the settings as a map attribute of the device's at-config item.
+
+    Settings are read for many devices at once with BatchGetItem, projected
+    to that attribute. UpdateItem only sets it, the device state stored in
+    the same item is left alone, and only when the stored settings are older,
+    so a CONFIG uplink retried late does not undo a newer one.
+    """
+
+    def __init__(self, table_name: str = 'at-config', client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def load_many(self, devids: Iterable[str]) -> Dict[str, DeviceConfig]:
+        devids = list(devids)
+        configs = {}
+        for start in range(0, len(devids), MAX_KEYS):
+            request = {self.table_name: {
+                'Keys': [{'WirelessDeviceId': {'S': devid}} for devid in devids[start:start + MAX_KEYS]],
+                'ProjectionExpression': 'WirelessDeviceId, #c',
+                'ExpressionAttributeNames': {'#c': CONFIG_ATTRIBUTE},
+            }}
+            attempt = 0
+            while request:
+                with metrics.timer('config_get'):
+                    response = self.client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    if CONFIG_ATTRIBUTE in item:
+                        configs[item['WirelessDeviceId']['S']] = decode_config(item[CONFIG_ATTRIBUTE])
+                request = response.get('UnprocessedKeys') or None
+                if request:
+                    # throttled keys, back off before asking again
+                    attempt += 1
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        return configs
+
+    def save(self, devid: str, config: DeviceConfig) -> bool:
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'WirelessDeviceId': {'S': devid}},
+                UpdateExpression='SET #c = :c',
+                ConditionExpression='attribute_not_exists(#c.#u) OR #c.#u < :u',
+                ExpressionAttributeNames={'#c': CONFIG_ATTRIBUTE, '#u': 'updated'},
+                ExpressionAttributeValues={':c': encode_config(config), ':u': {'N': str(config.updated)}},
+            )
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+
+class DeviceConfigStore:
+    """
+    Settings of each device, cached in the warm container.
+
+    Settings are read for every located uplink, so a device's settings are
+    kept for `ttl` seconds once loaded, and the absence of settings, the
+    usual case for devices that never sent a CONFIG uplink, for
+    `negative_ttl` seconds. prefetch() loads the devices of a whole batch
+    missing from the cache with one backend call; get() loads a single
+    device on a miss. Settings of a CONFIG uplink are written through.
+    """
+
+    def __init__(self, backend, max_entries: int = 10000, ttl: float = 300.0, negative_ttl: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = self.misses = self.loads = 0
+        # devid -> (expires, settings or None)
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cached(self, devid: str, now: float):
+        """(True, settings) of a fresh cache entry, (False, None) otherwise. Called with the lock held."""
+        entry = self._entries.get(devid)
+        if entry is None or now >= entry[0]:
+            return False, None
+        self._entries.move_to_end(devid)
+        return True, entry[1]
+
+    def _cache(self, configs: Dict[str, Optional[DeviceConfig]], now: float):
+        with self._lock:
+            for devid, config in configs.items():
+                self._entries[devid] = (now + (self.ttl if config is not None else self.negative_ttl), config)
+                self._entries.move_to_end(devid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, devids, now: float) -> Dict[str, Optional[DeviceConfig]]:
+        with self._lock:
+            self.loads += 1
+        try:
+            loaded = self.backend.load_many(devids)
+        except Exception as e:
+            # the defaults apply until the next attempt, after negative_ttl
+            logger.warning('Unable to load device settings', devices=len(devids), error=str(e))
+            loaded = {}
+        configs = {devid: loaded.get(devid) for devid in devids}
+        self._cache(configs, now)
+        return configs
+
+    def get(self, devid: str) -> Optional[DeviceConfig]:
+        """The settings of a device, None when it has none."""
+        now = self.clock()
+        with self._lock:
+            found, config = self._cached(devid, now)
+            if found:
+                self.hits += 1
+                return config
+            self.misses += 1
+        return self._load([devid], now)[devid]
+
+    def prefetch(self, devids: Iterable[str]) -> int:
+        """Loads the settings of the devices not cached, returns how many were loaded."""
+        now = self.clock()
+        with self._lock:
+            missing = [devid for devid in dict.fromkeys(devids) if not self._cached(devid, now)[0]]
+        if missing:
+            self._load(missing, now)
+        return len(missing)
+
+    def update(self, devid: str, config: DeviceConfig) -> bool:
+        """
+        Stores the settings of a CONFIG uplink.
+
+        Returns:
+        bool: False when newer settings were stored already and nothing changed.
+        """
+        stored = self.backend.save(devid, config)
+        if stored:
+            self._cache({devid: config}, self.clock())
+        else:
+            # reread the newer settings on next use
+            with self._lock:
+                self._entries.pop(devid, None)
+        return stored
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'loads': self.loads}
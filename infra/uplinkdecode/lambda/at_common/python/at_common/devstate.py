@@ -0,0 +1,361 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, NamedTuple, Optional
+
+from at_common.clients import get_client
+from at_common.frames import Sensor
+from at_common.instrumentation import logger, metrics
+
+# Map attribute holding the state in an at-config item, next to the device settings
+STATE_ATTRIBUTE = 'state'
+# BatchGetItem accepts at most 100 keys per call
+MAX_KEYS = 100
+# Metres per degree of latitude, and of longitude at the equator
+METRES_PER_DEGREE = 111_320.0
+
+
+class DeviceState(NamedTuple):
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    accuracy: Optional[float] = None
+    fix_timestamp: Optional[int] = None    # ms, timestamp of the uplink the fix was solved for
+    battery: Optional[int] = None
+    motion: bool = False                    # motion bit of the last uplink
+    motion_timestamp: Optional[int] = None  # ms, last uplink reporting motion
+    geofences: FrozenSet[str] = frozenset()  # fences the last fix lies in (see at_common.geofence)
+
+    @property
+    def has_fix(self) -> bool:
+        return self.fix_timestamp is not None
+
+    @property
+    def moved(self) -> bool:
+        """Whether motion was reported after the last fix."""
+        return self.motion_timestamp is not None and (
+            self.fix_timestamp is None or self.motion_timestamp > self.fix_timestamp)
+
+    def location(self) -> Dict[str, Any]:
+        """The last fix as a GeoJSON payload, the shape GetPositionEstimate returns."""
+        return {
+            'coordinates': [self.longitude, self.latitude],
+            'type': 'Point',
+            'properties': {'horizontalAccuracy': self.accuracy},
+        }
+
+    def distance(self, other: 'DeviceState') -> float:
+        """Metres between the fixes of two states, equirectangular, which is plenty at fix distances."""
+        dx = (self.longitude - other.longitude) * math.cos(math.radians(self.latitude)) * METRES_PER_DEGREE
+        dy = (self.latitude - other.latitude) * METRES_PER_DEGREE
+        return math.hypot(dx, dy)
+
+
+def encode_state(state: DeviceState) -> Dict:
+    fields = {}
+    for name, value in state._asdict().items():
+        if isinstance(value, bool):
+            fields[name] = {'BOOL': value}
+        elif isinstance(value, frozenset):
+            # string sets cannot be empty
+            if value:
+                fields[name] = {'SS': sorted(value)}
+        elif value is not None:
+            fields[name] = {'N': str(value)}
+    return {'M': fields}
+
+
+def decode_state(value: Dict) -> DeviceState:
+    return DeviceState(**{
+        name: (float(field['N']) if name in ('latitude', 'longitude', 'accuracy') else int(field['N']))
+        if 'N' in field else frozenset(field['SS']) if 'SS' in field else field.get('BOOL')
+        for name, field in value['M'].items() if name in DeviceState._fields
+    })
+
+
+class LocalStateBackend:
+    """In-memory stand-in for the at-config table, e.g. for benchmarks or without a table."""
+
+    def __init__(self):
+        self.states: Dict[str, DeviceState] = {}
+        self._lock = threading.Lock()
+
+    def load(self, devid: str) -> Optional[DeviceState]:
+        with self._lock:
+            return self.states.get(devid)
+
+    def load_many(self, devids: Iterable[str]) -> Dict[str, DeviceState]:
+        with self._lock:
+            return {devid: self.states[devid] for devid in devids if devid in self.states}
+
+    def save(self, devid: str, state: DeviceState):
+        with self._lock:
+            self.states[devid] = state
+
+
+class DynamoDBStateBackend:
+    """
+    Keeps the state as a map attribute of the device's at-config item.
+
+    UpdateItem only sets that attribute, the device settings stored in the
+    same item are left alone. States of many devices are read at once with
+    BatchGetItem, projected to that attribute.
+    """
+
+    def __init__(self, table_name: str = 'at-config', client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def load(self, devid: str) -> Optional[DeviceState]:
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'WirelessDeviceId': {'S': devid}},
+            ProjectionExpression='#s',
+            ExpressionAttributeNames={'#s': STATE_ATTRIBUTE},
+        )
+        state = response.get('Item', {}).get(STATE_ATTRIBUTE)
+        return decode_state(state) if state else None
+
+    def load_many(self, devids: Iterable[str]) -> Dict[str, DeviceState]:
+        devids = list(devids)
+        states = {}
+        for start in range(0, len(devids), MAX_KEYS):
+            request = {self.table_name: {
+                'Keys': [{'WirelessDeviceId': {'S': devid}} for devid in devids[start:start + MAX_KEYS]],
+                'ProjectionExpression': 'WirelessDeviceId, #s',
+                'ExpressionAttributeNames': {'#s': STATE_ATTRIBUTE},
+            }}
+            attempt = 0
+            while request:
+                with metrics.timer('state_get'):
+                    response = self.client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    if STATE_ATTRIBUTE in item:
+                        states[item['WirelessDeviceId']['S']] = decode_state(item[STATE_ATTRIBUTE])
+                request = response.get('UnprocessedKeys') or None
+                if request:
+                    # throttled keys, back off before asking again
+                    attempt += 1
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        return states
+
+    def save(self, devid: str, state: DeviceState):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={'WirelessDeviceId': {'S': devid}},
+            UpdateExpression='SET #s = :s',
+            ExpressionAttributeNames={'#s': STATE_ATTRIBUTE},
+            ExpressionAttributeValues={':s': encode_state(state)},
+        )
+
+
+class DeviceStateStore:
+    """
+    Last position, battery and motion of each device, cached in the warm container.
+
+    A device's state is loaded from the backend on first use and kept for `ttl`
+    seconds, so containers pick up fixes solved elsewhere; prefetch() loads
+    the devices of a whole batch with one backend call. Changes are written
+    by flush(), once per invocation, and only when other containers would
+    act on them: a device starts moving, the fences change, a first fix, a
+    fix away from the stored one by more than their accuracy, or a fix with
+    the stored one older than half of `max_fix_age`. The newer fixes of a
+    device standing still stay in the cache. Backend writes so scale with
+    movement rather than with the uplink rate.
+
+    With policy 'motion' a position solve is skipped while the device has not
+    reported motion since its last fix and the fix is younger than
+    `max_fix_age` seconds; the last fix is reused instead. Policy 'always'
+    solves every uplink.
+    """
+
+    def __init__(self, backend, max_entries: int = 10000, ttl: float = 300.0, policy: str = 'motion',
+                 max_fix_age: float = 3600.0, clock: Callable[[], float] = time.monotonic, executor=None):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policy = policy
+        self.max_fix_age = max_fix_age
+        self.clock = clock
+        self.executor = executor
+        self.reused = 0
+        self.solved = 0
+        self.writes = 0
+        # devid -> (load time, state, state as stored in the backend)
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        # devids whose state changed materially since it was stored
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _fresh(self, devid: str, now: float):
+        """The entry of a device loaded less than `ttl` ago or not written yet. Called with the lock held."""
+        entry = self._entries.get(devid)
+        if entry is None or (now - entry[0] > self.ttl and devid not in self._dirty):
+            return None
+        self._entries.move_to_end(devid)
+        return entry
+
+    def get(self, devid: str) -> DeviceState:
+        now = self.clock()
+        with self._lock:
+            entry = self._fresh(devid, now)
+            if entry is not None:
+                return entry[1]
+        try:
+            state = self.backend.load(devid) or DeviceState()
+        except Exception as e:
+            # without the stored state the device is simply solved again
+            logger.warning('Unable to load device state', devid=devid, error=str(e))
+            state = DeviceState()
+        self._loaded({devid: state}, now)
+        return state
+
+    def prefetch(self, devids: Iterable[str]) -> int:
+        """Loads the states of the devices not cached, returns how many were loaded."""
+        now = self.clock()
+        with self._lock:
+            missing = [devid for devid in dict.fromkeys(devids) if self._fresh(devid, now) is None]
+        if not missing:
+            return 0
+        try:
+            loaded = self.backend.load_many(missing)
+        except Exception as e:
+            # get() loads them one by one instead
+            logger.warning('Unable to load device states', devices=len(missing), error=str(e))
+            return 0
+        self._loaded({devid: loaded.get(devid) or DeviceState() for devid in missing}, now)
+        return len(missing)
+
+    def _loaded(self, states: Dict[str, DeviceState], now: float):
+        with self._lock:
+            for devid, state in states.items():
+                if devid in self._dirty:
+                    # a change not written yet is newer than the stored state
+                    continue
+                self._entries[devid] = (now, state, state)
+                self._entries.move_to_end(devid)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            devid, _ = self._entries.popitem(last=False)
+            self._dirty.discard(devid)
+
+    def _material(self, stored: DeviceState, state: DeviceState) -> bool:
+        """Whether a change must be written for other containers to act on it."""
+        if (state.moved and not stored.moved) or state.geofences != stored.geofences:
+            return True
+        if state.fix_timestamp == stored.fix_timestamp:
+            return False
+        if not stored.has_fix or not state.has_fix:
+            return True
+        # timestamps are in ms, so half of max_fix_age
+        if state.fix_timestamp - stored.fix_timestamp > self.max_fix_age * 500:
+            return True
+        return state.distance(stored) > max(state.accuracy or 0, stored.accuracy or 0)
+
+    def _update(self, devid: str, change: Callable[[DeviceState], Optional[DeviceState]]) -> Optional[DeviceState]:
+        """
+        Caches the state `change` makes of the device's current state, keeping
+        its load time so it is still reloaded after `ttl`. `change` runs with
+        the lock held, so concurrent changes of a device are not lost, and
+        returns None to leave the state as it is.
+        """
+        state = self.get(devid)
+        with self._lock:
+            entry = self._entries.get(devid)
+            loaded, state, stored = entry if entry is not None else (self.clock(), state, DeviceState())
+            updated = change(state)
+            if updated is None:
+                return None
+            self._entries[devid] = (loaded, updated, stored)
+            self._entries.move_to_end(devid)
+            if self._material(stored, updated):
+                self._dirty.add(devid)
+            self._evict()
+        return updated
+
+    def flush(self) -> int:
+        """Writes the states changed materially since they were stored, returns how many were written."""
+        with self._lock:
+            dirty = [(devid, self._entries[devid][1]) for devid in self._dirty]
+            self._dirty.clear()
+        if not dirty:
+            return 0
+        if self.executor is not None and len(dirty) > 1:
+            written = sum(self.executor.map(lambda change: self._write(*change), dirty))
+        else:
+            written = sum(self._write(devid, state) for devid, state in dirty)
+        with self._lock:
+            self.writes += written
+        return written
+
+    def _write(self, devid: str, state: DeviceState) -> bool:
+        try:
+            with metrics.timer('state_save'):
+                self.backend.save(devid, state)
+        except Exception as e:
+            logger.warning('Unable to save device state', devid=devid, error=str(e))
+            return False
+        with self._lock:
+            entry = self._entries.get(devid)
+            if entry is not None:
+                self._entries[devid] = (entry[0], entry[1], state)
+        return True
+
+    def observe(self, devid: str, timestamp: int, sensor: Sensor) -> DeviceState:
+        """Records the sensor block of an uplink at `timestamp` (ms)."""
+        def change(state: DeviceState) -> DeviceState:
+            updated = state._replace(battery=sensor.battery, motion=sensor.motion)
+            if sensor.motion and (state.motion_timestamp is None or timestamp > state.motion_timestamp):
+                updated = updated._replace(motion_timestamp=timestamp)
+            return updated
+
+        return self._update(devid, change)
+
+    def reusable_fix(self, devid: str, timestamp: int, policy: Optional[str] = None) -> Optional[DeviceState]:
+        """
+        Returns the state when its last fix can stand in for a solve of an
+        uplink at `timestamp` (ms), otherwise None. `policy` overrides the
+        store's policy, e.g. with the device's own setting.
+        """
+        if (policy or self.policy) != 'motion':
+            return None
+        state = self.get(devid)
+        if not state.has_fix or state.moved or timestamp - state.fix_timestamp > self.max_fix_age * 1000:
+            return None
+        with self._lock:
+            self.reused += 1
+        return state
+
+    def record_fix(self, devid: str, timestamp: int, location: Dict[str, Any],
+                   geofences: Optional[FrozenSet[str]] = None) -> bool:
+        """
+        Stores a solved position (tracker payload) as the device's last fix,
+        with the fences it lies in when given.
+
+        Returns:
+        bool: False when the device already has a newer fix and nothing was stored.
+        """
+        def change(state: DeviceState) -> Optional[DeviceState]:
+            if state.has_fix and state.fix_timestamp > timestamp:
+                return None
+            # the lock is held
+            self.solved += 1
+            updated = state._replace(
+                latitude=location['latitude'], longitude=location['longitude'],
+                accuracy=location.get('accuracy', {}).get('horizontal'), fix_timestamp=timestamp,
+            )
+            return updated._replace(geofences=geofences) if geofences is not None else updated
+
+        return self._update(devid, change) is not None
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'reused': self.reused, 'solved': self.solved, 'writes': self.writes}
@@ -0,0 +1,116 @@
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import metrics
+from at_common.items import FRAGMENT_BUCKET_MS, FRAGMENT_KEY_ATTRIBUTE, PayloadRecord, decode_image
+from at_common.reassembly import SEQ_MODULUS
+
+FRAGMENT_INDEX = 'fragments'
+# Attributes decode_item() reads, in either item format; 'location' is left out
+FRAGMENT_ATTRIBUTES = (
+    'WirelessDeviceId', 'timestamp', 'seq', 'type', 'v', 'f',
+    'frag cnt', 'battery', 'temperature', 'humidity', 'motion', 'max accel',
+    'wifidata', 'nav msg size', 'capture time', 'nav frag',
+)
+# BatchGetItem accepts at most 100 keys per call
+MAX_KEYS = 100
+
+
+def seq_ranges(first_seq: int, last_seq: int) -> List[Tuple[int, int]]:
+    """Inclusive seq ranges from first_seq to last_seq, split at the wraparound."""
+    if first_seq <= last_seq:
+        return [(first_seq, last_seq)]
+    return [(first_seq, SEQ_MODULUS - 1), (0, last_seq)]
+
+
+class FragmentStore:
+    """
+    Reads the fragments of a message from at-payloads by key.
+
+    The sparse 'fragments' index (WirelessDeviceId, fragkey) addresses a
+    device's fragment items by time bucket and seq (see
+    at_common.items.fragment_key), so a message is found with one key range
+    per bucket it may span, independent of how many other uplinks the device
+    sent. The index only projects keys; the items are then read from the
+    table with consistent reads and a projection of the attributes
+    decode_item() needs. Queries and batch reads are paginated.
+
+    The index itself is eventually consistent. When fewer fragments than
+    expected are found, the query is repeated once after `retry_delay`
+    seconds.
+    """
+
+    def __init__(self, table_name: str = 'at-payloads', index_name: str = FRAGMENT_INDEX, retry_delay: float = 0.2,
+                 client=None):
+        self.table_name = table_name
+        self.index_name = index_name
+        self.retry_delay = retry_delay
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def fetch(self, end: PayloadRecord) -> List[PayloadRecord]:
+        """
+        Returns the fragments of the message `end` (its END item) completes,
+        `end` included, in seq order from the first fragment on, across the
+        wraparound.
+        """
+        count = end.frame.num_msg
+        first_seq = (end.seq - count + 1) % SEQ_MODULUS
+        keys = self.fragment_keys(end.devid, end.timestamp, first_seq, end.seq)
+        if len(keys) < count and self.retry_delay:
+            time.sleep(self.retry_delay)
+            keys = self.fragment_keys(end.devid, end.timestamp, first_seq, end.seq)
+        return sorted(self.get_items(keys), key=lambda item: (item.seq - first_seq) % SEQ_MODULUS)
+
+    def fragment_keys(self, devid: str, timestamp: int, first_seq: int, last_seq: int) -> List[Dict]:
+        """Table keys of the fragment items of a device with a seq in [first_seq, last_seq]."""
+        bucket = timestamp // FRAGMENT_BUCKET_MS
+        keys = []
+        # fragments reach back at most one bucket from the END item
+        for b in (bucket - 1, bucket):
+            for low, high in seq_ranges(first_seq, last_seq):
+                keys.extend(self._query(devid, b * SEQ_MODULUS + low, b * SEQ_MODULUS + high))
+        return keys
+
+    def _query(self, devid: str, low: int, high: int) -> Iterable[Dict]:
+        kwargs = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': 'WirelessDeviceId = :d AND #k BETWEEN :low AND :high',
+            'ExpressionAttributeNames': {'#k': FRAGMENT_KEY_ATTRIBUTE},
+            'ExpressionAttributeValues': {':d': {'S': devid}, ':low': {'N': str(low)}, ':high': {'N': str(high)}},
+        }
+        while True:
+            with metrics.timer('fragment_query'):
+                response = self.client.query(**kwargs)
+            for item in response.get('Items', []):
+                yield {'WirelessDeviceId': item['WirelessDeviceId'], 'timestamp': item['timestamp']}
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def get_items(self, keys: List[Dict]) -> List[PayloadRecord]:
+        names = {f'#a{i}': name for i, name in enumerate(FRAGMENT_ATTRIBUTES)}
+        items = []
+        for start in range(0, len(keys), MAX_KEYS):
+            request = {self.table_name: {
+                'Keys': keys[start:start + MAX_KEYS],
+                'ConsistentRead': True,
+                'ProjectionExpression': ', '.join(names),
+                'ExpressionAttributeNames': names,
+            }}
+            attempt = 0
+            while request:
+                with metrics.timer('fragment_get'):
+                    response = self.client.batch_get_item(RequestItems=request)
+                items.extend(response.get('Responses', {}).get(self.table_name, []))
+                request = response.get('UnprocessedKeys') or None
+                if request:
+                    # throttled keys, back off before asking again
+                    attempt += 1
+                    time.sleep(min(0.05 * 2 ** attempt, 1.0))
+        return [decode_image(item) for item in items]
@@ -0,0 +1,177 @@
+import binascii
+import os
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+# Uplink type codes, carried in the top two bits of the first frame byte
+CONFIG, NOLOC, WIFI, GNSS = range(4)
+UPLINK_TYPES = ["CONFIG", "NOLOC", "WIFI", "GNSS"]
+
+# Fixed-size blocks of the asset tracker frame format
+SENSOR = struct.Struct('>BbBB')    # battery, temperature, humidity, motion|max accel
+AP_RECORD = struct.Struct('>b6s')  # rssi, mac
+GNSS_INFO = struct.Struct('>BHI')  # nav msg size, capture time (48 bit, big endian)
+# Settings block of a CONFIG frame: reporting mode, report interval (s), Wi-Fi / GNSS fragments,
+# resolve policy. Assumed layout, not taken from a firmware specification; the firmware in
+# service sends a bare CONFIG header, check this against the firmware that adds the block
+CONFIG_BLOCK = struct.Struct('>BHBBB')
+# The block is only decoded with CONFIG_SETTINGS=1, otherwise every CONFIG frame
+# is taken as a bare header and changes no settings
+CONFIG_SETTINGS = int(os.environ.get('CONFIG_SETTINGS', 0))
+
+GNSS_LAST_FRAG = 0x7
+
+# Codes of the settings in the CONFIG block, assumed like its layout
+REPORTING_MODES = ('PERIODIC', 'MOTION', 'ON_DEMAND')
+RESOLVE_POLICIES = (None, 'motion', 'always')  # None follows DEVICE_STATE_POLICY
+
+
+class Sensor(NamedTuple):
+    battery: int
+    temperature: int
+    humidity: int
+    motion: bool
+    max_accel: float
+
+
+class AccessPoint(NamedTuple):
+    mac: str
+    rssi: int
+
+    def to_api(self):
+        return {'MacAddress': self.mac, 'Rss': self.rssi}
+
+
+class GnssInfo(NamedTuple):
+    nav_size: int
+    capture_time: int
+
+
+class Settings(NamedTuple):
+    reporting_mode: str
+    report_interval: int  # s
+    wifi_fragments: int   # fragments of a Wi-Fi scan, 0 when not fixed
+    gnss_fragments: int   # fragments of a GNSS message, 0 when not fixed
+    resolve_policy: Optional[str]
+
+
+class FrameLayout(NamedTuple):
+    """Describes which blocks follow the header byte, in order."""
+    type: str
+    sensor: bool = False
+    aps: bool = False
+    gnss: bool = False
+    nav: bool = False
+    settings: bool = False
+
+
+class Frame(NamedTuple):
+    type: str
+    num_msg: int
+    frag_num: int
+    sensor: Optional[Sensor]
+    aps: Tuple[AccessPoint, ...]
+    gnss: Optional[GnssInfo]
+    data: bytes
+    settings: Optional[Settings] = None  # None for a bare CONFIG header or CONFIG_SETTINGS off
+
+    @property
+    def nav_frag(self) -> str:
+        """Hex encoded NAV message fragment carried after the header byte."""
+        return memoryview(self.data)[1:].hex()
+
+    def wifi_data(self):
+        return [ap.to_api() for ap in self.aps]
+
+
+# Position of a frame within a (possibly fragmented) message
+SINGLE, FIRST, MIDDLE, LAST = range(4)
+
+LAYOUTS = {
+    (CONFIG, SINGLE): FrameLayout('CONFIG', settings=True),
+    (NOLOC, SINGLE): FrameLayout('NOLOC', sensor=True),
+    (WIFI, SINGLE): FrameLayout('WIFI', sensor=True, aps=True),
+    (WIFI, FIRST): FrameLayout('WIFI_F', sensor=True, aps=True),
+    (WIFI, LAST): FrameLayout('WIFI_END', aps=True),
+    (GNSS, FIRST): FrameLayout('GNSS', sensor=True, gnss=True),
+    (GNSS, MIDDLE): FrameLayout('GNSS_F', nav=True),
+    (GNSS, LAST): FrameLayout('GNSS_END', nav=True),
+}
+
+
+class FrameError(ValueError):
+    pass
+
+
+def decode_payload(data: str) -> bytes:
+    """
+    Decodes the PayloadData of an uplink into the raw frame bytes.
+
+    Sidewalk delivers the frame as base64 encoded ASCII hex, both layers are
+    undone on bytes without building an intermediate string. A missing or
+    non-string PayloadData is a malformed payload too.
+    """
+    try:
+        return binascii.a2b_hex(binascii.a2b_base64(data))
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise FrameError(f'Malformed payload: {e}') from e
+
+
+def frame_position(uplink_t: int, num_msg: int, frag_num: int) -> int:
+    if uplink_t == WIFI:
+        if num_msg == 1:
+            return SINGLE
+        return FIRST if frag_num == 0 else LAST
+    if uplink_t == GNSS:
+        if frag_num == 0:
+            return FIRST
+        return LAST if frag_num == GNSS_LAST_FRAG else MIDDLE
+    return SINGLE
+
+
+def decode_frame(data: bytes) -> Frame:
+    """
+    Decodes a raw frame using the layout registered for its header.
+
+    Args:
+    data (bytes): Raw frame bytes, as returned by decode_payload.
+
+    Returns:
+    Frame: The decoded frame. Blocks not present in the layout are None/empty.
+    """
+    if not data:
+        raise FrameError('Empty frame')
+    view = memoryview(data)
+    header = view[0]
+    uplink_t = (header & 0xC0) >> 6
+    num_msg = (header & 0x38) >> 3
+    frag_num = header & 0x7
+    layout = LAYOUTS[(uplink_t, frame_position(uplink_t, num_msg, frag_num))]
+
+    offset = 1
+    sensor = gnss = settings = None
+    aps = ()
+    try:
+        if layout.sensor:
+            batt, temp, hum, accel = SENSOR.unpack_from(view, offset)
+            sensor = Sensor(batt, temp, hum, bool(accel & 0x80), (accel & 0x7F) / 10)
+            offset += SENSOR.size
+        if layout.aps:
+            end = offset + (len(view) - offset) // AP_RECORD.size * AP_RECORD.size
+            aps = tuple(AccessPoint(mac.hex(':'), rssi) for rssi, mac in AP_RECORD.iter_unpack(view[offset:end]))
+            if not aps:
+                raise FrameError(f'{layout.type} frame carries no access points')
+        if layout.gnss:
+            nav_size, time_hi, time_lo = GNSS_INFO.unpack_from(view, offset)
+            gnss = GnssInfo(nav_size, (time_hi << 32) | time_lo)
+        # firmware before the settings block sends a bare CONFIG header, decoded with
+        # settings None so the settings stored for the device stay as they are
+        if layout.settings and CONFIG_SETTINGS and len(view) > offset:
+            mode, interval, wifi_frags, gnss_frags, policy = CONFIG_BLOCK.unpack_from(view, offset)
+            settings = Settings(REPORTING_MODES[mode], interval, wifi_frags, gnss_frags, RESOLVE_POLICIES[policy])
+    except struct.error as e:
+        raise FrameError(f'Truncated {layout.type} frame: {e}') from e
+    except IndexError as e:
+        raise FrameError(f'Unknown setting in {layout.type} frame') from e
+
+    return Frame(layout.type, num_msg, frag_num, sensor, aps, gnss, data, settings)
@@ -0,0 +1,265 @@
+import json
+import math
+import threading
+import time
+from concurrent.futures import wait
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+
+# Metres per degree of latitude, and of longitude at the equator
+METRES_PER_DEGREE = 111_320.0
+# Fences covering more grid cells are checked on every lookup instead
+MAX_CELLS = 4096
+# PutEvents accepts at most 10 entries per call
+MAX_EVENTS = 10
+# Same detail type and detail as the Amazon Location events, so the
+# appsync-send-geofence-event function handles them unchanged. Rules on the
+# aws.geo source do not match them, template.yml routes the events of
+# GeofenceEventPublisher's source with UplinkGeofenceEventRule
+DETAIL_TYPE = 'Location Geofence Event'
+
+
+class _Polygon:
+    __slots__ = ('rings',)
+
+    def __init__(self, rings: List[List[List[float]]]):
+        # first ring is the exterior, the others are holes
+        self.rings = [tuple((float(x), float(y)) for x, y in ring) for ring in rings]
+
+    def bbox(self) -> Tuple[float, float, float, float]:
+        xs = [x for x, _ in self.rings[0]]
+        ys = [y for _, y in self.rings[0]]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def contains(self, x: float, y: float) -> bool:
+        # even-odd ray casting over every ring, a point in a hole crosses twice as often
+        inside = False
+        for ring in self.rings:
+            x1, y1 = ring[-1]
+            for x2, y2 in ring:
+                if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                    inside = not inside
+                x1, y1 = x2, y2
+        return inside
+
+
+class _Circle:
+    __slots__ = ('x', 'y', 'radius', 'scale')
+
+    def __init__(self, center: List[float], radius: float):
+        self.x, self.y = float(center[0]), float(center[1])
+        self.radius = float(radius)
+        self.scale = math.cos(math.radians(self.y))
+
+    def bbox(self) -> Tuple[float, float, float, float]:
+        dy = self.radius / METRES_PER_DEGREE
+        dx = dy / max(self.scale, 1e-6)
+        return self.x - dx, self.y - dy, self.x + dx, self.y + dy
+
+    def contains(self, x: float, y: float) -> bool:
+        dx = (x - self.x) * self.scale * METRES_PER_DEGREE
+        dy = (y - self.y) * METRES_PER_DEGREE
+        return dx * dx + dy * dy <= self.radius * self.radius
+
+
+def parse_geometry(geometry: Dict[str, Any]):
+    """
+    Reads a geofence geometry as ListGeofences returns it, {'Polygon': [rings]}
+    or {'Circle': {'Center': [lng, lat], 'Radius': m}}. The lower case keys
+    of the frontend's Geo API are accepted as well.
+    """
+    geometry = {key.lower(): value for key, value in geometry.items()}
+    if geometry.get('polygon'):
+        return _Polygon(geometry['polygon'])
+    if geometry.get('circle'):
+        circle = {key.lower(): value for key, value in geometry['circle'].items()}
+        return _Circle(circle['center'], circle['radius'])
+    raise ValueError(f'Unsupported geofence geometry {list(geometry)}')
+
+
+class GeofenceIndex:
+    """
+    Polygon and circle geofences in a uniform grid of `cell_size` degrees.
+
+    A fence is registered in every cell its bounding box touches, so a
+    lookup only tests the fences of the point's cell: a bounding box check,
+    then the exact polygon or circle test. Fences spanning more than
+    MAX_CELLS cells are tested on every lookup.
+
+    With a `source`, e.g. list_geofences() of a collection, the fences are
+    reloaded every `ttl` seconds so containers pick up fences drawn in the
+    frontend. A failed reload keeps the current fences.
+    """
+
+    def __init__(self, cell_size: float = 0.01, source: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None,
+                 ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.cell_size = cell_size
+        self.source = source
+        self.ttl = ttl
+        self.clock = clock
+        self.lookups = 0
+        self._fences: Dict[str, Tuple[Tuple[float, float, float, float], Any]] = {}
+        self._cells: Dict[Tuple[int, int], List[str]] = {}
+        self._large: List[str] = []
+        self._loaded: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fences)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def load(self, entries: Iterable[Dict[str, Any]]):
+        """Replaces the fences with `entries`, {'GeofenceId', 'Geometry'} dicts."""
+        fences, cells, large = {}, {}, []
+        for entry in entries:
+            try:
+                shape = parse_geometry(entry['Geometry'])
+            except (KeyError, ValueError) as e:
+                logger.warning('Skipping geofence', geofence=entry.get('GeofenceId'), error=str(e))
+                continue
+            fence_id = entry['GeofenceId']
+            bbox = shape.bbox()
+            fences[fence_id] = (bbox, shape)
+            (x0, y0), (x1, y1) = self._cell(bbox[0], bbox[1]), self._cell(bbox[2], bbox[3])
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS:
+                large.append(fence_id)
+                continue
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.setdefault((cx, cy), []).append(fence_id)
+        with self._lock:
+            self._fences, self._cells, self._large = fences, cells, large
+            self._loaded = self.clock()
+
+    def load_file(self, path: str):
+        """Loads the fences from a JSON lines file of load() entries."""
+        with open(path) as f:
+            self.load(json.loads(line) for line in f if line.strip())
+
+    def _refresh(self):
+        if self.source is None or (self._loaded is not None and self.clock() - self._loaded <= self.ttl):
+            return
+        try:
+            with metrics.timer('geofence_load'):
+                self.load(self.source())
+        except Exception as e:
+            logger.warning('Unable to load geofences', error=str(e))
+            with self._lock:
+                self._loaded = self.clock()
+
+    def containing(self, longitude: float, latitude: float) -> FrozenSet[str]:
+        """Ids of the fences the point lies in."""
+        self._refresh()
+        with self._lock:
+            fences = self._fences
+            candidates = self._cells.get(self._cell(longitude, latitude), []) + self._large
+            self.lookups += 1
+        inside = set()
+        for fence_id in candidates:
+            (x0, y0, x1, y1), shape = fences[fence_id]
+            if x0 <= longitude <= x1 and y0 <= latitude <= y1 and shape.contains(longitude, latitude):
+                inside.add(fence_id)
+        return frozenset(inside)
+
+    def stats(self) -> Dict[str, int]:
+        return {'fences': len(self._fences), 'cells': len(self._cells), 'large': len(self._large),
+                'lookups': self.lookups}
+
+
+def list_geofences(collection_name: str, client=None) -> List[Dict[str, Any]]:
+    """Every ACTIVE geofence of an Amazon Location collection."""
+    client = client or get_client('location')
+    entries = []
+    kwargs = {'CollectionName': collection_name}
+    while True:
+        response = client.list_geofences(**kwargs)
+        entries.extend(entry for entry in response['Entries'] if entry.get('Status', 'ACTIVE') == 'ACTIVE')
+        if not response.get('NextToken'):
+            return entries
+        kwargs['NextToken'] = response['NextToken']
+
+
+def transitions(devid: str, previous: FrozenSet[str], current: FrozenSet[str], longitude: float, latitude: float,
+                timestamp: int) -> List[Dict[str, Any]]:
+    """ENTER / EXIT events between two sets of fences, with the Amazon Location event detail shape."""
+    sample_time = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).isoformat()
+    return [{
+        'EventType': event_type,
+        'GeofenceId': fence_id,
+        'DeviceId': devid,
+        'SampleTime': sample_time,
+        'Position': [longitude, latitude],
+    } for event_type, fences in (('EXIT', previous - current), ('ENTER', current - previous))
+        for fence_id in sorted(fences)]
+
+
+class GeofenceEventPublisher:
+    """
+    Sends geofence events to EventBridge, up to MAX_EVENTS per PutEvents call.
+
+    Like at_common.publisher.PositionPublisher, events are buffered and sent
+    once a call is full or on flush(), in the background with an executor.
+    Failed events are logged and counted; the uplink is not retried for them
+    as the device's fences are already recorded.
+    """
+
+    def __init__(self, client, source: str = 'asset-tracker.uplink', event_bus: str = 'default', executor=None):
+        self._client = client
+        self.source = source
+        self.event_bus = event_bus
+        self.executor = executor
+        self._buffer: List[Dict[str, Any]] = []
+        self._inflight = []
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_client('events')
+
+    def add(self, event: Dict[str, Any]):
+        with self._lock:
+            self._buffer.append(event)
+            if len(self._buffer) < MAX_EVENTS:
+                return
+            chunk, self._buffer = self._buffer, []
+        self._dispatch(chunk)
+
+    def flush(self):
+        with self._lock:
+            chunk, self._buffer = self._buffer, []
+        if chunk:
+            self._dispatch(chunk)
+        with self._lock:
+            inflight, self._inflight = self._inflight, []
+        wait(inflight)
+
+    def _dispatch(self, chunk):
+        if self.executor is None:
+            self._put(chunk)
+            return
+        future = self.executor.submit(self._put, chunk)
+        with self._lock:
+            self._inflight.append(future)
+
+    def _put(self, chunk):
+        entries = [{
+            'Source': self.source,
+            'DetailType': DETAIL_TYPE,
+            'Detail': json.dumps(event),
+            'EventBusName': self.event_bus,
+        } for event in chunk]
+        try:
+            with metrics.timer('put_events'):
+                response = self.client.put_events(Entries=entries)
+            failed = response.get('FailedEntryCount', 0)
+        except Exception as e:
+            logger.error('Error sending geofence events', events=len(chunk), error=str(e))
+            failed = len(chunk)
+        metrics.count('geofence_events', len(chunk) - failed)
+        if failed:
+            metrics.count('geofence_events_failed', failed)
@@ -0,0 +1,206 @@
+import functools
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+SERVICE_NAME = 'asset-tracker-uplink'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AssetTracker/Uplink')
+
+EMF_MAX_VALUES = 100
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+
+class Logger:
+    """
+    Level-gated structured logger writing one JSON object per line.
+
+    Fields are only serialized when the level is enabled, so debug logging of
+    whole events and frames costs nothing with LOG_LEVEL=INFO.
+    """
+
+    def __init__(self, service: str, level: str = 'INFO', stream=None):
+        self.service = service
+        self.level = LEVELS.get(level.upper(), LEVELS['INFO'])
+        self.stream = stream
+
+    def enabled(self, level: str) -> bool:
+        return LEVELS[level] >= self.level
+
+    def _log(self, level: str, message: str, fields):
+        if LEVELS[level] < self.level:
+            return
+        record = {'level': level, 'service': self.service, 'message': message, **fields}
+        print(json.dumps(record, default=str), file=self.stream or sys.stdout)
+
+    def debug(self, message: str, **fields):
+        self._log('DEBUG', message, fields)
+
+    def info(self, message: str, **fields):
+        self._log('INFO', message, fields)
+
+    def warning(self, message: str, **fields):
+        self._log('WARNING', message, fields)
+
+    def error(self, message: str, **fields):
+        self._log('ERROR', message, fields)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Metrics:
+    """
+    Collects per-stage latencies and counters, emitted as CloudWatch embedded
+    metric format (EMF) records.
+
+    Latencies are grouped by stage and uplink type. flush() writes one EMF
+    record per group carrying all samples as a Values/Counts distribution,
+    so CloudWatch can compute percentiles, plus locally computed p50/p95/p99.
+    """
+
+    def __init__(self, namespace: str, service: str, stream=None, clock=time.perf_counter):
+        self.namespace = namespace
+        self.service = service
+        self.stream = stream
+        self.clock = clock
+        self._latencies: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self._counters: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, stage: str, millis: float, uplink_type: str = 'ALL'):
+        with self._lock:
+            self._latencies[(stage, uplink_type)].append(millis)
+
+    def count(self, name: str, value: int = 1, uplink_type: str = 'ALL'):
+        with self._lock:
+            self._counters[(name, uplink_type)] += value
+
+    @contextmanager
+    def timer(self, stage: str, uplink_type: str = 'ALL'):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(stage, (self.clock() - start) * 1000, uplink_type)
+
+    def summary(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """Latency count and percentiles in ms per (stage, uplink type), without resetting."""
+        with self._lock:
+            latencies = {key: sorted(values) for key, values in self._latencies.items()}
+        return {
+            key: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+            }
+            for key, values in latencies.items()
+        }
+
+    def flush_if_due(self, interval: float):
+        """Flushes when `interval` seconds passed since the last flush, aggregating across warm invocations."""
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            latencies, self._latencies = self._latencies, defaultdict(list)
+            counters, self._counters = self._counters, defaultdict(int)
+        timestamp = int(time.time() * 1000)
+        out = self.stream or sys.stdout
+
+        for (stage, uplink_type), values in latencies.items():
+            values.sort()
+            distribution = defaultdict(int)
+            for value in values:
+                distribution[round(value, 2)] += 1
+            buckets = list(distribution.items())
+            # EMF accepts at most 100 distinct values per metric and record
+            for i in range(0, len(buckets), EMF_MAX_VALUES):
+                chunk = buckets[i:i + EMF_MAX_VALUES]
+                record = self._envelope(timestamp, ['Stage', 'UplinkType'], 'Latency', 'Milliseconds')
+                record.update({
+                    'Stage': stage,
+                    'UplinkType': uplink_type,
+                    'Latency': {'Values': [v for v, _ in chunk], 'Counts': [c for _, c in chunk]},
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'p99': percentile(values, 99),
+                })
+                print(json.dumps(record), file=out)
+
+        for (name, uplink_type), value in counters.items():
+            record = self._envelope(timestamp, ['UplinkType'], name, 'Count')
+            record.update({'UplinkType': uplink_type, name: value})
+            print(json.dumps(record), file=out)
+
+    def _envelope(self, timestamp: int, dimensions: List[str], metric: str, unit: str):
+        return {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service'] + dimensions],
+                    'Metrics': [{'Name': metric, 'Unit': unit}],
+                }],
+            },
+            'Service': self.service,
+        }
+
+
+logger = Logger(SERVICE_NAME, os.environ.get('LOG_LEVEL', 'INFO'))
+metrics = Metrics(METRICS_NAMESPACE, SERVICE_NAME)
+
+
+def profiled(handler=None, sample_rate: Optional[float] = None, top: int = 25):
+    """
+    Decorates a Lambda handler to flush metrics and to run a sampled share of
+    invocations under cProfile.
+
+    The sample rate defaults to the PROFILE_SAMPLE_RATE environment variable
+    (0 disables profiling). Profiles are logged as the `top` entries sorted by
+    cumulative time. Metrics are flushed after every invocation, a frozen or
+    recycled container would lose whatever it held back. Long-running
+    callers, e.g. the uplink service, set METRICS_FLUSH_INTERVAL to flush at
+    most every that many seconds instead.
+    """
+    if handler is None:
+        return functools.partial(profiled, sample_rate=sample_rate, top=top)
+    rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0)) if sample_rate is None else sample_rate
+    flush_interval = float(os.environ.get('METRICS_FLUSH_INTERVAL', 0))
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            if rate <= 0 or random.random() >= rate:
+                return handler(event, context)
+            # only sampled invocations pay for importing the profiler
+            import cProfile
+            import pstats
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(handler, event, context)
+            finally:
+                report = io.StringIO()
+                pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(top)
+                logger.info('Profile', handler=handler.__name__, profile=report.getvalue())
+        finally:
+            metrics.flush_if_due(flush_interval)
+
+    return wrapper
@@ -0,0 +1,175 @@
+import ast
+import base64
+import json
+import os
+from decimal import Decimal
+from typing import Any, Dict, NamedTuple, Optional
+
+from at_common.frames import CONFIG, GNSS, GNSS_LAST_FRAG, NOLOC, WIFI, AccessPoint, Frame, GnssInfo, Sensor, \
+    decode_frame
+from at_common.reassembly import FRAGMENT_TYPES, SEQ_MODULUS
+
+# Format of at-payloads items:
+#   0  legacy, every decoded field as its own attribute ('max accel',
+#      'wifidata' as JSON, 'location' as str() of a dict, ...)
+#   1  compact, the raw frame as a single binary attribute next to the key
+#      and index attributes, 'location' as JSON
+LEGACY, COMPACT = 0, 1
+ITEM_FORMAT = int(os.environ.get('ITEM_FORMAT', COMPACT))
+
+VERSION_ATTRIBUTE = 'v'
+FRAME_ATTRIBUTE = 'f'
+
+# Fragment items carry 'fragkey', the sort key of the sparse 'fragments'
+# index: the 5 minute bucket of the item's timestamp and its seq, so the
+# fragments of a message are addressed as a seq range (see at_common.fragments)
+FRAGMENT_KEY_ATTRIBUTE = 'fragkey'
+FRAGMENT_BUCKET_MS = 300_000
+
+# Header of the frame a legacy item was decoded from. Legacy items do not
+# record the fragment number of a GNSS_F frame, fragments are ordered by seq.
+_LEGACY_HEADERS = {
+    'CONFIG': (CONFIG, 0),
+    'NOLOC': (NOLOC, 0),
+    'WIFI': (WIFI, 0),
+    'WIFI_F': (WIFI, 0),
+    'WIFI_END': (WIFI, 1),
+    'GNSS': (GNSS, 0),
+    'GNSS_F': (GNSS, 1),
+    'GNSS_END': (GNSS, GNSS_LAST_FRAG),
+}
+
+
+def fragment_key(timestamp: int, seq: int) -> int:
+    return timestamp // FRAGMENT_BUCKET_MS * SEQ_MODULUS + seq
+
+
+class PayloadRecord(NamedTuple):
+    """An at-payloads item, in either format."""
+    devid: str
+    timestamp: int
+    seq: int
+    frame: Frame
+    location: Optional[Dict[str, Any]]
+    version: int
+
+
+def encode_item(devid: str, timestamp: int, seq: int, frame: Frame, location: Optional[Dict] = None,
+                version: int = ITEM_FORMAT) -> Dict[str, Dict]:
+    """
+    Builds the at-payloads item of a decoded frame, in DynamoDB attribute value format.
+
+    'type' and 'seq' are kept as plain attributes in every format, the defrag
+    stream filter selects on them. Fragments also get 'fragkey', the key of
+    the 'fragments' index. 'location' is only present once the position was
+    resolved.
+    """
+    if version == LEGACY:
+        item = _encode_legacy(devid, timestamp, seq, frame, location)
+    else:
+        item = _encode_compact(devid, timestamp, seq, frame, location, version)
+    if frame.type in FRAGMENT_TYPES:
+        item[FRAGMENT_KEY_ATTRIBUTE] = {'N': str(fragment_key(timestamp, seq))}
+    return item
+
+
+def _encode_compact(devid, timestamp, seq, frame: Frame, location, version):
+    item = {
+        'WirelessDeviceId': {'S': devid},
+        'timestamp': {'N': str(timestamp)},
+        'seq': {'N': str(seq)},
+        'type': {'S': frame.type},
+        VERSION_ATTRIBUTE: {'N': str(version)},
+        FRAME_ATTRIBUTE: {'B': bytes(frame.data)},
+    }
+    if location:
+        item['location'] = encode_location(location, version)
+    return item
+
+
+def _encode_legacy(devid, timestamp, seq, frame: Frame, location=None):
+    item = {
+        'WirelessDeviceId': {'S': devid},
+        'timestamp': {'N': str(timestamp)},
+        'seq': {'N': str(seq)},
+        'type': {'S': frame.type},
+    }
+    if frame.type != "NOLOC":
+        item['frag cnt'] = {'N': str(frame.num_msg)}
+    if frame.sensor:
+        item['battery'] = {'N': str(frame.sensor.battery)}
+        item['temperature'] = {'N': str(frame.sensor.temperature)}
+        item['humidity'] = {'N': str(frame.sensor.humidity)}
+        item['motion'] = {'S': str(frame.sensor.motion)}
+        item['max accel'] = {'N': str(frame.sensor.max_accel)}
+    if frame.aps:
+        item['wifidata'] = {'S': json.dumps(frame.wifi_data())}
+    if frame.gnss:
+        item['nav msg size'] = {'N': str(frame.gnss.nav_size)}
+        item['capture time'] = {'N': str(frame.gnss.capture_time)}
+    if frame.type in ("GNSS_F", "GNSS_END"):
+        item['nav frag'] = {'S': frame.nav_frag}
+    if location:
+        item['location'] = encode_location(location, LEGACY)
+    return item
+
+
+def encode_location(location: Dict[str, Any], version: int = ITEM_FORMAT) -> Dict[str, str]:
+    """The 'location' attribute of an item in the given format."""
+    if version == LEGACY:
+        return {'S': str(location)}
+    return {'S': json.dumps(location, separators=(',', ':'))}
+
+
+def decode_item(item: Dict[str, Any]) -> PayloadRecord:
+    """
+    Reads an item as returned by a Table resource (numbers as Decimal, binary
+    as bytes or boto3 Binary), in either format.
+    """
+    version = int(item.get(VERSION_ATTRIBUTE, LEGACY))
+    if version == LEGACY:
+        frame = _decode_legacy_frame(item)
+    else:
+        data = item[FRAME_ATTRIBUTE]
+        frame = decode_frame(bytes(getattr(data, 'value', data)))
+    location = item.get('location')
+    if location is not None:
+        location = json.loads(location) if version != LEGACY else ast.literal_eval(location)
+    return PayloadRecord(item['WirelessDeviceId'], int(item['timestamp']), int(item['seq']), frame, location,
+                         version)
+
+
+def decode_image(image: Dict[str, Dict]) -> PayloadRecord:
+    """Reads the NewImage of a stream record, in either format."""
+    return decode_item({name: _attribute_value(value) for name, value in image.items()})
+
+
+def _attribute_value(value: Dict[str, Any]):
+    (kind, raw), = value.items()
+    if kind == 'N':
+        return Decimal(raw)
+    if kind == 'B':
+        # stream events carry binary values base64 encoded
+        return base64.b64decode(raw) if isinstance(raw, str) else raw
+    return raw
+
+
+def _decode_legacy_frame(item: Dict[str, Any]) -> Frame:
+    # the raw bytes are gone, data only carries the header and nav fragment
+    frame_type = item['type']
+    uplink_t, frag_num = _LEGACY_HEADERS[frame_type]
+    num_msg = int(item.get('frag cnt', 1))
+    data = bytes([uplink_t << 6 | (num_msg & 0x7) << 3 | frag_num])
+    if 'nav frag' in item:
+        data += bytes.fromhex(item['nav frag'])
+
+    sensor = gnss = None
+    if 'battery' in item:
+        sensor = Sensor(int(item['battery']), int(item['temperature']), int(item['humidity']),
+                        item['motion'] == 'True', float(item['max accel']))
+    aps = ()
+    if 'wifidata' in item:
+        aps = tuple(AccessPoint(ap['MacAddress'], ap['Rss']) for ap in json.loads(item['wifidata']))
+    if 'nav msg size' in item:
+        gnss = GnssInfo(int(item['nav msg size']), int(item['capture time']))
+    return Frame(frame_type, num_msg, frag_num, sensor, aps, gnss, data)
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+
+class PositionCache:
+    """
+    Bounded LRU cache of position estimates with a TTL, keyed on Wi-Fi scans.
+
+    Kept at module level it persists across warm invocations. A scan is keyed
+    on its sorted MAC set with each RSSI bucketed, so repeated scans of a
+    parked asset map to the same solve.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, rssi_bucket: int = 10,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.rssi_bucket = rssi_bucket
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[Tuple, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def scan_key(self, access_points: Iterable[Dict[str, Any]]) -> Tuple:
+        """Normalizes a list of {'MacAddress', 'Rss'} entries into a cache key."""
+        return tuple(sorted(
+            (ap['MacAddress'].lower(), int(ap['Rss']) // self.rssi_bucket) for ap in access_points
+        ))
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.clock() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Tuple, value: Any):
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_solve(self, access_points: Iterable[Dict[str, Any]], solve: Callable[[], Any]) -> Any:
+        """Returns the cached estimate for a scan, or calls solve() and caches its result."""
+        key = self.scan_key(access_points)
+        value = self.get(key)
+        if value is None:
+            value = solve()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+        }
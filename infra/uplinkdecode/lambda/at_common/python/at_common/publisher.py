@@ -0,0 +1,95 @@
+import json
+import threading
+from concurrent.futures import wait
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+
+# BatchUpdateDevicePosition accepts at most 10 updates per call
+MAX_POSITIONS = 10
+
+
+class PositionPublisher:
+    """
+    Coalesces tracker positions into IoT messages of up to `batch_size` positions.
+
+    Positions are published as {"positions": [...]} envelopes, which the
+    decoder-function forwards to the tracker in a single
+    BatchUpdateDevicePosition call. A message is sent once `batch_size`
+    positions are buffered or when flush() is called at the end of an
+    invocation or batch. With batch_size=1 every position is published on its
+    own, without an envelope. Each position can carry a tag, e.g. the record
+    it came from, flush() returns the tags of positions that failed to
+    publish. With an executor, messages are sent in the background.
+    """
+
+    def __init__(self, client, topic: str, batch_size: int = MAX_POSITIONS, qos: int = 0, executor=None):
+        self._client = client
+        self.topic = topic
+        self.batch_size = max(1, min(batch_size, MAX_POSITIONS))
+        self.qos = qos
+        self.executor = executor
+        self._buffer: List[Tuple[Dict[str, Any], Optional[Hashable]]] = []
+        self.failed: List[Hashable] = []
+        self._inflight = []
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_client('iot-data')
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, position: Dict[str, Any], tag: Optional[Hashable] = None):
+        with self._lock:
+            self._buffer.append((position, tag))
+            if len(self._buffer) < self.batch_size:
+                return
+            chunk, self._buffer = self._buffer, []
+        self._dispatch(chunk)
+
+    def flush(self) -> List[Hashable]:
+        """
+        Publishes every buffered position.
+
+        Returns:
+        List[Hashable]: Tags of the positions that could not be published,
+        across all messages since the last flush. The list is reset by this call.
+        """
+        with self._lock:
+            chunk, self._buffer = self._buffer, []
+        if chunk:
+            self._dispatch(chunk)
+        with self._lock:
+            inflight, self._inflight = self._inflight, []
+        wait(inflight)
+        with self._lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def _dispatch(self, chunk):
+        if self.executor is None:
+            self._publish(chunk)
+            return
+        future = self.executor.submit(self._publish, chunk)
+        with self._lock:
+            self._inflight.append(future)
+
+    def _publish(self, chunk):
+        positions = [position for position, _ in chunk]
+        payload = positions[0] if self.batch_size == 1 else {'positions': positions}
+        try:
+            with metrics.timer('publish'):
+                response = self.client.publish(topic=self.topic, qos=self.qos, payload=json.dumps(payload))
+            metrics.count('positions_published', len(positions))
+            logger.debug('IoT Data response', positions=len(positions), response=response)
+        except Exception as e:
+            logger.error('Error publishing positions', topic=self.topic, positions=len(positions), error=str(e))
+            with self._lock:
+                self.failed.extend(tag for _, tag in chunk)
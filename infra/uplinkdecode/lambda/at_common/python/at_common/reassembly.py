@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from at_common.frames import GNSS_LAST_FRAG, Frame
+
+# Sidewalk sequence numbers wrap around at this value
+SEQ_MODULUS = 1 << 16
+
+FRAGMENT_TYPES = {
+    'WIFI_F': 'WIFI',
+    'WIFI_END': 'WIFI',
+    'GNSS': 'GNSS',
+    'GNSS_F': 'GNSS',
+    'GNSS_END': 'GNSS',
+}
+
+
+def fragment_index(frame: Frame) -> int:
+    """Position of a fragment within its message, 0 being the first fragment."""
+    if frame.frag_num == GNSS_LAST_FRAG and frame.type == 'GNSS_END':
+        return frame.num_msg - 1
+    return frame.frag_num
+
+
+class Reassembled(NamedTuple):
+    devid: str
+    kind: str
+    first_seq: int
+    frames: Tuple[Frame, ...]
+    timestamps: Tuple[int, ...]
+
+    @property
+    def first_timestamp(self) -> int:
+        return self.timestamps[0]
+
+    @property
+    def sensor(self):
+        return self.frames[0].sensor
+
+    def wifi_data(self) -> List[Dict]:
+        return [ap.to_api() for frame in self.frames for ap in frame.aps]
+
+    def nav_msg(self) -> str:
+        return ''.join(frame.nav_frag for frame in self.frames[1:])
+
+    @property
+    def capture_time(self) -> int:
+        return self.frames[0].gnss.capture_time
+
+
+class _Pending:
+    __slots__ = ('kind', 'count', 'frames', 'timestamps', 'received', 'created', 'handed_off')
+
+    def __init__(self, kind: str, count: int, created: float):
+        self.kind = kind
+        self.count = count
+        self.frames: List[Optional[Frame]] = [None] * count
+        self.timestamps: List[Optional[int]] = [None] * count
+        self.received = 0
+        self.created = created
+        # the END fragment arrived first, the message is the defrag function's
+        self.handed_off = False
+
+
+class FragmentBuffer:
+    """
+    Reassembles fragmented WIFI and GNSS messages inside the decoder.
+
+    Pending messages are keyed by device and the sequence number of their
+    first fragment, derived from the fragment index and 'frag cnt'. Fragments
+    may arrive in any order and across a sequence wraparound; a message
+    completes when its received count reaches 'frag cnt'. Partial messages are
+    dropped after `window` seconds, or oldest first once `max_pending` is hit.
+    Fragments that landed on another container never complete here, those
+    messages are left to the defrag function. So are messages whose END
+    fragment arrived before the others: the decoder wrote it without a
+    location, which hands the message to the defrag function, and solving
+    it here as well would publish the position twice.
+    """
+
+    def __init__(self, max_pending: int = 4096, window: float = 300.0,
+                 seq_modulus: int = SEQ_MODULUS, clock=time.monotonic):
+        self.max_pending = max_pending
+        self.window = window
+        self.seq_modulus = seq_modulus
+        self.clock = clock
+        self.completed = 0
+        self.expired = 0
+        self.handed_off = 0
+        self._pending: 'OrderedDict[Tuple[str, int], _Pending]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, devid: str, seq: int, timestamp: int, frame: Frame) -> Optional[Reassembled]:
+        """
+        Buffers a fragment.
+
+        Returns:
+        Optional[Reassembled]: The complete message if this fragment finished
+        it, otherwise None, also for a message handed to the defrag function.
+        """
+        kind = FRAGMENT_TYPES.get(frame.type)
+        count = frame.num_msg
+        index = fragment_index(frame)
+        if kind is None or count < 2 or index >= count:
+            return None
+        first_seq = (seq - index) % self.seq_modulus
+        key = (devid, first_seq)
+        now = self.clock()
+
+        with self._lock:
+            self._expire(now)
+            pending = self._pending.get(key)
+            if pending is None or pending.kind != kind or pending.count != count:
+                pending = _Pending(kind, count, now)
+                self._pending[key] = pending
+                if len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+                    self.expired += 1
+            if pending.frames[index] is not None:
+                return None
+            pending.frames[index] = frame
+            pending.timestamps[index] = timestamp
+            pending.received += 1
+            if pending.received < pending.count:
+                pending.handed_off |= index == count - 1
+                return None
+            del self._pending[key]
+            if pending.handed_off:
+                self.handed_off += 1
+                return None
+            self.completed += 1
+
+        return Reassembled(devid, kind, first_seq, tuple(pending.frames), tuple(pending.timestamps))
+
+    def _expire(self, now: float):
+        while self._pending:
+            key, pending = next(iter(self._pending.items()))
+            if now - pending.created <= self.window:
+                break
+            del self._pending[key]
+            self.expired += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': len(self._pending), 'completed': self.completed, 'expired': self.expired,
+                'handed_off': self.handed_off}
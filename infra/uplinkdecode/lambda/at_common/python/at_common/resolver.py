@@ -0,0 +1,281 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+
+# Error codes of a request rejected for exceeding the account's quota
+THROTTLING_CODES = frozenset({
+    'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded',
+})
+
+
+class ResolverUnavailable(Exception):
+    """The position could not be resolved now: the circuit is open, or throttling persisted."""
+
+
+def error_kind(e: Exception) -> str:
+    """'throttled', 'server' for errors worth retrying, 'client' for the others."""
+    response = getattr(e, 'response', None)
+    if response is None:
+        # connection errors and timeouts
+        return 'server'
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if code in THROTTLING_CODES or status == 429:
+        return 'throttled'
+    return 'server' if status >= 500 else 'client'
+
+
+def remaining_time(context, margin: float = 0.0) -> Optional[float]:
+    """Seconds left of a Lambda invocation less `margin`, None without a context, e.g. in benchmarks."""
+    if context is None:
+        return None
+    return context.get_remaining_time_in_millis() / 1000 - margin
+
+
+class TokenBucket:
+    """
+    Paces calls to `rate` per second with bursts of up to `burst` calls.
+
+    The rate adapts to the quota actually granted: every throttled call
+    cuts it by `decrease`, every successful call raises it by `increase`
+    of `max_rate` again, so containers sharing an account quota settle just
+    below it instead of all retrying at full speed.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, min_rate: float = 0.5, decrease: float = 0.7,
+                 increase: float = 0.02, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # takes a token, possibly one not refilled yet, and returns how long to wait for it
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(-self._tokens / self.rate, 0.0)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Waits for a token, returns False without taking one if that takes longer than `timeout`."""
+        wait = self._reserve()
+        if timeout is not None and wait > timeout:
+            with self._lock:
+                self._tokens += 1
+            return False
+        if wait:
+            self.sleep(wait)
+        return True
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.increase)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service.
+
+    After `threshold` consecutive failures the circuit opens and calls are
+    refused for `reset_timeout` seconds. Then a single probe call is let
+    through (half open): its success closes the circuit, its failure opens
+    it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """Gives back a call allowed but not made, e.g. the probe of a half open circuit."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info('Circuit closed')
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                if self.state == self.CLOSED:
+                    logger.warning('Circuit opened', failures=self.failures)
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+                self.opened += 1
+
+
+class PositionResolver:
+    """
+    Calls get_position_estimate of AWS IoT Wireless within its quota.
+
+    Calls are paced by a TokenBucket. Throttled calls and server errors are
+    retried up to `max_attempts` times with full jitter exponential backoff,
+    starting at `base_delay` and capped at `max_delay` seconds. Calls that
+    still fail count against a CircuitBreaker. While the circuit is open, or
+    when no token is available within `max_wait` seconds, ResolverUnavailable
+    is raised right away, and callers defer the solve (see
+    DeferredSolveQueue) rather than fail. Other errors are raised as is.
+
+    Handlers set a deadline, the invocation's remaining time less a margin
+    (see set_deadline), which caps the waits for a token and the backoffs;
+    a solve that does not fit it is refused the same way instead of timing
+    out the invocation.
+
+    The limits apply per container; RESOLVER_RATE is the container's share
+    of the account's quota.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: float = 10.0, max_attempts: int = 4, base_delay: float = 0.1,
+                 max_delay: float = 2.0, max_wait: float = 5.0, breaker: Optional[CircuitBreaker] = None,
+                 client=None, rng: Optional[random.Random] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline: Optional[float] = None
+        self.calls = self.throttled = self.retries = self.refused = 0
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_client('iotwireless')
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def set_deadline(self, seconds: Optional[float]):
+        """Refuses solves after `seconds` from now, None lifts the deadline."""
+        self.deadline = None if seconds is None else self.clock() + seconds
+
+    def _remaining(self) -> float:
+        return float('inf') if self.deadline is None else self.deadline - self.clock()
+
+    def estimate(self, **request) -> Dict[str, Any]:
+        """Returns the GeoJSON position of a get_position_estimate request."""
+        if not self.breaker.allow():
+            self._count('refused')
+            metrics.count('resolver_refused')
+            raise ResolverUnavailable('Circuit open')
+        error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._count('retries')
+                self.sleep(max(0.0, min(self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)),
+                                        self._remaining())))
+            remaining = self._remaining()
+            if remaining <= 0 or not self.bucket.acquire(min(self.max_wait, remaining)):
+                # a saturated container, or an invocation running out of time, defers instead of queueing up calls
+                if error is None:
+                    self.breaker.release()
+                else:
+                    self.breaker.record_failure()
+                self._count('refused')
+                metrics.count('resolver_refused')
+                raise ResolverUnavailable('Out of time' if remaining <= 0 else 'Rate limited') from error
+            self._count('calls')
+            try:
+                response = self.client.get_position_estimate(**request)
+                location = json.loads(response['GeoJsonPayload'].read())
+            except Exception as e:
+                kind = error_kind(e)
+                if kind == 'client':
+                    self.breaker.record_success()
+                    raise
+                if kind == 'throttled':
+                    self._count('throttled')
+                    metrics.count('resolver_throttled')
+                    self.bucket.throttled()
+                error = e
+                continue
+            self.bucket.succeeded()
+            self.breaker.record_success()
+            return location
+        self.breaker.record_failure()
+        logger.warning('Position estimate failed', attempts=self.max_attempts, error=str(error))
+        raise ResolverUnavailable(str(error)) from error
+
+    def stats(self) -> Dict[str, Any]:
+        return {'calls': self.calls, 'throttled': self.throttled, 'retries': self.retries, 'refused': self.refused,
+                'rate': round(self.bucket.rate, 2), 'circuit': self.breaker.state, 'opened': self.breaker.opened}
+
+
+class DeferredSolveQueue:
+    """
+    SQS queue of solves deferred while the resolver was unavailable.
+
+    A message holds the at-payloads key of the uplink ('devid', 'timestamp',
+    'seq'), the solve ('kind' WIFI with the access points or GNSS with the
+    nav message and capture time in 'args'), 'location_timestamp' and
+    'battery' of the position to publish, and either the END 'frame' (hex)
+    of an item not written yet, or the 'version' of an item already written
+    without its location. Messages become visible after `delay` seconds,
+    around when the circuit half opens again.
+    """
+
+    def __init__(self, queue_url: str, delay: int = 30, client=None):
+        self.queue_url = queue_url
+        self.delay = delay
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('sqs')
+
+    def defer(self, message: Dict[str, Any]):
+        with metrics.timer('defer_solve'):
+            self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message, separators=(',', ':')),
+                                     DelaySeconds=self.delay)
+        metrics.count('solve_deferred', uplink_type=message['kind'])
@@ -0,0 +1,365 @@
+import math
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+
+# Sensor fields aggregated per bucket
+METRICS = ('battery', 'temperature', 'humidity', 'max_accel')
+
+# Bucket width in ms per resolution
+RESOLUTIONS = {
+    'hour': 3_600_000,
+    'day': 86_400_000,
+}
+
+# Samples up to this far (ms) behind the newest sample applied are still added
+LATENESS = 3_600_000
+
+# version, resolution, buckets, watermark, horizon, recent timestamps
+_HEADER = struct.Struct('<BqIqqI')
+_FORMAT_VERSION = 2
+
+
+class Stats(NamedTuple):
+    min: float
+    max: float
+    mean: float
+    last: float
+
+
+class Bucket(NamedTuple):
+    start: int          # ms, inclusive
+    count: int
+    stats: Dict[str, Stats]
+
+
+class Sample(NamedTuple):
+    timestamp: int      # ms
+    values: Tuple[float, ...]   # in METRICS order
+
+
+class Rollup:
+    """
+    Aggregates of one device at one resolution, in parallel arrays sorted by
+    bucket start.
+
+    Per bucket it keeps the sample count, the time of the last sample and, per
+    metric, min, max, sum and last value. Buckets are found with binary
+    search; appending to the newest bucket, the common case, is O(1).
+
+    A sample is identified by its timestamp, the at-payloads sort key of the
+    device. The timestamps applied after the horizon, LATENESS behind the
+    watermark (the newest sample applied so far), are kept, so a redelivered
+    stream record is not counted twice while records of other shards may
+    arrive out of order. Samples at or before the horizon, applied already
+    or not, are dropped as late; Rollups logs and counts them.
+    """
+
+    def __init__(self, resolution: int):
+        self.resolution = resolution
+        self.watermark = 0
+        self.horizon = 0
+        self.recent = array('q')    # applied timestamps after the horizon, sorted
+        self.starts = array('q')
+        self.counts = array('I')
+        self.last_times = array('q')
+        # per metric: min, max, last (float32) and sum (float64)
+        self.mins = [array('f') for _ in METRICS]
+        self.maxs = [array('f') for _ in METRICS]
+        self.lasts = [array('f') for _ in METRICS]
+        self.sums = [array('d') for _ in METRICS]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _columns(self) -> List[array]:
+        return [self.starts, self.counts, self.last_times, *self.mins, *self.maxs, *self.lasts, *self.sums]
+
+    def late(self, timestamp: int) -> bool:
+        return timestamp <= self.horizon
+
+    def add(self, timestamp: int, values: Iterable[float]) -> bool:
+        """Adds a sample, returns False when it was added already or is late."""
+        if timestamp <= self.horizon:
+            return False
+        r = bisect_left(self.recent, timestamp)
+        if r < len(self.recent) and self.recent[r] == timestamp:
+            return False
+        self.recent.insert(r, timestamp)
+        if timestamp > self.watermark:
+            self.watermark = timestamp
+            self.horizon = max(self.horizon, timestamp - LATENESS)
+            del self.recent[:bisect_left(self.recent, self.horizon + 1)]
+        start = timestamp - timestamp % self.resolution
+        i = len(self.starts) - 1
+        if i < 0 or self.starts[i] != start:
+            i = bisect_left(self.starts, start)
+            if i == len(self.starts) or self.starts[i] != start:
+                self._insert(i, start)
+        self.counts[i] += 1
+        newest = timestamp >= self.last_times[i]
+        if newest:
+            self.last_times[i] = timestamp
+        for m, value in enumerate(values):
+            if value < self.mins[m][i]:
+                self.mins[m][i] = value
+            if value > self.maxs[m][i]:
+                self.maxs[m][i] = value
+            self.sums[m][i] += value
+            if newest:
+                self.lasts[m][i] = value
+        return True
+
+    def _insert(self, i: int, start: int):
+        self.starts.insert(i, start)
+        self.counts.insert(i, 0)
+        self.last_times.insert(i, 0)
+        for m in range(len(METRICS)):
+            self.mins[m].insert(i, math.inf)
+            self.maxs[m].insert(i, -math.inf)
+            self.lasts[m].insert(i, math.nan)
+            self.sums[m].insert(i, 0.0)
+
+    def bucket(self, i: int) -> Bucket:
+        count = self.counts[i]
+        return Bucket(self.starts[i], count, {
+            metric: Stats(self.mins[m][i], self.maxs[m][i], self.sums[m][i] / count if count else math.nan,
+                          self.lasts[m][i])
+            for m, metric in enumerate(METRICS)
+        })
+
+    def query(self, start: int, end: int) -> Iterator[Bucket]:
+        """Buckets overlapping [start, end) ms, oldest first."""
+        first = bisect_left(self.starts, start - start % self.resolution)
+        last = bisect_left(self.starts, end)
+        return (self.bucket(i) for i in range(first, last))
+
+    def to_bytes(self) -> bytes:
+        columns = self._columns() + [self.recent]
+        if sys.byteorder == 'big':
+            columns = [array(column.typecode, column) for column in columns]
+            for column in columns:
+                column.byteswap()
+        return _HEADER.pack(_FORMAT_VERSION, self.resolution, len(self.starts), self.watermark, self.horizon,
+                            len(self.recent)) + b''.join(column.tobytes() for column in columns)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Rollup':
+        if data[0] != _FORMAT_VERSION:
+            raise ValueError(f'Unsupported rollup format {data[0]}')
+        _, resolution, count, watermark, horizon, recent = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        rollup = cls(resolution)
+        rollup.watermark = watermark
+        rollup.horizon = horizon
+        for column, length in [(column, count) for column in rollup._columns()] + [(rollup.recent, recent)]:
+            size = column.itemsize * length
+            column.frombytes(data[offset:offset + size])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            offset += size
+        return rollup
+
+
+def chunk_start(resolution: str, timestamp: int) -> int:
+    """
+    Start (ms) of the stored chunk holding a timestamp: hourly rollups are
+    stored per UTC day, daily rollups per UTC month. A chunk so holds at
+    most 31 buckets, about 3 KB, and each write of a batch's samples
+    rewrites that much rather than a month or a year of buckets.
+    """
+    if resolution == 'hour':
+        return timestamp - timestamp % RESOLUTIONS['day']
+    moment = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+    moment = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return int(moment.timestamp() * 1000)
+
+
+def series_key(resolution: str, chunk: int) -> str:
+    # ms timestamps have 13 digits until 2286, so keys of a resolution sort by chunk
+    return f'{resolution}#{chunk}'
+
+
+class ConflictError(Exception):
+    """A rollup chunk was changed by someone else since it was loaded."""
+
+
+class LocalRollupStore:
+    """In-memory stand-in for the rollup table."""
+
+    def __init__(self):
+        self.items: Dict[Tuple[str, str], Tuple[bytes, int]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, devid: str, key: str) -> Optional[Tuple[bytes, int]]:
+        with self._lock:
+            return self.items.get((devid, key))
+
+    def load_range(self, devid: str, first: str, last: str) -> Dict[str, Tuple[bytes, int]]:
+        with self._lock:
+            return {key: stored for (d, key), stored in self.items.items() if d == devid and first <= key <= last}
+
+    def save(self, devid: str, key: str, data: bytes, version: int):
+        with self._lock:
+            current = self.items.get((devid, key))
+            if (current[1] if current else 0) != version:
+                raise ConflictError(key)
+            self.items[(devid, key)] = (data, version + 1)
+
+
+class DynamoDBRollupStore:
+    """
+    One item per device and chunk, the packed Rollup in binary attribute
+    'data'. Writes are conditional on the item version, so concurrent
+    consumers never overwrite each other's samples. The chunks of a range
+    are read with one Query on the series sort key.
+    """
+
+    def __init__(self, table_name: str = 'at-rollups', client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    def load(self, devid: str, key: str) -> Optional[Tuple[bytes, int]]:
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'WirelessDeviceId': {'S': devid}, 'series': {'S': key}},
+            ConsistentRead=True,
+        )
+        item = response.get('Item')
+        if not item:
+            return None
+        return bytes(item['data']['B']), int(item['version']['N'])
+
+    def load_range(self, devid: str, first: str, last: str) -> Dict[str, Tuple[bytes, int]]:
+        """Stored chunks of a device with a series key in [first, last]."""
+        kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'WirelessDeviceId = :d AND series BETWEEN :first AND :last',
+            'ExpressionAttributeValues': {':d': {'S': devid}, ':first': {'S': first}, ':last': {'S': last}},
+        }
+        chunks = {}
+        while True:
+            response = self.client.query(**kwargs)
+            for item in response.get('Items', []):
+                chunks[item['series']['S']] = bytes(item['data']['B']), int(item['version']['N'])
+            if 'LastEvaluatedKey' not in response:
+                return chunks
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def save(self, devid: str, key: str, data: bytes, version: int):
+        condition = {'ConditionExpression': 'attribute_not_exists(series)'} if version == 0 else {
+            'ConditionExpression': 'version = :v', 'ExpressionAttributeValues': {':v': {'N': str(version)}}}
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'WirelessDeviceId': {'S': devid},
+                    'series': {'S': key},
+                    'data': {'B': data},
+                    'version': {'N': str(version + 1)},
+                },
+                **condition,
+            )
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                raise ConflictError(key) from e
+            raise
+
+
+class Rollups:
+    """
+    Incremental per-device hourly and daily rollups over a store.
+
+    Chunks are cached in the warm container together with their version;
+    a chunk changed elsewhere is reloaded and the samples applied again.
+    """
+
+    def __init__(self, store, max_entries: int = 4096, max_attempts: int = 3):
+        self.store = store
+        self.max_entries = max_entries
+        self.max_attempts = max_attempts
+        self._cache: 'OrderedDict[Tuple[str, str], Tuple[Rollup, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, devid: str, resolution: str, key: str, cached: bool = True) -> Tuple[Rollup, int]:
+        with self._lock:
+            entry = self._cache.get((devid, key)) if cached else None
+            if entry is not None:
+                self._cache.move_to_end((devid, key))
+                return entry
+        stored = self.store.load(devid, key)
+        if stored is None:
+            return Rollup(RESOLUTIONS[resolution]), 0
+        data, version = stored
+        return Rollup.from_bytes(data), version
+
+    def _remember(self, devid: str, key: str, rollup: Rollup, version: int):
+        with self._lock:
+            self._cache[(devid, key)] = (rollup, version)
+            self._cache.move_to_end((devid, key))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def apply(self, devid: str, samples: Iterable[Sample]) -> int:
+        """
+        Adds the samples of one device to every resolution.
+
+        Returns:
+        int: Samples added to the hourly rollups, duplicates excluded.
+        """
+        samples = sorted(samples)
+        added = 0
+        for resolution in RESOLUTIONS:
+            chunks: Dict[int, List[Sample]] = {}
+            for sample in samples:
+                chunks.setdefault(chunk_start(resolution, sample.timestamp), []).append(sample)
+            for chunk, chunk_samples in chunks.items():
+                count = self._apply_chunk(devid, resolution, series_key(resolution, chunk), chunk_samples)
+                if resolution == 'hour':
+                    added += count
+        return added
+
+    def _apply_chunk(self, devid: str, resolution: str, key: str, samples: List[Sample]) -> int:
+        for attempt in range(self.max_attempts):
+            rollup, version = self._load(devid, resolution, key, cached=attempt == 0)
+            # applied to a copy, the cached chunk stays as stored if the write fails
+            rollup = Rollup.from_bytes(rollup.to_bytes())
+            late = sum(rollup.late(sample.timestamp) for sample in samples)
+            added = sum(rollup.add(sample.timestamp, sample.values) for sample in samples)
+            if late and attempt == 0 and resolution == 'hour':
+                logger.warning('Dropping late samples', devid=devid, series=key, samples=late,
+                               horizon=rollup.horizon)
+                metrics.count('late_samples', late)
+            if not added:
+                return 0
+            try:
+                self.store.save(devid, key, rollup.to_bytes(), version)
+            except ConflictError:
+                logger.debug('Rollup changed concurrently, reloading', devid=devid, series=key)
+                continue
+            self._remember(devid, key, rollup, version + 1)
+            return added
+        raise ConflictError(key)
+
+    def query(self, devid: str, resolution: str, start: int, end: int) -> List[Bucket]:
+        """Buckets of a device overlapping [start, end) ms, oldest first."""
+        if end <= start:
+            return []
+        chunks = self.store.load_range(devid, series_key(resolution, chunk_start(resolution, start)),
+                                       series_key(resolution, chunk_start(resolution, end - 1)))
+        buckets = []
+        for key in sorted(chunks):
+            buckets.extend(Rollup.from_bytes(chunks[key][0]).query(start, end))
+        return buckets
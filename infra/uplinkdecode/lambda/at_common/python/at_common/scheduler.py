@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, List, Optional
+
+
+class IOScheduler:
+    """
+    Runs the network calls of the uplink pipeline on a shared thread pool.
+
+    Independent calls (position solves, table writes, publishes) overlap, both
+    within an uplink and across the uplinks of a batch. Dependent calls are
+    chained with then(), e.g. a location is only published once resolved.
+    The pool is meant to live at module level so threads and the HTTP
+    connection pools of the boto3 clients they use stay warm.
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='io')
+        self._pending: List[Future] = []
+        self._lock = threading.Lock()
+
+    def _track(self, future: Future) -> Future:
+        with self._lock:
+            self._pending.append(future)
+        return future
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self._track(self.executor.submit(fn, *args, **kwargs))
+
+    def then(self, future: Future, fn: Callable[[Any], Any]) -> Future:
+        """
+        Schedules fn(result) once future succeeds.
+
+        The returned future fails with the original exception if future does,
+        fn is not called in that case.
+        """
+        chained: Future = Future()
+        chained.set_running_or_notify_cancel()
+
+        def run(result):
+            try:
+                chained.set_result(fn(result))
+            except BaseException as e:
+                chained.set_exception(e)
+
+        def on_done(done: Future):
+            error = done.exception()
+            if error is not None:
+                chained.set_exception(error)
+            else:
+                self.executor.submit(run, done.result())
+
+        future.add_done_callback(on_done)
+        return self._track(chained)
+
+    def drain(self, futures: Optional[Iterable[Future]] = None) -> List[BaseException]:
+        """
+        Waits for the given futures, or for everything scheduled so far.
+
+        Returns:
+        List[BaseException]: Exceptions raised by the awaited tasks.
+        """
+        if futures is not None:
+            futures = [f for f in futures if f is not None]
+            wait(futures)
+            with self._lock:
+                self._pending = [f for f in self._pending if not f.done()]
+            return [f.exception() for f in futures if f.exception() is not None]
+
+        errors = []
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return errors
+            wait(pending)
+            errors.extend(f.exception() for f in pending if f.exception() is not None)
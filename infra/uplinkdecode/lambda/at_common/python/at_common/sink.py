@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+from concurrent.futures import wait
+from typing import Any, Callable, Dict, List, Tuple
+
+from at_common.clients import get_client
+from at_common.instrumentation import logger, metrics
+
+# BatchWriteItem accepts at most 25 put requests per call
+MAX_BATCH_SIZE = 25
+
+
+class PayloadSink:
+    """
+    Buffers items for a DynamoDB table and writes them with BatchWriteItem.
+
+    Items are flushed in chunks of up to 25, either when the buffer is full or
+    when flush() is called at the end of an invocation or batch. Unprocessed
+    items returned by DynamoDB are re-driven with jittered exponential backoff.
+    Any client exposing batch_write_item works, e.g. a boto3 client pointed at
+    DynamoDB Local through AWS_ENDPOINT_URL_DYNAMODB, or an in-memory fake.
+    Without a client the shared DynamoDB client is used, created on first write.
+    With an executor, chunks are written in the background and flush() waits
+    for all of them.
+    """
+
+    def __init__(self, client, table_name: str,
+                 key_attributes: Tuple[str, ...] = ('WirelessDeviceId', 'timestamp'),
+                 batch_size: int = MAX_BATCH_SIZE,
+                 max_attempts: int = 6,
+                 base_delay: float = 0.05,
+                 max_delay: float = 1.0,
+                 sleep: Callable[[float], None] = time.sleep,
+                 executor=None):
+        self._client = client
+        self.table_name = table_name
+        self.key_attributes = key_attributes
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.executor = executor
+        # keyed by primary key, BatchWriteItem rejects duplicate keys in one request
+        self._buffer: Dict[Tuple, Dict[str, Any]] = {}
+        self.failed: List[Dict[str, Any]] = []
+        self._inflight = []
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self._client or get_client('dynamodb')
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def item_key(self, item: Dict[str, Any]) -> Tuple:
+        return tuple(next(iter(item[name].values())) for name in self.key_attributes)
+
+    def put(self, item: Dict[str, Any]):
+        """Buffers an item, a later item with the same key replaces it like put_item would."""
+        with self._lock:
+            self._buffer[self.item_key(item)] = item
+            if len(self._buffer) < self.batch_size:
+                return
+            chunk = self._take(self.batch_size)
+        self._dispatch(chunk)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Writes every buffered item.
+
+        Returns:
+        List[Dict[str, Any]]: Items that could not be written, across all
+        writes since the last flush. The list is reset by this call.
+        """
+        while True:
+            with self._lock:
+                chunk = self._take(self.batch_size)
+            if not chunk:
+                break
+            self._dispatch(chunk)
+        with self._lock:
+            inflight, self._inflight = self._inflight, []
+        wait(inflight)
+        with self._lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def _dispatch(self, chunk: List[Dict[str, Any]]):
+        if self.executor is None:
+            self._write(chunk)
+            return
+        future = self.executor.submit(self._write, chunk)
+        with self._lock:
+            self._inflight.append(future)
+
+    def _take(self, count: int) -> List[Dict[str, Any]]:
+        keys = list(self._buffer)[:count]
+        return [self._buffer.pop(key) for key in keys]
+
+    def _write(self, items: List[Dict[str, Any]]):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            try:
+                with metrics.timer('batch_write_item'):
+                    response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+            except Exception as e:
+                logger.error('Error writing batch', table=self.table_name, items=len(requests), error=str(e))
+                break
+            requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            if not requests:
+                return
+        logger.error('Unable to write items', table=self.table_name, items=len(requests))
+        with self._lock:
+            self.failed.extend(request['PutRequest']['Item'] for request in requests)
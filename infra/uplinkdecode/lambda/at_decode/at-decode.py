@@ -1,38 +1,122 @@
 import os
 import json
 import base64
-import boto3
 from datetime import datetime
+from at_common.apindex import AccessPointIndex
+from at_common.batch import decode_batch
+from at_common.clients import get_client
+from at_common.dedupe import DuplicateFilter, DynamoDBSeqBackend
+from at_common.devconfig import DeviceConfig, DeviceConfigStore, DynamoDBConfigBackend, LocalConfigBackend
+from at_common.devstate import DeviceStateStore, DynamoDBStateBackend, LocalStateBackend
+from at_common.frames import Frame, FrameError, decode_frame, decode_payload
+from at_common.geofence import GeofenceEventPublisher, GeofenceIndex, list_geofences, transitions
+from at_common.instrumentation import logger, metrics, profiled
+from at_common.items import encode_item, encode_location
+from at_common.poscache import PositionCache
+from at_common.publisher import PositionPublisher
+from at_common.reassembly import FRAGMENT_TYPES, FragmentBuffer
+from at_common.resolver import CircuitBreaker, DeferredSolveQueue, PositionResolver, ResolverUnavailable, remaining_time
+from at_common.scheduler import IOScheduler
+from at_common.sink import PayloadSink
 
 # Constants
 TOPIC_NAME = 'iot/assettracker'
+IO_WORKERS = int(os.environ.get('IO_WORKERS', 16))
+# Positions per IoT message, 1 publishes every position on its own
+PUBLISH_BATCH_SIZE = int(os.environ.get('PUBLISH_BATCH_SIZE', 10))
+# Frame types whose uplinks may be solved, and so read the device settings
+LOCATED_TYPES = {'WIFI', *FRAGMENT_TYPES}
 
-iot_wireless_client = boto3.client('iotwireless')
-iot_data_client = boto3.client('iot-data')
-dynamodb_client = boto3.client('dynamodb')
+# Clients are created on first use (see at_common.clients), a NOLOC or
+# CONFIG uplink never pays for the iotwireless client
+io_scheduler = IOScheduler(max_workers=IO_WORKERS)
 # payload_table_name = os.environ.get('UPLINK_PAYLOAD_TABLE')
 payload_table_name = 'at-payloads'
+payload_sink = PayloadSink(None, payload_table_name, executor=io_scheduler.executor)
+position_publisher = PositionPublisher(None, TOPIC_NAME, batch_size=PUBLISH_BATCH_SIZE,
+                                       executor=io_scheduler.executor)
+position_cache = PositionCache(
+    max_entries=int(os.environ.get('POSITION_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('POSITION_CACHE_TTL', 300)),
+    rssi_bucket=int(os.environ.get('POSITION_CACHE_RSSI_BUCKET', 10))
+)
+fragment_buffer = FragmentBuffer(window=float(os.environ.get('FRAG_WINDOW', 300)))
+# Last fix, battery and motion per device, an empty DEVICE_STATE_TABLE keeps them in memory only.
+# Changes are written once per invocation, by device_states.flush()
+device_state_table = os.environ.get('DEVICE_STATE_TABLE', 'at-config')
+device_states = DeviceStateStore(
+    DynamoDBStateBackend(device_state_table) if device_state_table else LocalStateBackend(),
+    max_entries=int(os.environ.get('DEVICE_STATE_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('DEVICE_STATE_TTL', 300)),
+    policy=os.environ.get('DEVICE_STATE_POLICY', 'motion'),
+    max_fix_age=float(os.environ.get('DEVICE_STATE_MAX_FIX_AGE', 3600)),
+    executor=io_scheduler.executor
+)
+# Settings sent by each device in CONFIG uplinks, kept next to the state.
+# Devices without settings are cached as such for DEVICE_CONFIG_NEGATIVE_TTL
+device_config_table = os.environ.get('DEVICE_CONFIG_TABLE', 'at-config')
+device_configs = DeviceConfigStore(
+    DynamoDBConfigBackend(device_config_table) if device_config_table else LocalConfigBackend(),
+    max_entries=int(os.environ.get('DEVICE_CONFIG_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('DEVICE_CONFIG_TTL', 300)),
+    negative_ttl=float(os.environ.get('DEVICE_CONFIG_NEGATIVE_TTL', 60))
+)
+ap_index = AccessPointIndex(
+    max_entries=int(os.environ.get('AP_INDEX_SIZE', 65536)),
+    min_aps=int(os.environ.get('LOCAL_SOLVE_MIN_APS', 2)),
+    max_accuracy=float(os.environ.get('LOCAL_SOLVE_MAX_ACCURACY', 100))
+)
+if os.environ.get('AP_INDEX_SEED'):
+    ap_index.load(os.environ['AP_INDEX_SEED'])
+# Geofences evaluated in-process on every new fix, from an Amazon Location
+# collection or a JSON lines file; without either no fences are evaluated
+geofence_collection = os.environ.get('GEOFENCE_COLLECTION')
+geofence_index = GeofenceIndex(
+    cell_size=float(os.environ.get('GEOFENCE_CELL_SIZE', 0.01)),
+    source=(lambda: list_geofences(geofence_collection)) if geofence_collection else None,
+    ttl=float(os.environ.get('GEOFENCE_REFRESH', 300))
+)
+if os.environ.get('GEOFENCE_FILE'):
+    geofence_index.load_file(os.environ['GEOFENCE_FILE'])
+geofence_events = GeofenceEventPublisher(None, executor=io_scheduler.executor)
+# Sequence numbers already processed, checked in memory and, with a
+# DEDUPE_TABLE, claimed there against duplicates sent to other containers
+dedupe_table = os.environ.get('DEDUPE_TABLE')
+uplink_filter = DuplicateFilter(
+    window=int(os.environ.get('DEDUPE_WINDOW', 256)),
+    max_devices=int(os.environ.get('DEDUPE_CACHE_SIZE', 100000)),
+    backend=DynamoDBSeqBackend(
+        dedupe_table,
+        ttl=int(os.environ.get('DEDUPE_TTL', 86400)),
+        lease=int(os.environ.get('DEDUPE_LEASE', 60))
+    ) if dedupe_table else None,
+    executor=io_scheduler.executor
+)
+# Position estimates paced to the container's share of the quota, with
+# retries and a circuit breaker (see at_common/resolver.py). Solves the
+# resolver cannot take are sent to DEFERRED_SOLVE_QUEUE for resolve_handler,
+# without a queue the uplink fails as before
+position_resolver = PositionResolver(
+    rate=float(os.environ.get('RESOLVER_RATE', 10)),
+    burst=float(os.environ.get('RESOLVER_BURST', 10)),
+    max_attempts=int(os.environ.get('RESOLVER_MAX_ATTEMPTS', 4)),
+    max_wait=float(os.environ.get('RESOLVER_MAX_WAIT', 5)),
+    breaker=CircuitBreaker(
+        threshold=int(os.environ.get('RESOLVER_BREAKER_THRESHOLD', 5)),
+        reset_timeout=float(os.environ.get('RESOLVER_BREAKER_RESET', 30))
+    )
+)
+# Seconds of an invocation kept for writing and publishing, solves that would
+# run into them are deferred instead of timing out the invocation
+SOLVE_MARGIN = float(os.environ.get('RESOLVER_DEADLINE_MARGIN', 3))
+deferred_queue_url = os.environ.get('DEFERRED_SOLVE_QUEUE')
+deferred_solves = DeferredSolveQueue(
+    deferred_queue_url, delay=int(os.environ.get('DEFERRED_SOLVE_DELAY', 30))) if deferred_queue_url else None
 
-def decode_payload(data):
-    data_bytes = data.encode('ascii')
-    decoded = base64.b64decode(data_bytes).decode('ascii')
-    # print(decoded)
-    return decoded
-
-def get_uplink_type(decoded_bytes):
-    at_uplink_t = (decoded_bytes[0] & 0xC0) >> 6
-    uplink_types = ["CONFIG", "NOLOC", "WIFI", "GNSS"]
-    return uplink_types[at_uplink_t] if at_uplink_t < len(uplink_types) else "unknown"
-
-def to_signed_byte(byte):
-    return byte - 256 if byte > 127 else byte
-
-def format_mac_address(mac_bytes):
-    mac = mac_bytes.hex()
-    return ':'.join(mac[i:i + 2] for i in range(0, len(mac), 2))
-
+@profiled
 def lambda_handler(event, context):
-    print(f'Received event: {event}')
+    position_resolver.set_deadline(remaining_time(context, SOLVE_MARGIN))
+    logger.debug('Received event', event=event)
     
     uplink = event.get("at_uplink")
     if not uplink:
@@ -42,332 +126,414 @@ def lambda_handler(event, context):
         }
     
     timestamp = int(datetime.utcnow().timestamp() * 1000)
-    devid = uplink.get("WirelessDeviceId")
-    seq = uplink.get("WirelessMetadata").get("Seq")
-    payload = decode_payload(uplink.get("PayloadData"))
-    decoded_bytes = bytearray.fromhex(payload)
-    at_uplink_type = get_uplink_type(decoded_bytes)
-    
-    match at_uplink_type:
-        case "CONFIG":
-            print(f'CONFIG! TBD')
-        case "NOLOC":
-            # Extracting the data
-            num_msg = (decoded_bytes[0] & 0x38)>>3
-            batt = decoded_bytes[1]
-            temp = to_signed_byte(decoded_bytes[2])
-            hum = int(decoded_bytes[3])
-            motion = bool((decoded_bytes[4] & 0x80))
-            max_accel = float(decoded_bytes[4] & 0x7F) / 10
-
-            print(f'WirelessDeviceId: {devid}, '
-                f'Uplink Type: {at_uplink_type}, '
-                f'Timestamp: {timestamp}, '
-                f'Seq: {seq}, '
-                f'Battery: {batt}%, '
-                f'Temperature: {temp}C, '
-                f'RH: {hum}%, '
-                f'Motion: {motion}, '
-                f'Max Accel: {max_accel}g')
-
-			# write_to_payloads_table
-            try:
-                response = dynamodb_client.put_item(
-                    TableName=payload_table_name,
-                    Item={
-                        'WirelessDeviceId': {'S': devid},
-                        'timestamp': {'N': str(timestamp)},
-                        'seq': {'N': str(seq)},
-                        'type': {'S': at_uplink_type},
-                        'battery': {'N': str(batt)},
-                        'temperature': {'N': str(temp)},
-                        'humidity': {'N': str(hum)},
-                        'motion': {'S': str(motion)},
-                        'max accel': {'N': str(max_accel)}
-                    }
-                )
-                print(f"DynamoDB write response: {response}")
-            except Exception as e:
-                print(f"Error writing to DynamoDB payloads table: {e}")
+    try:
+        with metrics.timer('decode'):
+            frame = decode_frame(decode_payload(uplink.get("PayloadData")))
+    except FrameError as e:
+        logger.warning('Unable to decode uplink', devid=uplink.get("WirelessDeviceId"), error=str(e))
+        return {'statusCode': 422 }
 
-        case "WIFI":
-            # Check if this is a fragment
-            num_msg = (decoded_bytes[0] & 0x38)>>3
-            if num_msg == 1:
-                batt = decoded_bytes[1]
-                temp = to_signed_byte(decoded_bytes[2])
-                hum = int(decoded_bytes[3])
-                motion = bool((decoded_bytes[4] & 0x80))
-                max_accel = float(decoded_bytes[4] & 0x7F) / 10
-                rssi1 = to_signed_byte(decoded_bytes[5])
-                mac1 = format_mac_address(decoded_bytes[6:12])
-                rssi2 = to_signed_byte(decoded_bytes[12])
-                mac2 = format_mac_address(decoded_bytes[13:19])
-
-                # Print the extracted data
-                print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                    f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                    f'Uplink Type: {at_uplink_type}, '
-                    f'Battery: {batt}%, '
-                    f'Temperature: {temp}C, '
-                    f'RH: {hum}%, '
-                    f'Motion: {motion}, '
-                    f'Max Accel: {max_accel}g, '
-                    f'RSSI_1: {rssi1}, '
-                    f'MAC_1: {mac1}, '
-                    f'RSSI_2: {rssi2}, '
-                    f'MAC_2: {mac2}')
-        
-                # Get location
-                location_response = get_location_from_iot_wireless(mac1, rssi1, mac2, rssi2)
-                print(location_response)
-
-                tracker_location = construct_tracker_payload(location_response, timestamp, batt)
-
-                wifi_data = [{'MacAddress': mac1, 'Rss': rssi1}, {'MacAddress': mac2, 'Rss': rssi2}]
-                # write_to_payloads_table
-                try:
-                    response = dynamodb_client.put_item(
-                        TableName=payload_table_name,
-                        Item={
-                            'WirelessDeviceId': {'S': devid},
-                            'timestamp': {'N': str(timestamp)},
-                            'seq': {'N': str(seq)},
-                            'type': {'S': at_uplink_type},
-                            'frag cnt': {'N': str(num_msg)},
-                            'battery': {'N': str(batt)},
-                            'temperature': {'N': str(temp)},
-                            'humidity': {'N': str(hum)},
-                            'motion': {'S': str(motion)},
-                            'max accel': {'N': str(max_accel)},
-                            'wifidata': {'S': json.dumps(wifi_data)},
-                            'location': {'S': str(tracker_location)}
-                        }
-                    )
-                    print(f"DynamoDB write response: {response}")
-                except Exception as e:
-                    print(f"Error writing to DynamoDB payloads table: {e}")
-
-                # Construct and publish tracker location payload
-
-                publish_to_iot(tracker_location)
-
-            else:
-                #it is a fragment.  just write it to the payloads table and let the defrag function determin the location
-                frag_num = (decoded_bytes[0] & 0x7)
-                if frag_num == 0:
-                    batt = decoded_bytes[1]
-                    temp = to_signed_byte(decoded_bytes[2])
-                    hum = int(decoded_bytes[3])
-                    motion = bool((decoded_bytes[4] & 0x80))
-                    max_accel = float(decoded_bytes[4] & 0x7F) / 10
-                    rssi1 = to_signed_byte(decoded_bytes[5])
-                    mac1 = format_mac_address(decoded_bytes[6:12])
-                    rssi2 = to_signed_byte(decoded_bytes[12])
-                    mac2 = format_mac_address(decoded_bytes[13:19])
-
-                    at_uplink_type = "WIFI_F"
-
-                    # Print the extracted data
-                    print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                        f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                        f'Uplink Type: {at_uplink_type}, '
-                        f'frag count: {num_msg}, '
-                        f'Battery: {batt}%, '
-                        f'Temperature: {temp}C, '
-                        f'RH: {hum}%, '
-                        f'Motion: {motion}, '
-                        f'Max Accel: {max_accel}g, '
-                        f'RSSI_1: {rssi1}, '
-                        f'MAC_1: {mac1}, '
-                        f'RSSI_2: {rssi2}, '
-                        f'MAC_2: {mac2}')
-                    
-                    wifi_data = [{'MacAddress': mac1, 'Rss': rssi1}, {'MacAddress': mac2, 'Rss': rssi2}]
-                    # write_to_payloads_table
-                    try:
-                        response = dynamodb_client.put_item(
-                            TableName=payload_table_name,
-                            Item={
-                                'WirelessDeviceId': {'S': devid},
-                                'timestamp': {'N': str(timestamp)},
-                                'seq': {'N': str(seq)},
-                                'type': {'S': at_uplink_type},
-                                'frag cnt': {'N': str(num_msg)},
-                                'battery': {'N': str(batt)},
-                                'temperature': {'N': str(temp)},
-                                'humidity': {'N': str(hum)},
-                                'motion': {'S': str(motion)},
-                                'max accel': {'N': str(max_accel)},
-                                'wifidata': {'S': json.dumps(wifi_data)}
-                            }
-                        )
-                        print(f"DynamoDB write response: {response}")
-                    except Exception as e:
-                        print(f"Error writing to DynamoDB payloads table: {e}")
+    devid, seq, confirm = uplink_identity(uplink, frame)
+    if seq is not None and not uplink_filter.check(devid, seq, confirm):
+        metrics.count('duplicate', uplink_type=frame.type)
+        logger.debug('Dropping duplicate uplink', devid=devid, seq=seq)
+        return {'statusCode': 200}
 
-                else:
-                    rssi1 = to_signed_byte(decoded_bytes[1])
-                    mac1 = format_mac_address(decoded_bytes[2:8])
-                    
-                    if len(payload) == 30:
-                        rssi2 = to_signed_byte(decoded_bytes[8])
-                        mac2 = format_mac_address(decoded_bytes[9:15])
-
-                        # Print the extracted data for 2 macs
-                        print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                            f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                            f'Uplink Type: {at_uplink_type}, '
-                            f'frag count: {num_msg}, '
-                            f'RSSI_1: {rssi1}, '
-                            f'MAC_1: {mac1}, '
-                            f'RSSI_2: {rssi2}, '
-                            f'MAC_2: {mac2}')
-                        wifi_data = [{'MacAddress': mac1, 'Rss': rssi1}, {'MacAddress': mac2, 'Rss': rssi2}]
-                    else:
-                        # Print the extracted data for one mac
-                        print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                            f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                            f'Uplink Type: {at_uplink_type}, '
-                            f'frag count: {num_msg}, '
-                            f'RSSI_1: {rssi1}, '
-                            f'MAC_1: {mac1}')
-                        wifi_data = [{'MacAddress': mac1, 'Rss': rssi1}]
-                            
-                    at_uplink_type = "WIFI_END"
-                    
-                    
-                    # write_to_payloads_table
-                    try:
-                        response = dynamodb_client.put_item(
-                            TableName=payload_table_name,
-                            Item={
-                                'WirelessDeviceId': {'S': devid},
-                                'timestamp': {'N': str(timestamp)},
-                                'seq': {'N': str(seq)},
-                                'type': {'S': at_uplink_type},
-                                'frag cnt': {'N': str(num_msg)},
-                                'wifidata': {'S': json.dumps(wifi_data)}
-                            }
-                        )
-                        print(f"DynamoDB write response: {response}")
-                    except Exception as e:
-                        print(f"Error writing to DynamoDB payloads table: {e}")
-
-        case "GNSS":
-            print(f'GNSS!')
-            num_msg = (decoded_bytes[0] & 0x38)>>3
-            frag_num = (decoded_bytes[0] & 0x7)
-            if frag_num == 0:
-                batt = decoded_bytes[1]
-                temp = to_signed_byte(decoded_bytes[2])
-                hum = int(decoded_bytes[3])
-                motion = bool((decoded_bytes[4] & 0x80))
-                max_accel = float(decoded_bytes[4] & 0x7F) / 10
-                nav_size = decoded_bytes[5]
-                cap_time = int.from_bytes(decoded_bytes[6:12], "big")
-
-                at_uplink_type = "GNSS"
-
-                # Print the extracted data
-                print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                    f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                    f'Uplink Type: {at_uplink_type}, '
-                    f'frag count: {num_msg}, '
-                    f'Battery: {batt}%, '
-                    f'Temperature: {temp}C, '
-                    f'RH: {hum}%, '
-                    f'Motion: {motion}, '
-                    f'Max Accel: {max_accel}g, '
-                    f'Nav Msg Size: {nav_size}, '
-                    f'Capture Time: {cap_time}')
-   
-                # write_to_payloads_table
-                try:
-                    response = dynamodb_client.put_item(
-                        TableName=payload_table_name,
-                        Item={
-                            'WirelessDeviceId': {'S': devid},
-                            'timestamp': {'N': str(timestamp)},
-                            'seq': {'N': str(seq)},
-                            'type': {'S': at_uplink_type},
-                            'frag cnt': {'N': str(num_msg)},
-                            'battery': {'N': str(batt)},
-                            'temperature': {'N': str(temp)},
-                            'humidity': {'N': str(hum)},
-                            'motion': {'S': str(motion)},
-                            'max accel': {'N': str(max_accel)},
-                            'nav msg size': {'N': str(nav_size)},
-                            'capture time': {'N': str(cap_time)}
-                        }
-                    )
-                    print(f"DynamoDB write response: {response}")
-                except Exception as e:
-                    print(f"Error writing to DynamoDB payloads table: {e}")
-
-            else:
-                if frag_num == 0x7:
-                    at_uplink_type = "GNSS_END"
-                else:
-                    at_uplink_type = "GNSS_F"
-
-                nav_frag = payload[2:]
-                # Print the extracted data
-                print(f'WirelessDeviceId: {uplink.get("WirelessDeviceId")}, '
-                    f'Seq: {uplink.get("WirelessMetadata").get("Seq")}, '
-                    f'Uplink Type: {at_uplink_type}, '
-                    f'frag count: {num_msg}, '
-                    f'NAV frag: {nav_frag}')
-   
-                # write_to_payloads_table
-                try:
-                    response = dynamodb_client.put_item(
-                        TableName=payload_table_name,
-                        Item={
-                            'WirelessDeviceId': {'S': devid},
-                            'timestamp': {'N': str(timestamp)},
-                            'seq': {'N': str(seq)},
-                            'type': {'S': at_uplink_type},
-                            'frag cnt': {'N': str(num_msg)},
-                            'nav frag': {'S': nav_frag}
-                        }
-                     )
-                    print(f"DynamoDB write response: {response}")
-                except Exception as e:
-                    print(f"Error writing to DynamoDB payloads table: {e}")
-
-        case _:
-            print(f'Unknown uplink message type!')
-            return {'statusCode': 422 }
+    try:
+        with metrics.timer('uplink', frame.type):
+            persisted, published = process_uplink(uplink, frame, timestamp)
+            try:
+                errors = io_scheduler.drain([persisted, published])
+            finally:
+                # the table write overlaps with the publishes
+                publishing = io_scheduler.submit(position_publisher.flush)
+                notifying = io_scheduler.submit(geofence_events.flush)
+                unwritten = payload_sink.flush()
+                device_states.flush()
+            errors += io_scheduler.drain([publishing, notifying])
+        if not errors and unwritten:
+            errors.append(RuntimeError('Unable to write uplink'))
+        if not errors and publishing.result():
+            errors.append(RuntimeError('Unable to publish position'))
+        if errors:
+            raise errors[0]
+    except Exception:
+        # the retry of a failed uplink must not be dropped as a duplicate
+        if seq is not None:
+            uplink_filter.release(devid, seq, confirm)
+        raise
+    if seq is not None:
+        uplink_filter.complete(devid, seq, confirm)
 
     return {
         'statusCode': 200,
     }
 
-def get_location_from_iot_wireless(mac1, rssi1, mac2, rssi2):
-    response = iot_wireless_client.get_position_estimate(
-        WiFiAccessPoints=[{'MacAddress': mac1, 'Rss': rssi1}, {'MacAddress': mac2, 'Rss': rssi2}],
-        Timestamp=datetime.utcnow().timestamp()
-    )
-    return json.loads(response['GeoJsonPayload'].read())
+@profiled
+def batch_handler(event, context):
+    """
+    Entry point for batched uplinks, e.g. from an SQS queue or a Kinesis stream.
+
+    Frames of the whole batch are decoded together (see at_common.batch) and
+    then processed one by one. Records that fail are reported back as
+    batchItemFailures so only those are redelivered. Records that cannot be
+    read and frames that cannot be decoded are dropped, as retrying them
+    would not help.
+    """
+    position_resolver.set_deadline(remaining_time(context, SOLVE_MARGIN))
+    records = event.get("Records", [])
+    # records that cannot be read are dropped with the frames that cannot be decoded
+    uplinks = []
+    errors = {}
+    for i, record in enumerate(records):
+        try:
+            uplinks.append(record_uplink(record))
+        except FrameError as e:
+            uplinks.append({})
+            errors[i] = e
+    logger.info('Received batch', uplinks=len(uplinks))
+
+    with metrics.timer('decode_batch'):
+        payloads = []
+        for i, uplink in enumerate(uplinks):
+            try:
+                payloads.append(b'' if i in errors else decode_payload(uplink.get("PayloadData")))
+            except FrameError as e:
+                payloads.append(b'')
+                errors[i] = e
+        frames = [errors.get(i, frame) for i, frame in enumerate(decode_batch(payloads))]
+
+    # duplicates, within the batch or of earlier uplinks, are dropped before any I/O
+    identities = {i: uplink_identity(uplink, frame) for i, (uplink, frame) in enumerate(zip(uplinks, frames))
+                  if not isinstance(frame, FrameError)}
+    identities = {i: identity for i, identity in identities.items() if identity[1] is not None}
+    fresh = dict(zip(identities, uplink_filter.check_many(list(identities.values()))))
+    try:
+        # settings of the devices with located uplinks, one read for those not cached
+        device_configs.prefetch(
+            uplink.get("WirelessDeviceId") for i, (uplink, frame) in enumerate(zip(uplinks, frames))
+            if not isinstance(frame, FrameError) and frame.type in LOCATED_TYPES and fresh.get(i, True))
+        # and the states of the devices with a sensor block or a position
+        device_states.prefetch(
+            uplink.get("WirelessDeviceId") for i, (uplink, frame) in enumerate(zip(uplinks, frames))
+            if not isinstance(frame, FrameError) and (frame.sensor or frame.type in LOCATED_TYPES)
+            and fresh.get(i, True))
+
+        # uplinks of one device in a batch must not share the timestamp sort key
+        timestamp = int(datetime.utcnow().timestamp() * 1000)
+        last_timestamps = {}
+        failures = []
+        record_keys = {}
+        scheduled = []
+        for i, (record, uplink, frame) in enumerate(zip(records, uplinks, frames)):
+            if isinstance(frame, FrameError):
+                logger.warning('Unable to decode uplink', devid=uplink.get("WirelessDeviceId"), error=str(frame))
+                continue
+            if not fresh.get(i, True):
+                metrics.count('duplicate', uplink_type=frame.type)
+                continue
+            devid = uplink.get("WirelessDeviceId")
+            uplink_timestamp = max(timestamp, last_timestamps.get(devid, 0) + 1)
+            last_timestamps[devid] = uplink_timestamp
+            record_keys[(devid, str(uplink_timestamp))] = record_id(record)
+            try:
+                scheduled.append((record, *process_uplink(uplink, frame, uplink_timestamp)))
+            except Exception as e:
+                logger.error('Error processing uplink', devid=devid, error=str(e))
+                failures.append({'itemIdentifier': record_id(record)})
+
+        # solves of all uplinks run concurrently, chunks of resolved items are
+        # written while the remaining solves and the publishes are in flight
+        io_scheduler.drain([persisted for _, persisted, _ in scheduled])
+        for item in payload_sink.flush():
+            failures.append({'itemIdentifier': record_keys[payload_sink.item_key(item)]})
+        io_scheduler.drain([published for _, _, published in scheduled])
+        for key in position_publisher.flush():
+            failures.append({'itemIdentifier': record_keys[key]})
+        geofence_events.flush()
+        device_states.flush()
+        for record, persisted, published in scheduled:
+            for future in (persisted, published):
+                if future is not None and future.exception() is not None:
+                    logger.error('Error processing uplink', record=record_id(record), error=str(future.exception()))
+                    failures.append({'itemIdentifier': record_id(record)})
+                    break
+    except Exception:
+        # the whole batch is redelivered, its retry must not be dropped as duplicates
+        for i, identity in identities.items():
+            if fresh[i]:
+                uplink_filter.release(*identity)
+        raise
+
+    failed = {failure['itemIdentifier'] for failure in failures}
+    for i, identity in identities.items():
+        if fresh[i] and record_id(records[i]) in failed:
+            uplink_filter.release(*identity)
+    uplink_filter.complete_many([identity for i, identity in identities.items()
+                                 if fresh[i] and record_id(records[i]) not in failed])
+
+    return {'batchItemFailures': failures}
+
+@profiled
+def resolve_handler(event, context):
+    """
+    Entry point of the deferred solve queue (see at_common.resolver).
+
+    Solves the positions deferred while the resolver was unavailable, then
+    writes and publishes them like process_uplink would have. Messages whose
+    solve fails again are reported back as batchItemFailures and return once
+    the queue's visibility timeout expires.
+    """
+    position_resolver.set_deadline(remaining_time(context, SOLVE_MARGIN))
+    records = event.get("Records", [])
+    logger.info('Received deferred solves', solves=len(records))
+
+    failures = []
+    record_keys = {}
+    scheduled = []
+    for record in records:
+        deferred = json.loads(record['body'])
+        devid, timestamp = deferred['devid'], deferred['timestamp']
+        record_keys[(devid, str(timestamp))] = record['messageId']
+        try:
+            frame = decode_frame(bytes.fromhex(deferred['frame'])) if 'frame' in deferred else None
+            scheduled.append((record, *schedule_solve(
+                devid, timestamp, deferred['seq'], frame, (deferred['kind'], *deferred['args']),
+                deferred['location_timestamp'], deferred['battery'], defer=False, version=deferred.get('version'))))
+        except Exception as e:
+            logger.error('Error scheduling deferred solve', devid=devid, error=str(e))
+            failures.append({'itemIdentifier': record['messageId']})
+
+    io_scheduler.drain([persisted for _, persisted, _ in scheduled])
+    for item in payload_sink.flush():
+        failures.append({'itemIdentifier': record_keys[payload_sink.item_key(item)]})
+    io_scheduler.drain([published for _, _, published in scheduled])
+    for key in position_publisher.flush():
+        failures.append({'itemIdentifier': record_keys[key]})
+    geofence_events.flush()
+    device_states.flush()
+    for record, persisted, published in scheduled:
+        for future in (persisted, published):
+            if future is not None and future.exception() is not None:
+                logger.warning('Deferred solve failed', record=record['messageId'], error=str(future.exception()))
+                failures.append({'itemIdentifier': record['messageId']})
+                break
+
+    logger.debug('Resolver', **position_resolver.stats())
+    return {'batchItemFailures': failures}
 
-def construct_tracker_payload(location_response, timestamp, batt):
+def record_uplink(record):
+    """
+    Extracts the at_uplink from an SQS or Kinesis record, or a bare uplink.
+
+    Raises FrameError when the record does not hold a JSON object.
+    """
+    try:
+        if 'body' in record:
+            body = json.loads(record['body'])
+        elif 'kinesis' in record:
+            body = json.loads(base64.b64decode(record['kinesis']['data']))
+        else:
+            body = record
+    except (ValueError, TypeError) as e:
+        raise FrameError(f'Malformed record: {e}') from e
+    uplink = body.get("at_uplink", body) if isinstance(body, dict) else None
+    if not isinstance(uplink, dict):
+        raise FrameError('Malformed record: no uplink object')
+    return uplink
+
+def uplink_identity(uplink, frame: Frame):
+    """
+    Returns (devid, seq, confirm) of an uplink for the duplicate filter.
+
+    NOLOC duplicates cost one table write, as much as claiming their
+    sequence number would, so they are only checked in memory.
+    """
+    seq = (uplink.get("WirelessMetadata") or {}).get("Seq")
+    return uplink.get("WirelessDeviceId"), None if seq is None else int(seq), frame.type != 'NOLOC'
+
+def record_id(record):
+    if 'messageId' in record:
+        return record['messageId']
+    if 'kinesis' in record:
+        return record['kinesis']['sequenceNumber']
+    return record.get("at_uplink", record).get("WirelessMetadata", {}).get("Seq")
+
+def process_uplink(uplink, frame: Frame, timestamp):
+    """
+    Writes the uplink and schedules its position solve and publish.
+
+    Returns:
+    Tuple[Future, Future]: The futures of the item being buffered for the
+    payloads table and of the location being queued for publishing, which
+    happens on position_publisher.flush(), (None, None) when there was
+    nothing to resolve or the last fix was reused, and the item was buffered
+    right away.
+    """
+    devid = uplink.get("WirelessDeviceId")
+    seq = uplink.get("WirelessMetadata").get("Seq")
+
+    if logger.enabled('DEBUG'):
+        logger.debug('Decoded uplink', devid=devid, seq=seq, timestamp=timestamp, frame=frame._asdict())
+
+    if frame.sensor:
+        device_states.observe(devid, timestamp, frame.sensor)
+
+    solve = None
+    match frame.type:
+        case "CONFIG":
+            if frame.settings is None:
+                # bare CONFIG header of firmware without the settings block, or the
+                # block is not decoded (see CONFIG_SETTINGS in at_common/frames.py),
+                # the settings cached and stored for the device are left unchanged
+                logger.info('CONFIG uplink without settings', devid=devid)
+                return None, None
+            config = DeviceConfig.from_settings(frame.settings, timestamp)
+            logger.info('Device settings', devid=devid, **config._asdict())
+            # written to at-config, only the uplinks carrying a position go to at-payloads
+            return io_scheduler.submit(device_configs.update, devid, config), None
+        case "WIFI":
+            # Single message Wi-Fi scan, resolve it right away
+            solve = ('WIFI', frame.wifi_data())
+            location_timestamp, batt = timestamp, frame.sensor.battery
+        case _ if frame.type in FRAGMENT_TYPES:
+            config = device_configs.get(devid)
+            if config and config.expected_fragments(frame.type) not in (0, frame.num_msg):
+                # reassembled anyway, num_msg decides; mismatches point at a firmware or radio issue
+                metrics.count('unexpected_fragments', uplink_type=frame.type)
+                logger.warning('Unexpected fragment count', devid=devid, seq=seq, num_msg=frame.num_msg,
+                               expected=config.expected_fragments(frame.type))
+            # Fragments are reassembled here when they all reach this container
+            # with the END fragment last. Otherwise the END item is written without
+            # a location and the defrag function reassembles the message from the table
+            with metrics.timer('reassembly', frame.type):
+                message = fragment_buffer.add(devid, seq, timestamp, frame)
+            if message:
+                logger.debug('Reassembled message', devid=devid, kind=message.kind, first_seq=message.first_seq,
+                    fragments=len(message.frames), buffer=fragment_buffer.stats())
+                if message.kind == "WIFI":
+                    solve = ('WIFI', message.wifi_data())
+                else:
+                    solve = ('GNSS', message.nav_msg(), message.capture_time)
+                location_timestamp, batt = message.first_timestamp, message.sensor.battery
+
+    if solve is None:
+        # write_to_payloads_table, flushed at the end of the invocation
+        payload_sink.put(encode_item(devid, timestamp, seq, frame))
+        return None, None
+
+    config = device_configs.get(devid)
+    last = device_states.reusable_fix(devid, location_timestamp, policy=config and config.resolve_policy)
+    if last:
+        # No motion since the last fix, the item gets that position and
+        # nothing is solved or published
+        metrics.count('fix_reused', uplink_type=frame.type)
+        tracker_location = construct_tracker_payload(last.location(), last.fix_timestamp, batt, devid)
+        payload_sink.put(encode_item(devid, timestamp, seq, frame, tracker_location))
+        return None, None
+
+    return schedule_solve(devid, timestamp, seq, frame, solve, location_timestamp, batt)
+
+def schedule_solve(devid, timestamp, seq, frame, solve, location_timestamp, batt, defer=True, version=None):
+    """
+    Schedules a position solve, then the write of the item with that
+    position and its publish.
+
+    solve is ('WIFI', access_points) or ('GNSS', nav_msg, capture_time).
+    With defer, a solve the resolver cannot take now is sent to the deferred
+    solve queue and both futures resolve to None. Without a frame only the
+    location of the stored item, in format version, is written.
+    """
+    kind, *args = solve
+
+    def resolve():
+        try:
+            if kind == 'WIFI':
+                return get_location_from_iot_wireless(*args)
+            return get_location_from_gnss(*args)
+        except ResolverUnavailable:
+            if not defer or deferred_solves is None:
+                raise
+        # the item is written once resolve_handler solved the position
+        deferred_solves.defer({
+            'devid': devid, 'timestamp': timestamp, 'seq': seq, 'kind': kind, 'args': args,
+            'location_timestamp': location_timestamp, 'battery': batt, 'frame': bytes(frame.data).hex(),
+        })
+        return None
+
+    def persist(location_response):
+        if location_response is None:
+            return None
+        logger.debug('Resolved location', devid=devid, location=location_response)
+        tracker_location = construct_tracker_payload(location_response, location_timestamp, batt, devid)
+        if frame is not None:
+            payload_sink.put(encode_item(devid, timestamp, seq, frame, tracker_location))
+        else:
+            get_client('dynamodb').update_item(
+                TableName=payload_table_name,
+                Key={'WirelessDeviceId': {'S': devid}, 'timestamp': {'N': str(timestamp)}},
+                UpdateExpression='SET #l = :l',
+                ExpressionAttributeNames={'#l': 'location'},
+                ExpressionAttributeValues={':l': encode_location(tracker_location, version)},
+            )
+        record_fix(devid, location_timestamp, tracker_location)
+        return tracker_location
+
+    def publish(tracker_location):
+        # a location is only published once it is resolved, together with the
+        # other locations of the invocation (see at_common.publisher)
+        if tracker_location is not None:
+            position_publisher.add(tracker_location, (devid, str(timestamp)))
+
+    persisted = io_scheduler.then(io_scheduler.submit(resolve), persist)
+    published = io_scheduler.then(persisted, publish)
+    return persisted, published
+
+def record_fix(devid, timestamp, tracker_location):
+    """Stores a new fix and queues the geofence ENTER / EXIT events it causes."""
+    if not len(geofence_index) and geofence_index.source is None:
+        device_states.record_fix(devid, timestamp, tracker_location)
+        return
+    longitude, latitude = tracker_location['longitude'], tracker_location['latitude']
+    with metrics.timer('geofence'):
+        inside = geofence_index.containing(longitude, latitude)
+    previous = device_states.get(devid).geofences
+    # an older fix solved late neither changes the fences nor emits events
+    if device_states.record_fix(devid, timestamp, tracker_location, geofences=inside):
+        for event in transitions(devid, previous, inside, longitude, latitude, timestamp):
+            geofence_events.add(event)
+
+def get_location_from_iot_wireless(access_points):
+    def solve():
+        with metrics.timer('position_estimate', 'WIFI'):
+            return position_resolver.estimate(
+                WiFiAccessPoints=access_points,
+                Timestamp=datetime.utcnow().timestamp()
+            )
+
+    # known access points are solved in-process, the cloud is only asked for the rest
+    location = position_cache.get_or_solve(access_points, lambda: ap_index.get_or_solve(access_points, solve))
+    logger.debug('Position cache', **position_cache.stats(), ap_index=ap_index.stats())
+    return location
+
+def get_location_from_gnss(nav_msg, capture_time):
+    with metrics.timer('position_estimate', 'GNSS'):
+        return position_resolver.estimate(
+            Gnss={
+                'Payload': nav_msg,
+                'CaptureTime': float(capture_time)
+            }
+        )
+
+def construct_tracker_payload(location_response, timestamp, batt, devid):
     coor = location_response.get("coordinates")
     prop = location_response.get("properties")
     
     return {
-        'deviceId': 'assettracker',
+        'deviceId': devid,
         'timestamp': timestamp,
         'latitude': coor[1],
         'longitude': coor[0],
         'accuracy': {'horizontal': prop.get("horizontalAccuracy")},
         'positionProperties': {'batteryLevel': batt}
     }
-
-def publish_to_iot(payload):
-    response = iot_data_client.publish(
-        topic=TOPIC_NAME,
-        qos=0,
-        payload=json.dumps(payload)
-    )
-    print(f"IoT Data Response: {response}")
@@ -1,148 +1,208 @@
 import os
-import json
-import base64
-import boto3
-import time
-from decimal import Decimal
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Any, Optional
-from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime
+from at_common.apindex import AccessPointIndex
+from at_common.fragments import FragmentStore
+from at_common.instrumentation import logger, metrics, profiled
+from at_common.items import PayloadRecord, decode_image
+from at_common.poscache import PositionCache
+from at_common.publisher import PositionPublisher
+from at_common.reassembly import SEQ_MODULUS
+from at_common.resolver import CircuitBreaker, DeferredSolveQueue, PositionResolver, ResolverUnavailable, remaining_time
 
 # Constants
 TOPIC_NAME = 'iot/assettracker'
+# Upper bound of devices resolved concurrently within one batch
+MAX_WORKERS = int(os.environ.get('DEFRAG_WORKERS', 8))
+# Positions per IoT message, 1 publishes every position on its own
+PUBLISH_BATCH_SIZE = int(os.environ.get('PUBLISH_BATCH_SIZE', 10))
 
-iot_wireless_client = boto3.client('iotwireless')
-iot_data_client = boto3.client('iot-data')
-dynamodb = boto3.resource('dynamodb')
 # payload_table_name = os.environ.get('UPLINK_PAYLOAD_TABLE')
-payload_table = dynamodb.Table('at-payloads')
+payload_table_name = 'at-payloads'
+position_cache = PositionCache(
+    max_entries=int(os.environ.get('POSITION_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('POSITION_CACHE_TTL', 300)),
+    rssi_bucket=int(os.environ.get('POSITION_CACHE_RSSI_BUCKET', 10))
+)
 
+ap_index = AccessPointIndex(
+    max_entries=int(os.environ.get('AP_INDEX_SIZE', 65536)),
+    min_aps=int(os.environ.get('LOCAL_SOLVE_MIN_APS', 2)),
+    max_accuracy=float(os.environ.get('LOCAL_SOLVE_MAX_ACCURACY', 100))
+)
+if os.environ.get('AP_INDEX_SEED'):
+    ap_index.load(os.environ['AP_INDEX_SEED'])
+# Tagged with the stream sequence numbers, messages are sent by the worker filling them
+position_publisher = PositionPublisher(None, TOPIC_NAME, batch_size=PUBLISH_BATCH_SIZE)
+fragment_store = FragmentStore(payload_table_name)
+# Same limits as in at-decode, solves the resolver cannot take are deferred
+# to DEFERRED_SOLVE_QUEUE instead of failing the stream record
+position_resolver = PositionResolver(
+    rate=float(os.environ.get('RESOLVER_RATE', 10)),
+    burst=float(os.environ.get('RESOLVER_BURST', 10)),
+    max_attempts=int(os.environ.get('RESOLVER_MAX_ATTEMPTS', 4)),
+    max_wait=float(os.environ.get('RESOLVER_MAX_WAIT', 5)),
+    breaker=CircuitBreaker(
+        threshold=int(os.environ.get('RESOLVER_BREAKER_THRESHOLD', 5)),
+        reset_timeout=float(os.environ.get('RESOLVER_BREAKER_RESET', 30))
+    )
+)
+# Seconds of an invocation kept for writing and publishing, solves that would
+# run into them are deferred instead of timing out the invocation
+SOLVE_MARGIN = float(os.environ.get('RESOLVER_DEADLINE_MARGIN', 3))
+deferred_queue_url = os.environ.get('DEFERRED_SOLVE_QUEUE')
+deferred_solves = DeferredSolveQueue(
+    deferred_queue_url, delay=int(os.environ.get('DEFERRED_SOLVE_DELAY', 30))) if deferred_queue_url else None
+
+# Kept across warm invocations, like the clients of at_common.clients
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+@profiled
 def lambda_handler(event, context):
-    print(f'Received event: {event}')
-    timestamp = int(datetime.utcnow().timestamp() * 1000)
-    current_time = time.time()
-    # frag window of past 5min in ms
-    frag_window = (int(current_time) - 300) * 1000 
+    """
+    Reassembles every WIFI_END / GNSS_END stream record of the batch.
 
-    # Get the wireless device id
-    
-    for record in event['Records']:
-        devid = record['dynamodb']['Keys']['WirelessDeviceId']['S']
-        type = record['dynamodb']['NewImage']['type']['S']
-        last_frag = record['dynamodb']['NewImage']['seq']['N']
-        frag_cnt = record['dynamodb']['NewImage']['frag cnt']['N']
-        
-    
-    first_frag = str(int(last_frag) - int(frag_cnt) + 1)
-    
-    print(f'WirelessDeviceId: {devid}, '
-        f'Type: {type}, '
-        f'Frag window: {frag_window}, '
-        f'First Frag: {first_frag}, '
-        f'Last Frag: {last_frag}, '
-        f'Frag count: {frag_cnt}')
-    
+    Records are grouped by device. Devices are resolved concurrently on a
+    bounded thread pool, the records of one device in stream order. Failed
+    records are returned as batchItemFailures so only those are retried.
+    Positions of the batch are published together once all devices are done.
+    """
+    position_resolver.set_deadline(remaining_time(context, SOLVE_MARGIN))
+    records = event['Records']
+    logger.info('Received batch', records=len(records))
 
-    response = payload_table.query(
-        KeyConditionExpression=Key('WirelessDeviceId').eq(devid) & Key('timestamp').gt(int(frag_window)),
-        FilterExpression=Attr('seq').gte(int(first_frag)) & Attr('seq').lte(int(last_frag))
-    )
+    by_device = defaultdict(list)
+    for record in records:
+        by_device[record['dynamodb']['Keys']['WirelessDeviceId']['S']].append(record)
+
+    failures = []
+    for device_failures in executor.map(process_device_records, by_device.values()):
+        failures.extend(device_failures)
+    failures.extend(seq for seq in position_publisher.flush() if seq not in failures)
 
-    items = response['Items']
+    return {'batchItemFailures': [{'itemIdentifier': seq} for seq in failures]}
+
+def process_device_records(records):
+    failures = []
+    for record in records:
+        try:
+            process_record(record)
+        except Exception as e:
+            logger.error('Error reassembling record', record=record['dynamodb'].get('SequenceNumber'), error=str(e))
+            failures.append(record['dynamodb'].get('SequenceNumber'))
+    return failures
+
+def process_record(record):
+    # the END item, in either item format (see at_common.items)
+    end = decode_image(record['dynamodb']['NewImage'])
+    devid = end.devid
+    type = end.frame.type
+    last_frag = end.seq
+    frag_cnt = end.frame.num_msg
     
-    print(items)
+    logger.debug('Reassembling', devid=devid, type=type, last_frag=last_frag, frag_cnt=frag_cnt)
+
+    # the fragments are addressed by key, see at_common.fragments
+    with metrics.timer('query', type):
+        items = unique_fragments(fragment_store.fetch(end))
+    logger.debug('Fragments', devid=devid, items=[item._asdict() for item in items])
 
     match type:
         case 'WIFI_END':
-            frag_count_correct, combined_wifi_data = process_wifi_entries(items)
+            with metrics.timer('reassembly', type):
+                frag_count_correct, combined_wifi_data = process_wifi_entries(items)
             if frag_count_correct:
-                print("Combined WiFi Data:", combined_wifi_data)
-                #get the timestamp of the first message
-                first_timestamp = None
+                logger.debug('Combined WiFi data', devid=devid, wifi_data=combined_wifi_data)
+                #get the timestamp of the first message, the END item's when a stale fragment took its place
+                first_timestamp = end.timestamp
                 for entry in items:
-                    if entry.get('type') == 'WIFI_F':
-                        first_timestamp = entry['timestamp']
+                    if entry.frame.type == 'WIFI_F':
+                        first_timestamp = entry.timestamp
                 
-                print("First Frag Timestamp:", first_timestamp)
-                
-                iot_response = iot_wireless_client.get_position_estimate(
-                    WiFiAccessPoints=combined_wifi_data,
-                    Timestamp=datetime.utcnow().timestamp()
-                )
+                def solve():
+                    with metrics.timer('position_estimate', 'WIFI'):
+                        return position_resolver.estimate(
+                            WiFiAccessPoints=combined_wifi_data,
+                            Timestamp=datetime.utcnow().timestamp()
+                        )
 
                 # TODO - if a position is resolved, write it back to the first frag entry in the payloads table
-                geo_location = json.loads(iot_response['GeoJsonPayload'].read())
-                print(geo_location)
-                tracker_location = construct_tracker_payload(geo_location, first_timestamp)
-                # try:
-                #     response = dynamodb.updateitem(
-                #         Key = {'WirelessDeviceId': {'S': devid}, 'timestamp': {'N': str(first_timestamp)}},
-                #         UpdateExpression="set location=:p",
-                #         ExpressionAttributeValues={":p": geo_location},
-                #         ReturnValues="UPDATED_NEW",
-                #     )
-                #     print(f"DynamoDB write response: {response}")
-                # except Exception as e:
-                #     print(f"Error writing to DynamoDB payloads table: {e}")
+                # known access points are solved in-process, the cloud is only asked for the rest
+                try:
+                    geo_location = position_cache.get_or_solve(
+                        combined_wifi_data, lambda: ap_index.get_or_solve(combined_wifi_data, solve))
+                except ResolverUnavailable:
+                    if deferred_solves is None:
+                        raise
+                    defer_solve(end, items, first_timestamp, 'WIFI', combined_wifi_data)
+                    return
+                logger.debug('Resolved location', devid=devid, first_timestamp=first_timestamp,
+                    location=geo_location, cache=position_cache.stats(), ap_index=ap_index.stats())
+                tracker_location = construct_tracker_payload(geo_location, first_timestamp, devid)
                 
-                #then send the location to the tracker topic
-                publish_to_iot(tracker_location)
+                #then queue the location for the tracker topic
+                position_publisher.add(tracker_location, record['dynamodb'].get('SequenceNumber'))
 
             else:
-                print("WiFi fragments missing!")
-                return {'statusCode': 404}
+                logger.warning('WiFi fragments missing!', devid=devid, found=len(items), frag_cnt=frag_cnt)
                 
         case 'GNSS_END':
-            frag_count_correct, concatenated_nav_msg, capture_time = process_gnss_data(items)
-            if frag_count_correct:
-                print("Recovered NAV msg:", concatenated_nav_msg)
-                print("Capture Time:", capture_time)
-                #get the timestamp of the first message
-                first_timestamp = None
+            with metrics.timer('reassembly', type):
+                frag_count_correct, concatenated_nav_msg, capture_time = process_gnss_data(items)
+            if frag_count_correct and capture_time is None:
+                logger.warning('GNSS capture time missing!', devid=devid, found=len(items), frag_cnt=frag_cnt)
+            elif frag_count_correct:
+                logger.debug('Recovered NAV msg', devid=devid, nav_msg=concatenated_nav_msg, capture_time=capture_time)
+                #get the timestamp of the first message, the END item's when a stale fragment took its place
+                first_timestamp = end.timestamp
                 for entry in items:
-                    if entry.get('type') == 'GNSS':
-                        first_timestamp = entry['timestamp']
-                print("First Frag Timestamp:", first_timestamp)
-
-                iot_response = iot_wireless_client.get_position_estimate(
-                    Gnss={
-                        'Payload': str(concatenated_nav_msg),
-                        'CaptureTime': float(capture_time)
-                        }
-                )
+                    if entry.frame.type == 'GNSS':
+                        first_timestamp = entry.timestamp
+
+                try:
+                    with metrics.timer('position_estimate', 'GNSS'):
+                        geo_location = position_resolver.estimate(
+                            Gnss={
+                                'Payload': str(concatenated_nav_msg),
+                                'CaptureTime': float(capture_time)
+                                }
+                        )
+                except ResolverUnavailable:
+                    if deferred_solves is None:
+                        raise
+                    defer_solve(end, items, first_timestamp, 'GNSS', str(concatenated_nav_msg), capture_time)
+                    return
                 
                 # TODO - if a position is resolved, write it back to the first frag entry in the payloads table
-                geo_location = json.loads(iot_response['GeoJsonPayload'].read())
-                print(geo_location)
-                tracker_location = construct_tracker_payload(geo_location, first_timestamp)
-                # try:
-                #     response = dynamodb.updateitem(
-                #         Key = {'WirelessDeviceId': {'S': devid}, 'timestamp': {'N': str(first_timestamp)}},
-                #         UpdateExpression="set location=:p",
-                #         ExpressionAttributeValues={":p": geo_location},
-                #         ReturnValues="UPDATED_NEW",
-                #     )
-                #     print(f"DynamoDB write response: {response}")
-                # except Exception as e:
-                #     print(f"Error writing to DynamoDB payloads table: {e}")
+                logger.debug('Resolved location', devid=devid, first_timestamp=first_timestamp, location=geo_location)
+                tracker_location = construct_tracker_payload(geo_location, first_timestamp, devid)
                 
-                #then send the location to the tracker topic
-                publish_to_iot(tracker_location)
+                #then queue the location for the tracker topic
+                position_publisher.add(tracker_location, record['dynamodb'].get('SequenceNumber'))
 
             else:
-                print("GNSS fragments missing!")
-                return {'statusCode': 404}
-
+                logger.warning('GNSS fragments missing!', devid=devid, found=len(items), frag_cnt=frag_cnt)
 
-    return {'statusCode': 200 }
+def defer_solve(end: PayloadRecord, items: List[PayloadRecord], first_timestamp, kind, *args):
+    """
+    Sends the solve to the deferred solve queue, at-decode's resolve_handler
+    writes the location to the END item and publishes it.
+    """
+    battery = next((item.frame.sensor.battery for item in items if item.frame.sensor), None)
+    deferred_solves.defer({
+        'devid': end.devid, 'timestamp': end.timestamp, 'seq': end.seq, 'kind': kind, 'args': list(args),
+        'location_timestamp': int(first_timestamp), 'battery': battery, 'version': end.version,
+    })
 
-def construct_tracker_payload(location_response, timestamp):
+def construct_tracker_payload(location_response, timestamp, devid):
     # loc = location_response.get("location")
     coor = location_response.get("coordinates")
     prop = location_response.get("properties")
     
     return {
-        'deviceId': 'assettracker',
+        'deviceId': devid,
         'timestamp': int(timestamp),
         'latitude': coor[1],
         'longitude': coor[0],
@@ -150,62 +210,67 @@ def construct_tracker_payload(location_response, timestamp):
         'positionProperties': {'batteryLevel': 95}
     }
 
-def publish_to_iot(payload):
-    response = iot_data_client.publish(
-        topic=TOPIC_NAME,
-        qos=0,
-        payload=json.dumps(payload)
-    )
-    print(f"IoT Data Response: {response}")
-    
-def process_wifi_entries(entries: List[Dict]) -> Tuple[bool, List[Dict[str, Any]]]:
+def unique_fragments(items) -> List[PayloadRecord]:
+    """
+    Keeps the first item of every sequence number. A retransmitted fragment
+    that got past the decoder is stored again under a new timestamp and
+    would otherwise break the fragment count check.
+    """
+    first = {}
+    for item in items:
+        first.setdefault(item.seq, item)
+    return list(first.values())
+
+def process_wifi_entries(entries: List[PayloadRecord]) -> Tuple[bool, List[Dict[str, Any]]]:
     """
-    Processes a list of Wi-Fi data entries.
+    Processes a list of Wi-Fi fragments.
 
     Args:
-    entries (List[Dict]): List of dictionaries containing Wi-Fi data.
+    entries (List[PayloadRecord]): Decoded WIFI_F / WIFI_END items.
 
     Returns:
     Tuple[bool, List[Dict[str, Any]]]: A tuple containing:
-        - A boolean indicating if the total number of entries matches the 'frag cnt'.
-        - A combined list of all 'wifidata' objects.
+        - A boolean indicating if the total number of entries matches the fragment count.
+        - A combined list of the access points of all entries.
     """
     # Check if total number of entries matches the 'frag cnt' value
-    frag_count_correct = len(entries) == entries[0]['frag cnt'] if entries else False
+    frag_count_correct = len(entries) == entries[0].frame.num_msg if entries else False
 
-    # Combine 'wifidata' into a single list
+    # Combine the access points into a single list
     combined_wifi_data = []
     for entry in entries:
-        if 'wifidata' in entry:
-            wifi_data = json.loads(entry['wifidata'])
-            combined_wifi_data.extend(wifi_data)
+        combined_wifi_data.extend(entry.frame.wifi_data())
 
     return frag_count_correct, combined_wifi_data
     
 
-def process_gnss_data(data: List[Dict]) -> Tuple[bool, str, Optional[Decimal]]:
+def process_gnss_data(data: List[PayloadRecord]) -> Tuple[bool, str, Optional[int]]:
     """
-    Processes a list of GNSS data dictionaries.
+    Processes a list of GNSS fragments.
 
     Args:
-    data (List[Dict]): List of dictionaries containing GNSS data.
+    data (List[PayloadRecord]): Decoded GNSS / GNSS_F / GNSS_END items.
 
     Returns:
-    Tuple[bool, str, Optional[Decimal]]: A tuple containing:
+    Tuple[bool, str, Optional[int]]: A tuple containing:
         - A boolean indicating if the fragment count is correct.
-        - A string with the concatenated 'nav msg' values.
-        - The 'capture time' from the first 'seq' message, or None if not present.
+        - A string with the concatenated hex encoded nav message fragments.
+        - The capture time from the 'GNSS' message, or None if not present.
     """
 
     # Check if the total number of entries matches the 'frag cnt' value
-    frag_count_correct = len(data) == data[0]['frag cnt'] if data else False
+    frag_count_correct = len(data) == data[0].frame.num_msg if data else False
 
-    # Sort the data by 'seq' and concatenate 'nav frag' values
-    sorted_data = sorted([d for d in data if 'nav frag' in d], key=lambda x: x['seq'])
-    concatenated_nav_msg = ''.join(d['nav frag'] for d in sorted_data)
+    # The message starts with its 'GNSS' item, the seqs after it may wrap around to 0
+    first = next((d for d in data if d.frame.type == 'GNSS'), None)
+    first_seq = first.seq if first else min((d.seq for d in data), default=0)
 
-    # Extract the 'capture time' from the first 'seq' message
-    capture_time = min(data, key=lambda x: x['seq']).get('capture time', None) if data else None
+    # Sort the fragments by their offset from the first seq and concatenate the nav message fragments
+    sorted_data = sorted([d for d in data if d.frame.type in ('GNSS_F', 'GNSS_END')],
+                         key=lambda x: (x.seq - first_seq) % SEQ_MODULUS)
+    concatenated_nav_msg = ''.join(d.frame.nav_frag for d in sorted_data)
 
-    return frag_count_correct, concatenated_nav_msg, capture_time
+    # Extract the capture time from the 'GNSS' message
+    capture_time = first.frame.gnss.capture_time if first and first.frame.gnss else None
 
+    return frag_count_correct, concatenated_nav_msg, capture_time
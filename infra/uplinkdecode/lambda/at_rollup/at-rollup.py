@@ -0,0 +1,78 @@
+import os
+from collections import defaultdict
+from at_common.instrumentation import logger, metrics, profiled
+from at_common.items import decode_image
+from at_common.rollup import METRICS, RESOLUTIONS, DynamoDBRollupStore, LocalRollupStore, Rollups, Sample
+
+# Per-device hourly and daily telemetry aggregates, an empty ROLLUP_TABLE keeps them in memory only
+rollup_table_name = os.environ.get('ROLLUP_TABLE', 'at-rollups')
+rollups = Rollups(
+    DynamoDBRollupStore(rollup_table_name) if rollup_table_name else LocalRollupStore(),
+    max_entries=int(os.environ.get('ROLLUP_CACHE_SIZE', 4096))
+)
+
+@profiled
+def lambda_handler(event, context):
+    """
+    Rolls the sensor blocks of new at-payloads items up into per-device buckets.
+
+    Records are grouped by device and each device's samples are applied in
+    one read-modify-write per stored chunk. When a device fails, all of its
+    records are returned as batchItemFailures; samples already applied are
+    skipped on redelivery (see at_common.rollup.Rollup).
+    """
+    records = event['Records']
+    logger.info('Received batch', records=len(records))
+
+    by_device = defaultdict(list)
+    for record in records:
+        if record.get('eventName') != 'INSERT':
+            continue
+        item = decode_image(record['dynamodb']['NewImage'])
+        if item.frame.sensor is None:
+            continue
+        sensor = item.frame.sensor
+        sample = Sample(item.timestamp, tuple(float(getattr(sensor, metric)) for metric in METRICS))
+        by_device[item.devid].append((record['dynamodb'].get('SequenceNumber'), sample))
+
+    failures = []
+    for devid, entries in by_device.items():
+        try:
+            with metrics.timer('rollup'):
+                added = rollups.apply(devid, [sample for _, sample in entries])
+            metrics.count('samples_rolled_up', added)
+        except Exception as e:
+            logger.error('Error rolling up samples', devid=devid, error=str(e))
+            failures.extend(seq for seq, _ in entries)
+
+    return {'batchItemFailures': [{'itemIdentifier': seq} for seq in failures]}
+
+def query_handler(event, context):
+    """
+    Answers {deviceId, resolution, start, end} range requests from the rollups.
+
+    start and end are epoch ms, resolution is 'hour' or 'day'. Every bucket
+    overlapping the range is returned, oldest first, with min, max, mean and
+    last of each metric.
+    """
+    resolution = event.get('resolution', 'hour')
+    if resolution not in RESOLUTIONS or 'deviceId' not in event:
+        return {'statusCode': 400, 'body': 'deviceId and a resolution of hour or day are required'}
+    try:
+        start, end = int(event['start']), int(event['end'])
+    except (KeyError, TypeError, ValueError):
+        return {'statusCode': 400, 'body': 'start and end are required as epoch ms'}
+    if not 0 <= start < end:
+        return {'statusCode': 400, 'body': 'start must be before end'}
+
+    buckets = rollups.query(event['deviceId'], resolution, start, end)
+    return {
+        'statusCode': 200,
+        'deviceId': event['deviceId'],
+        'resolution': resolution,
+        'buckets': [{
+            'start': bucket.start,
+            'count': bucket.count,
+            **{metric: stats._asdict() for metric, stats in bucket.stats.items()},
+        } for bucket in buckets],
+    }
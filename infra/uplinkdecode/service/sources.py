@@ -0,0 +1,128 @@
+"""
+Uplink sources of the uplink service.
+
+A source is an iterable of at_uplink events (or bare uplinks) that stops
+once close() is called or, for finite sources, when it runs dry. Reading
+blocks while the service's worker queues are full, which pushes back on the
+source: the file is read no further, MQTT messages stay with the broker.
+"""
+import json
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+# Seconds a blocked read waits before checking whether the source was closed
+POLL_INTERVAL = 0.1
+
+
+class QueueSource:
+    """In-memory source, events are handed over with put()."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.queue: 'queue.Queue[Optional[Dict]]' = queue.Queue(maxsize)
+        self.closed = threading.Event()
+
+    def put(self, event: Dict, timeout: Optional[float] = None):
+        self.queue.put(event, timeout=timeout)
+
+    def close(self):
+        """Stops the source once the events already put are read."""
+        self.closed.set()
+
+    def __iter__(self) -> Iterator[Dict]:
+        while True:
+            try:
+                yield self.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.closed.is_set():
+                    return
+
+
+class FileTailSource:
+    """
+    JSON lines file of events, e.g. written by bench/traffic.py. With
+    follow, lines appended later are read as well until close().
+    """
+
+    def __init__(self, path: str, follow: bool = False):
+        self.path = path
+        self.follow = follow
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.path) as f:
+            partial = ''
+            while not self.closed.is_set():
+                line = f.readline()
+                if not line:
+                    if not self.follow:
+                        return
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                # a line still being written is completed by the next read
+                partial += line
+                if not partial.endswith('\n') and self.follow:
+                    continue
+                line, partial = partial.strip(), ''
+                if line:
+                    yield json.loads(line)
+
+
+class MqttSource:
+    """
+    Subscribes to a topic of an MQTT broker, e.g. on a site gateway.
+
+    Messages are received on paho-mqtt's network thread into a bounded queue;
+    while it is full that thread blocks and stops reading from the broker.
+    Requires the paho-mqtt package.
+    """
+
+    def __init__(self, host: str, topic: str, port: int = 1883, qos: int = 1, client_id: str = '',
+                 maxsize: int = 10000):
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError as e:
+            raise RuntimeError('MqttSource requires the paho-mqtt package') from e
+        self.topic = topic
+        self.qos = qos
+        self.queue: 'queue.Queue[Dict]' = queue.Queue(maxsize)
+        self.closed = threading.Event()
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = lambda client, userdata, flags, rc, *args: client.subscribe(self.topic, self.qos)
+        self.client.on_message = self._on_message
+        self.client.connect(host, port)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, message):
+        self.queue.put(json.loads(message.payload))
+
+    def close(self):
+        self.closed.set()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def __iter__(self) -> Iterator[Dict]:
+        while True:
+            try:
+                yield self.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.closed.is_set():
+                    return
+
+
+def open_source(spec: str, follow: bool = False):
+    """
+    Opens a source from its command line form: a file path,
+    mqtt://host[:port]/topic, or 'queue' for an in-memory QueueSource.
+    """
+    if spec == 'queue':
+        return QueueSource()
+    url = urlparse(spec)
+    if url.scheme == 'mqtt':
+        return MqttSource(url.hostname, url.path.lstrip('/') or '#', port=url.port or 1883)
+    return FileTailSource(url.path if url.scheme == 'file' else spec, follow=follow)
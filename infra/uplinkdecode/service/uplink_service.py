@@ -0,0 +1,284 @@
+"""
+Long-running uplink service, running the at-decode logic outside of Lambda.
+
+Events are read from a source (see sources.py) and dispatched to a pool of
+worker processes, sharded on WirelessDeviceId so all fragments of a device
+reach the same worker and are reassembled there. Each worker loads
+at-decode.py once and feeds its uplinks to batch_handler in micro-batches, so
+caches, device state and client connections stay warm for the life of the
+process. Uplinks failing in a batch are retried up to --retries times, all
+uplinks of a batch when batch_handler raises.
+
+Worker queues are bounded: when a worker falls behind the dispatcher blocks
+and stops reading the source. SIGINT / SIGTERM stop reading, the workers
+finish the uplinks already queued and flush before exiting. A worker process
+that dies is restarted on its queue, up to --max-restarts times in total,
+then the service fails; the uplinks of its batch in flight are lost, as is
+its fragment buffer.
+
+Configuration of the decode logic comes from the same environment variables
+as the Lambda (see template.yml), AWS credentials from the default chain.
+
+    python service/uplink_service.py trace.jsonl --workers 4
+    python service/uplink_service.py mqtt://localhost/sidewalk/uplinks --workers 8
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sources import open_source  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER_PATH = os.path.join(ROOT, 'lambda', 'at_common', 'python')
+DECODE_HANDLER = os.path.join(ROOT, 'lambda', 'at_decode', 'at-decode.py')
+
+
+def load_decode():
+    """Imports at-decode.py with the UplinkCommon layer on the path."""
+    if LAYER_PATH not in sys.path:
+        sys.path.insert(0, LAYER_PATH)
+    if 'at_decode' in sys.modules:
+        return sys.modules['at_decode']
+    spec = importlib.util.spec_from_file_location('at_decode', DECODE_HANDLER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['at_decode'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def device_of(event: Dict) -> str:
+    return event.get('at_uplink', event).get('WirelessDeviceId', '')
+
+
+def shard(devid: str, workers: int) -> int:
+    """Worker of a device, stable across processes unlike hash()."""
+    return zlib.crc32(devid.encode()) % workers
+
+
+def run_worker(index: int, inbox, results, batch_size: int, linger: float, retries: int,
+               setup: Optional[Callable[[], None]] = None):
+    """
+    Worker process: decodes the events of its shard in micro-batches of up to
+    `batch_size`, waiting at most `linger` seconds to fill one. A None event
+    drains the worker.
+    """
+    # the dispatcher handles the signals, workers stop on the None event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if setup is not None:
+        setup()
+    # metrics aggregated across batches, flushed every minute and on exit
+    os.environ.setdefault('METRICS_FLUSH_INTERVAL', '60')
+    decode = load_decode()
+    stats = {'worker': index, 'uplinks': 0, 'batches': 0, 'errors': 0, 'retried': 0, 'failed': 0, 'seconds': 0.0}
+    retry: List[Dict] = []
+    draining = False
+    sequence = 0
+
+    while not draining or retry:
+        batch = retry[:batch_size]
+        del retry[:len(batch)]
+        deadline = time.monotonic() + linger
+        while not draining and len(batch) < batch_size:
+            try:
+                event = inbox.get(timeout=max(deadline - time.monotonic(), 0) if batch else None)
+            except queue.Empty:
+                break
+            if event is None:
+                draining = True
+                break
+            sequence += 1
+            # unique ids let batch_handler report failures per uplink
+            batch.append({**event, 'messageId': f'{index}-{sequence}', 'attempts': 0})
+        if not batch:
+            continue
+
+        started = time.perf_counter()
+        try:
+            response = decode.batch_handler({'Records': batch}, None)
+        except Exception as e:
+            # every uplink of the batch failed, batch_handler released their sequence numbers
+            decode.logger.error('Error processing batch', worker=index, uplinks=len(batch), error=str(e))
+            response = {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in batch]}
+            stats['errors'] += 1
+        stats['seconds'] += time.perf_counter() - started
+        stats['batches'] += 1
+        failed = {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+        for record in batch:
+            if record['messageId'] not in failed:
+                stats['uplinks'] += 1
+            elif record['attempts'] < retries:
+                retry.append({**record, 'attempts': record['attempts'] + 1})
+                stats['retried'] += 1
+            else:
+                stats['failed'] += 1
+                decode.logger.error('Dropping uplink after retries', devid=device_of(record),
+                                    attempts=record['attempts'] + 1)
+
+    decode.metrics.flush()
+    stats['fragments'] = decode.fragment_buffer.stats()
+    stats['duplicates'] = decode.uplink_filter.stats()
+    results.put(stats)
+
+
+class WorkerFailed(Exception):
+    """Workers kept dying, more than max_restarts restarts were needed."""
+
+
+class UplinkService:
+    """
+    Dispatches the events of a source to `workers` decode processes.
+
+    Each worker has a queue of at most `queue_size` events; put() blocks
+    while the target worker's queue is full. `setup` runs in every worker
+    before the decode module is loaded, e.g. to install fake clients.
+
+    While blocked, put() and drain() check every `poll_interval` seconds
+    that the workers are alive (see supervise).
+    """
+
+    def __init__(self, workers: int = os.cpu_count() or 1, batch_size: int = 25, linger: float = 0.05,
+                 queue_size: int = 1000, retries: int = 2, drain_timeout: float = 30.0,
+                 setup: Optional[Callable[[], None]] = None, max_restarts: int = 3, poll_interval: float = 1.0):
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.max_restarts = max_restarts
+        self.poll_interval = poll_interval
+        self.dispatched = 0
+        self.restarts = 0
+        self.stopping = threading.Event()
+        self._context = multiprocessing.get_context()
+        self._worker_args = (batch_size, linger, retries, setup)
+        self.results = self._context.Queue()
+        self.inboxes = [self._context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [self._process(i) for i in range(workers)]
+
+    def _process(self, index: int):
+        return self._context.Process(target=run_worker, name=f'uplink-worker-{index}', daemon=True,
+                                     args=(index, self.inboxes[index], self.results, *self._worker_args))
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def supervise(self) -> List[int]:
+        """
+        Restarts the workers that died, on the queue they left, and returns
+        their indexes. A worker that exited normally has drained.
+
+        Raises:
+        WorkerFailed: When that takes more than max_restarts restarts.
+        """
+        restarted = []
+        for index, process in enumerate(self.processes):
+            if process.exitcode in (None, 0):
+                continue
+            if self.restarts >= self.max_restarts:
+                raise WorkerFailed(f'{process.name} exited with {process.exitcode}, '
+                                   f'{self.restarts} workers restarted already')
+            print(f'{process.name} exited with {process.exitcode}, restarting', file=sys.stderr)
+            self.restarts += 1
+            self.processes[index] = self._process(index)
+            self.processes[index].start()
+            restarted.append(index)
+        return restarted
+
+    def _put(self, index: int, event: Optional[Dict]):
+        while True:
+            try:
+                self.inboxes[index].put(event, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                self.supervise()
+
+    def put(self, event: Dict):
+        self._put(shard(device_of(event), self.workers), event)
+        self.dispatched += 1
+
+    def run(self, source: Iterable[Dict]) -> List[Dict]:
+        """Dispatches events until the source ends or stop() is called, then drains."""
+        self.start()
+        try:
+            for event in source:
+                self.put(event)
+                if self.stopping.is_set():
+                    break
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+        return self.drain()
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def drain(self) -> List[Dict]:
+        """
+        Lets every worker finish its queue and returns their stats. Workers
+        still busy after `drain_timeout` seconds are terminated.
+        """
+        for index in range(self.workers):
+            self._put(index, None)
+        deadline = time.monotonic() + self.drain_timeout
+        stats = []
+        while len(stats) < self.workers and time.monotonic() < deadline:
+            try:
+                stats.append(self.results.get(timeout=min(self.poll_interval, max(deadline - time.monotonic(), 0.01))))
+            except queue.Empty:
+                # a worker that died may have taken its None with it
+                for index in self.supervise():
+                    self._put(index, None)
+        for process in self.processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f'{process.name} did not drain in time, terminating', file=sys.stderr)
+                process.terminate()
+        return sorted(stats, key=lambda s: s['worker'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='JSON lines file, mqtt://host[:port]/topic')
+    parser.add_argument('--follow', action='store_true', help='keep reading lines appended to the file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch', type=int, default=25, help='uplinks per batch_handler call')
+    parser.add_argument('--linger', type=float, default=50, help='ms a worker waits to fill a batch')
+    parser.add_argument('--queue-size', type=int, default=1000, help='events queued per worker')
+    parser.add_argument('--retries', type=int, default=2, help='retries of a failed uplink')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='seconds to finish queued uplinks')
+    parser.add_argument('--max-restarts', type=int, default=3, help='worker restarts before the service fails')
+    args = parser.parse_args()
+
+    service = UplinkService(args.workers, args.batch, args.linger / 1000, args.queue_size, args.retries,
+                            args.drain_timeout, max_restarts=args.max_restarts)
+    source = open_source(args.source, follow=args.follow)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: (service.stop(), source.close()))
+
+    started = time.perf_counter()
+    stats = service.run(source)
+    elapsed = time.perf_counter() - started
+    uplinks = sum(s['uplinks'] for s in stats)
+    print(json.dumps({
+        'dispatched': service.dispatched,
+        'uplinks': uplinks,
+        'failed': sum(s['failed'] for s in stats),
+        'restarts': service.restarts,
+        'seconds': round(elapsed, 3),
+        'throughput': round(uplinks / elapsed, 1) if elapsed else 0.0,
+        'workers': stats,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# at_common is deployed as a Lambda layer, the bench helpers build frames and fake AWS clients
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda', 'at_common', 'python'), os.path.join(ROOT, 'bench')]
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from at_common.apindex import AccessPointIndex
+
+SITE = (47.6, -122.3)
+
+
+def scan(*aps):
+    return [{'MacAddress': mac, 'Rss': rss} for mac, rss in aps]
+
+
+def point(latitude, longitude, accuracy=10.0):
+    return {'coordinates': [longitude, latitude], 'type': 'Point', 'properties': {'horizontalAccuracy': accuracy}}
+
+
+def test_unknown_scans_are_solved_remotely_and_learned():
+    index = AccessPointIndex()
+    aps = scan(('AA:00:00:00:00:01', -60), ('aa:00:00:00:00:02', -70))
+    solves = []
+    location = index.get_or_solve(aps, lambda: solves.append(1) or point(*SITE))
+    assert location == point(*SITE)
+    repeated = index.get_or_solve(aps, lambda: solves.append(1) or point(*SITE))
+    assert len(solves) == 1
+    assert repeated['properties']['source'] == 'local'
+    assert repeated['coordinates'] == pytest.approx([SITE[1], SITE[0]])
+    assert index.stats() == {'size': 2, 'local': 1, 'remote': 1}
+
+
+def test_estimate_is_the_rssi_weighted_centroid():
+    index = AccessPointIndex(max_accuracy=1000)
+    index.seed([{'mac': 'a', 'latitude': 47.600, 'longitude': -122.3, 'accuracy': 5},
+                {'mac': 'b', 'latitude': 47.601, 'longitude': -122.3, 'accuracy': 5}])
+    even = index.estimate(scan(('a', -60), ('b', -60)))
+    assert even['coordinates'][1] == pytest.approx(47.6005)
+    closer_to_a = index.estimate(scan(('a', -50), ('b', -70)))
+    assert 47.600 < closer_to_a['coordinates'][1] < 47.6005
+    # 111 m apart, half of that from the centroid, plus the access points' own accuracy
+    assert even['properties']['horizontalAccuracy'] == pytest.approx(55.9, abs=0.5)
+
+
+def test_too_few_or_too_spread_access_points_are_not_solved_locally():
+    index = AccessPointIndex(min_aps=2, max_accuracy=100)
+    index.seed([{'mac': 'a', 'latitude': 47.60, 'longitude': -122.3},
+                {'mac': 'b', 'latitude': 47.61, 'longitude': -122.3}])
+    assert index.estimate(scan(('a', -60), ('c', -60))) is None
+    assert index.estimate(scan(('a', -60), ('b', -60))) is None
+
+
+def test_least_recently_seen_access_points_are_evicted():
+    index = AccessPointIndex(max_entries=2)
+    index.learn(scan(('a', -60), ('b', -60)), point(*SITE))
+    index.learn(scan(('a', -60)), point(*SITE))
+    index.learn(scan(('c', -60)), point(*SITE))
+    assert index.estimate(scan(('a', -60), ('b', -60))) is None
+    assert index.estimate(scan(('a', -60), ('c', -60))) is not None
+
+
+def test_disabled_index_always_solves_remotely(tmp_path):
+    seeds = tmp_path / 'aps.jsonl'
+    seeds.write_text(''.join(json.dumps({'mac': mac, 'latitude': 47.6, 'longitude': -122.3}) + '\n'
+                             for mac in 'ab'))
+    index = AccessPointIndex(max_entries=0)
+    index.load(str(seeds))
+    index.learn(scan(('a', -60), ('b', -60)), point(*SITE))
+    assert len(index) == 0
+    assert index.estimate(scan(('a', -60), ('b', -60))) is None
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from at_common import batch
+from at_common.batch import MIN_VECTOR_GROUP, decode_batch
+from at_common.frames import AP_RECORD, GNSS, GNSS_INFO, GNSS_LAST_FRAG, NOLOC, SENSOR, WIFI, FrameError, decode_frame
+
+pytest.importorskip('numpy')
+
+
+def header(uplink_t, num_msg=1, frag_num=0):
+    return bytes([uplink_t << 6 | num_msg << 3 | frag_num])
+
+
+def random_frames(rng, count):
+    """`count` frames of every layout, the fixed length ones at the lengths numpy decodes."""
+    def sensor():
+        return SENSOR.pack(rng.randrange(256), rng.randrange(-128, 128), rng.randrange(256), rng.randrange(256))
+
+    def aps(n):
+        return b''.join(AP_RECORD.pack(rng.randrange(-128, 0), rng.randbytes(6)) for _ in range(n))
+
+    frames = []
+    for _ in range(count):
+        capture_time = rng.randrange(1 << 48)
+        frames += [
+            header(NOLOC) + sensor(),
+            header(WIFI) + sensor() + aps(2),
+            header(WIFI, 2, 0) + sensor() + aps(2),
+            header(WIFI, 2, 1) + aps(rng.randint(1, 2)),
+            header(GNSS, 3, 0) + sensor() + GNSS_INFO.pack(36, capture_time >> 32, capture_time & 0xFFFFFFFF),
+            header(GNSS, 3, 1) + rng.randbytes(18),
+            header(GNSS, 3, GNSS_LAST_FRAG) + rng.randbytes(rng.randint(1, 18)),
+        ]
+    rng.shuffle(frames)
+    return frames
+
+
+def test_vectorized_decoding_matches_the_struct_codec():
+    payloads = random_frames(random.Random(1), 3 * MIN_VECTOR_GROUP)
+    assert decode_batch(payloads) == [decode_frame(data) for data in payloads]
+
+
+def test_small_groups_and_missing_numpy_use_the_struct_codec(monkeypatch):
+    def columns(*args):
+        raise AssertionError('decoded with numpy')
+
+    monkeypatch.setattr(batch, 'decode_columns', columns)
+    payloads = random_frames(random.Random(2), MIN_VECTOR_GROUP - 1)
+    assert decode_batch(payloads) == [decode_frame(data) for data in payloads]
+
+    monkeypatch.setattr(batch, 'DTYPES', {})
+    payloads = random_frames(random.Random(3), 2 * MIN_VECTOR_GROUP)
+    assert decode_batch(payloads) == [decode_frame(data) for data in payloads]
+
+
+def test_bad_frames_are_returned_in_place():
+    payloads = random_frames(random.Random(4), MIN_VECTOR_GROUP)
+    payloads[3:3] = [b'', header(WIFI) + SENSOR.pack(1, 2, 3, 4)]
+    results = decode_batch(payloads)
+    assert isinstance(results[3], FrameError)
+    assert isinstance(results[4], FrameError)
+    assert results[:3] + results[5:] == [decode_frame(data) for data in payloads[:3] + payloads[5:]]
@@ -0,0 +1,162 @@
+import time
+
+from at_common.dedupe import DuplicateFilter, DynamoDBSeqBackend, SequenceWindow
+from at_common.reassembly import SEQ_MODULUS
+
+
+class Backend:
+    """Claims pairs in memory, like DynamoDBSeqBackend does in the table."""
+
+    def __init__(self):
+        self.claimed = set()
+        self.promoted = set()
+
+    def claim(self, devid, seq):
+        if (devid, seq) in self.claimed:
+            return False
+        self.claimed.add((devid, seq))
+        return True
+
+    def promote(self, devid, seq):
+        self.promoted.add((devid, seq))
+
+    def release(self, devid, seq):
+        self.claimed.discard((devid, seq))
+
+
+class ConditionalCheckFailed(Exception):
+    response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+class Client:
+    """put_item, update_item and delete_item of at-dedupe items, honouring the condition of claim()."""
+
+    def __init__(self):
+        self.expires = {}
+
+    def put_item(self, TableName, Item, ExpressionAttributeValues, **kwargs):
+        key = (Item['WirelessDeviceId']['S'], Item['seq']['N'])
+        if key in self.expires and self.expires[key] >= int(ExpressionAttributeValues[':now']['N']):
+            raise ConditionalCheckFailed()
+        self.expires[key] = int(Item['expires']['N'])
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        self.expires[(Key['WirelessDeviceId']['S'], Key['seq']['N'])] = int(ExpressionAttributeValues[':expires']['N'])
+
+    def delete_item(self, TableName, Key):
+        self.expires.pop((Key['WirelessDeviceId']['S'], Key['seq']['N']), None)
+
+
+def test_window_drops_repeats_and_accepts_reordered_numbers():
+    window = SequenceWindow(10, size=8)
+    assert window.add(12) is True
+    assert window.add(11) is True
+    assert window.add(11) is False
+    assert window.add(10) is False
+    assert window.add(12) is False
+
+
+def test_window_slides_across_the_wrap():
+    window = SequenceWindow(SEQ_MODULUS - 2, size=8)
+    assert window.add(1) is True
+    assert window.add(SEQ_MODULUS - 1) is True
+    assert window.add(SEQ_MODULUS - 2) is False
+    assert window.add(0) is True
+    assert window.add(1) is False
+
+
+def test_stale_numbers_leave_the_window_alone():
+    window = SequenceWindow(100, size=8)
+    window.add(99)
+    assert window.add(50) is None
+    assert window.add(100 + SEQ_MODULUS // 2) is None
+    assert window.top == 100
+    assert window.add(99) is False
+    assert window.add(100) is False
+
+
+def test_released_numbers_get_through_again():
+    window = SequenceWindow(10, size=8)
+    window.add(9)
+    window.discard(9)
+    assert window.add(9) is True
+    assert window.add(9) is False
+
+
+def test_filter_drops_duplicates_within_a_batch():
+    dedupe = DuplicateFilter(window=8)
+    assert dedupe.check_many([('a', 1, True), ('a', 1, True), ('b', 1, True), ('a', 2, True)]) == \
+        [True, False, True, True]
+    assert dedupe.stats()['duplicates'] == 1
+
+
+def test_filter_lets_stale_numbers_through():
+    dedupe = DuplicateFilter(window=8)
+    dedupe.check('a', 100)
+    assert dedupe.check('a', 10) is True
+    assert dedupe.check('a', 10) is True
+    assert dedupe.stats()['stale'] == 2
+
+
+def test_backend_catches_duplicates_delivered_to_another_container():
+    backend = Backend()
+    dedupe = DuplicateFilter(window=8, backend=backend)
+    other = DuplicateFilter(window=8, backend=backend)
+    assert dedupe.check('a', 100) is True
+    assert other.check('a', 100) is False
+    assert dedupe.stats()['remote_duplicates'] == 0
+    assert other.stats()['remote_duplicates'] == 1
+    # unconfirmed uplinks are not claimed
+    assert dedupe.check('a', 101, confirm=False) is True
+    assert ('a', 101) not in backend.claimed
+
+
+def test_stale_numbers_are_claimed_in_the_backend():
+    backend = Backend()
+    dedupe = DuplicateFilter(window=8, backend=backend)
+    dedupe.check('a', 100)
+    assert dedupe.check('a', 10) is True
+    assert dedupe.check('a', 10) is False
+    assert dedupe.stats()['stale'] == 2
+    assert dedupe.stats()['remote_duplicates'] == 1
+
+
+def test_release_of_the_top_number_lets_the_retry_through():
+    window = SequenceWindow(10, size=8)
+    window.discard(10)
+    assert window.add(10) is True
+    assert window.add(10) is False
+
+    backend = Backend()
+    dedupe = DuplicateFilter(window=8, backend=backend)
+    assert dedupe.check('a', 5) is True
+    assert dedupe.check('a', 6) is True
+    dedupe.release('a', 6)
+    assert ('a', 6) not in backend.claimed
+    assert dedupe.check('a', 6) is True
+    assert dedupe.check('a', 6) is False
+
+
+def test_claims_are_leases_until_their_uplink_is_processed(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    backend = DynamoDBSeqBackend(ttl=86400, lease=60, client=Client())
+    assert backend.claim('a', 1)
+    assert not backend.claim('a', 1)
+    # the invocation holding the claim timed out, its retry is processed
+    now[0] += 61
+    assert backend.claim('a', 1)
+    backend.promote('a', 1)
+    now[0] += 3600
+    assert not backend.claim('a', 1)
+    backend.release('a', 1)
+    assert backend.claim('a', 1)
+
+
+def test_completed_uplinks_keep_their_claims():
+    backend = Backend()
+    dedupe = DuplicateFilter(window=8, backend=backend)
+    assert dedupe.check_many([('a', 1, True), ('a', 2, False)]) == [True, True]
+    dedupe.complete_many([('a', 1, True), ('a', 2, False)])
+    assert backend.promoted == {('a', 1)}
+    DuplicateFilter(window=8).complete('a', 3)
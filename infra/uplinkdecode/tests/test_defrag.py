@@ -0,0 +1,53 @@
+import pytest
+
+from at_common.frames import AP_RECORD, SENSOR, WIFI, decode_frame
+from at_common.items import decode_image, encode_item
+from at_common.resolver import ResolverUnavailable
+from handlers import load_handler
+
+SENSOR_BLOCK = SENSOR.pack(87, -5, 40, 0x80 | 23)
+WIFI_F = bytes([WIFI << 6 | 2 << 3]) + SENSOR_BLOCK + AP_RECORD.pack(-61, bytes.fromhex('aabbccddee01'))
+WIFI_END = bytes([WIFI << 6 | 2 << 3 | 1]) + AP_RECORD.pack(-75, bytes.fromhex('aabbccddee02'))
+
+
+class Queue:
+    def __init__(self):
+        self.messages = []
+
+    def defer(self, message):
+        self.messages.append(message)
+
+
+def unavailable(*args):
+    raise ResolverUnavailable('Circuit open')
+
+
+@pytest.fixture
+def at_defrag(monkeypatch):
+    at_defrag = load_handler('defrag')
+    monkeypatch.setattr(at_defrag, 'deferred_solves', Queue())
+    monkeypatch.setattr(at_defrag.position_cache, 'get_or_solve', unavailable)
+    return at_defrag
+
+
+def record(image):
+    return {'dynamodb': {'NewImage': image, 'SequenceNumber': '1'}}
+
+
+def test_deferred_solve_is_timed_by_the_first_fragment(at_defrag, monkeypatch):
+    first = decode_image(encode_item('dev', 1000, 10, decode_frame(WIFI_F)))
+    end = encode_item('dev', 2000, 11, decode_frame(WIFI_END))
+    monkeypatch.setattr(at_defrag.fragment_store, 'fetch', lambda _: [first, decode_image(end)])
+    at_defrag.process_record(record(end))
+    message, = at_defrag.deferred_solves.messages
+    assert (message['kind'], message['location_timestamp'], message['battery']) == ('WIFI', 1000, 87)
+
+
+def test_deferred_solve_without_the_first_fragment_is_timed_by_the_end(at_defrag, monkeypatch):
+    # the fragment before the END is one of an older message with the same sequence number
+    stale = decode_image(encode_item('dev', 500, 10, decode_frame(WIFI_END)))
+    end = encode_item('dev', 2000, 11, decode_frame(WIFI_END))
+    monkeypatch.setattr(at_defrag.fragment_store, 'fetch', lambda _: [stale, decode_image(end)])
+    at_defrag.process_record(record(end))
+    message, = at_defrag.deferred_solves.messages
+    assert (message['timestamp'], message['location_timestamp'], message['battery']) == (2000, 2000, None)
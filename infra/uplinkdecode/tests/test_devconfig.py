@@ -0,0 +1,85 @@
+import pytest
+
+from at_common.devconfig import DeviceConfig, DeviceConfigStore, DynamoDBConfigBackend, LocalConfigBackend
+from at_common.frames import Settings
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConditionalCheckFailed(Exception):
+    response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+class Client:
+    """update_item and batch_get_item over {devid: item}, honouring the 'updated' condition of save()."""
+
+    def __init__(self):
+        self.items = {}
+        self.batch_gets = 0
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        item = self.items.setdefault(Key['WirelessDeviceId']['S'], dict(Key))
+        stored = item.get('config', {}).get('M', {}).get('updated')
+        if stored is not None and int(stored['N']) >= int(ExpressionAttributeValues[':u']['N']):
+            raise ConditionalCheckFailed()
+        item['config'] = ExpressionAttributeValues[':c']
+
+    def batch_get_item(self, RequestItems):
+        self.batch_gets += 1
+        (table, request), = RequestItems.items()
+        found = [self.items[key['WirelessDeviceId']['S']] for key in request['Keys']
+                 if key['WirelessDeviceId']['S'] in self.items]
+        return {'Responses': {table: found}}
+
+
+def config(updated, interval=600):
+    return DeviceConfig.from_settings(Settings('MOTION', interval, 2, 4, 'always'), updated)
+
+
+@pytest.mark.parametrize('backend', [LocalConfigBackend, lambda: DynamoDBConfigBackend(client=Client())])
+def test_older_settings_do_not_replace_newer_ones(backend):
+    backend = backend()
+    assert backend.save('dev', config(2000))
+    assert not backend.save('dev', config(1000, interval=60))
+    assert not backend.save('dev', config(2000, interval=60))
+    assert backend.load_many(['dev', 'other']) == {'dev': config(2000)}
+
+
+def test_devices_without_settings_are_cached_for_the_negative_ttl():
+    clock = Clock()
+    client = Client()
+    store = DeviceConfigStore(DynamoDBConfigBackend(client=client), ttl=300, negative_ttl=60, clock=clock)
+    assert store.get('dev') is None
+    assert store.get('dev') is None
+    assert client.batch_gets == 1
+    DynamoDBConfigBackend(client=client).save('dev', config(1000))
+    clock.now = 61
+    assert store.get('dev') == config(1000)
+    clock.now = 300
+    assert store.get('dev') == config(1000)
+    assert client.batch_gets == 2
+
+
+def test_prefetch_loads_the_devices_not_cached_with_one_call():
+    client = Client()
+    store = DeviceConfigStore(DynamoDBConfigBackend(client=client))
+    store.update('a', config(1000))
+    assert store.prefetch(['a', 'b', 'c', 'b']) == 2
+    assert client.batch_gets == 1
+    assert store.prefetch(['a', 'b', 'c']) == 0
+    assert store.get('b') is None
+    assert client.batch_gets == 1
+
+
+def test_update_rejected_as_older_rereads_the_stored_settings():
+    client = Client()
+    store = DeviceConfigStore(DynamoDBConfigBackend(client=client))
+    DynamoDBConfigBackend(client=client).save('dev', config(2000))
+    assert not store.update('dev', config(1000, interval=60))
+    assert store.get('dev') == config(2000)
@@ -0,0 +1,82 @@
+import sys
+import threading
+
+import pytest
+
+from at_common.devstate import DeviceState, DeviceStateStore, LocalStateBackend
+from at_common.frames import Sensor
+
+LOCATION = {'latitude': 47.6, 'longitude': -122.3, 'accuracy': {'horizontal': 25.0}}
+MOVING = Sensor(87, -5, 40, True, 2.3)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fixes_are_written_when_other_containers_would_act_on_them():
+    backend = LocalStateBackend()
+    store = DeviceStateStore(backend, max_fix_age=3600, clock=Clock())
+    assert store.record_fix('dev', 1_000_000, LOCATION)
+    assert store.flush() == 1
+    # a few metres away, well within the accuracy
+    assert store.record_fix('dev', 1_060_000, dict(LOCATION, latitude=47.60001))
+    assert store.flush() == 0
+    assert backend.states['dev'].fix_timestamp == 1_000_000
+    assert store.get('dev').fix_timestamp == 1_060_000
+    # an older fix never replaces a newer one
+    assert not store.record_fix('dev', 1_030_000, LOCATION)
+    store.observe('dev', 1_120_000, MOVING)
+    assert store.flush() == 1
+    assert backend.states['dev'].moved
+
+
+def test_the_last_fix_is_reused_while_the_device_reports_no_motion():
+    store = DeviceStateStore(LocalStateBackend(), max_fix_age=3600, clock=Clock())
+    assert store.reusable_fix('dev', 1_000_000) is None
+    store.record_fix('dev', 1_000_000, LOCATION)
+    assert store.reusable_fix('dev', 1_060_000) == store.get('dev')
+    assert store.reusable_fix('dev', 1_060_000, policy='always') is None
+    assert store.reusable_fix('dev', 1_000_000 + 3_601_000) is None
+    store.observe('dev', 1_120_000, MOVING)
+    assert store.reusable_fix('dev', 1_180_000) is None
+    assert store.stats()['reused'] == 1
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_fixes_and_sensor_blocks_are_not_lost(switch_often):
+    store = DeviceStateStore(LocalStateBackend(), clock=Clock())
+    store.get('dev')
+    start = threading.Barrier(8)
+    stored = []
+
+    def report(worker):
+        start.wait()
+        for i in range(500):
+            timestamp = (i * 8 + worker) * 1000
+            if worker % 2:
+                store.observe('dev', timestamp, MOVING)
+            else:
+                stored.append(store.record_fix('dev', timestamp, LOCATION))
+
+    threads = [threading.Thread(target=report, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state = store.get('dev')
+    assert state.fix_timestamp == 3_998_000
+    assert state.motion_timestamp == 3_999_000
+    assert store.stats()['solved'] == sum(stored)
+    assert state == DeviceState(47.6, -122.3, 25.0, 3_998_000, 87, True, 3_999_000)
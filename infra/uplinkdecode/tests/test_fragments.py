@@ -0,0 +1,58 @@
+import pytest
+
+from at_common.fragments import FragmentStore, seq_ranges
+from at_common.frames import decode_frame
+from at_common.items import COMPACT, FRAGMENT_BUCKET_MS, LEGACY, decode_image, encode_item
+from at_common.reassembly import SEQ_MODULUS
+from fakes import FakeDynamoDB
+from traffic import gnss_frames, noloc_frames, sensor_block
+
+SENSOR = sensor_block(90, 21, 40, False, 0.0)
+# three nav fragments, a message of four frames
+NAV = bytes(range(50))
+
+
+def write_message(db, devid, first_seq, timestamp, version=COMPACT):
+    """Writes the items of a GNSS message one second apart, returns the END record."""
+    items = []
+    for i, data in enumerate(gnss_frames(SENSOR, NAV, 1_700_000_000)):
+        items.append(encode_item(devid, timestamp + i * 1000, (first_seq + i) % SEQ_MODULUS, decode_frame(data),
+                                 version=version))
+    for item in items:
+        db.put_item(TableName='at-payloads', Item=item)
+    return decode_image(items[-1])
+
+
+def test_seq_ranges_split_at_the_wrap():
+    assert seq_ranges(10, 13) == [(10, 13)]
+    assert seq_ranges(SEQ_MODULUS - 2, 1) == [(SEQ_MODULUS - 2, SEQ_MODULUS - 1), (0, 1)]
+
+
+@pytest.mark.parametrize('version', [COMPACT, LEGACY])
+def test_fetch_finds_only_the_fragments_of_the_message(version):
+    db = FakeDynamoDB()
+    store = FragmentStore(client=db, retry_delay=0)
+    earlier = write_message(db, 'dev', 96, 1_000_000, version)
+    end = write_message(db, 'dev', 100, 1_010_000, version)
+    write_message(db, 'other', 100, 1_010_000, version)
+    db.put_item(TableName='at-payloads', Item=encode_item('dev', 1_005_000, 104, decode_frame(noloc_frames(SENSOR)[0])))
+
+    fragments = store.fetch(end)
+    assert [item.seq for item in fragments] == [100, 101, 102, 103]
+    assert {item.devid for item in fragments} == {'dev'}
+    assert [item.frame.type for item in fragments] == ['GNSS', 'GNSS_F', 'GNSS_F', 'GNSS_END']
+    assert ''.join(item.frame.nav_frag for item in fragments[1:]) == NAV.hex()
+    assert [item.seq for item in store.fetch(earlier)] == [96, 97, 98, 99]
+
+
+def test_fetch_orders_fragments_across_the_wrap_and_a_bucket_boundary():
+    db = FakeDynamoDB()
+    store = FragmentStore(client=db, retry_delay=0)
+    first_seq = SEQ_MODULUS - 2
+    end = write_message(db, 'dev', first_seq, 3 * FRAGMENT_BUCKET_MS - 2000)
+
+    fragments = store.fetch(end)
+    assert [item.seq for item in fragments] == [SEQ_MODULUS - 2, SEQ_MODULUS - 1, 0, 1]
+    assert fragments[0].frame.type == 'GNSS'
+    assert fragments[-1] == end
+    assert db.calls['query'] == 4
@@ -0,0 +1,131 @@
+import base64
+import random
+
+import pytest
+
+import traffic
+from at_common import frames
+from at_common.frames import (
+    AP_RECORD, CONFIG, CONFIG_BLOCK, GNSS, GNSS_INFO, GNSS_LAST_FRAG, NOLOC, RESOLVE_POLICIES, REPORTING_MODES, SENSOR,
+    UPLINK_TYPES, WIFI, AccessPoint, FrameError, GnssInfo, Sensor, Settings, decode_frame, decode_payload,
+)
+
+SENSOR_BLOCK = SENSOR.pack(87, -5, 40, 0x80 | 23)
+APS = AP_RECORD.pack(-61, bytes.fromhex('aabbccddee01')) + AP_RECORD.pack(-75, bytes.fromhex('aabbccddee02'))
+
+
+def header(uplink_t, num_msg=1, frag_num=0):
+    return bytes([uplink_t << 6 | num_msg << 3 | frag_num])
+
+
+def test_decode_payload_undoes_base64_and_hex():
+    frame = header(NOLOC) + SENSOR_BLOCK
+    assert decode_payload(base64.b64encode(frame.hex().encode()).decode()) == frame
+
+
+@pytest.mark.parametrize('data', ['not base64!', base64.b64encode(b'xyz').decode(), None])
+def test_malformed_payload(data):
+    with pytest.raises(FrameError):
+        decode_payload(data)
+
+
+def test_noloc_frame():
+    frame = decode_frame(header(NOLOC) + SENSOR_BLOCK)
+    assert frame.type == 'NOLOC'
+    assert frame.sensor == Sensor(87, -5, 40, True, 2.3)
+    assert frame.aps == ()
+    assert frame.gnss is None
+
+
+def test_wifi_frame():
+    frame = decode_frame(header(WIFI) + SENSOR_BLOCK + APS)
+    assert frame.type == 'WIFI'
+    assert frame.aps == (AccessPoint('aa:bb:cc:dd:ee:01', -61), AccessPoint('aa:bb:cc:dd:ee:02', -75))
+    assert frame.wifi_data() == [{'MacAddress': 'aa:bb:cc:dd:ee:01', 'Rss': -61},
+                                 {'MacAddress': 'aa:bb:cc:dd:ee:02', 'Rss': -75}]
+
+
+def test_fragmented_wifi_frames():
+    first = decode_frame(header(WIFI, 2, 0) + SENSOR_BLOCK + APS)
+    end = decode_frame(header(WIFI, 2, 1) + APS[:AP_RECORD.size])
+    assert (first.type, first.num_msg, first.frag_num) == ('WIFI_F', 2, 0)
+    assert (end.type, end.num_msg, end.frag_num) == ('WIFI_END', 2, 1)
+    assert end.sensor is None
+    assert end.aps == (AccessPoint('aa:bb:cc:dd:ee:01', -61),)
+
+
+def test_gnss_frames():
+    capture_time = 0x0123_4567_89AB
+    info = GNSS_INFO.pack(36, capture_time >> 32, capture_time & 0xFFFFFFFF)
+    first = decode_frame(header(GNSS, 3, 0) + SENSOR_BLOCK + info)
+    middle = decode_frame(header(GNSS, 3, 1) + bytes(range(18)))
+    end = decode_frame(header(GNSS, 3, GNSS_LAST_FRAG) + bytes(range(18, 36)))
+    assert first.type == 'GNSS'
+    assert first.gnss == GnssInfo(36, capture_time)
+    assert (middle.type, end.type) == ('GNSS_F', 'GNSS_END')
+    assert middle.nav_frag + end.nav_frag == bytes(range(36)).hex()
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    header(NOLOC) + SENSOR_BLOCK[:2],
+    header(WIFI) + SENSOR_BLOCK,
+    header(WIFI) + SENSOR_BLOCK + APS[:AP_RECORD.size - 1],
+    header(GNSS, 3, 0) + SENSOR_BLOCK + b'\x24',
+])
+def test_truncated_frames(data):
+    with pytest.raises(FrameError):
+        decode_frame(data)
+
+
+@pytest.fixture
+def config_settings(monkeypatch):
+    monkeypatch.setattr(frames, 'CONFIG_SETTINGS', 1)
+
+
+def test_config_frame_with_settings(config_settings):
+    frame = decode_frame(header(CONFIG) + CONFIG_BLOCK.pack(1, 600, 2, 4, 2))
+    assert frame.type == 'CONFIG'
+    assert frame.settings == Settings('MOTION', 600, 2, 4, 'always')
+
+
+def test_config_settings_are_not_decoded_by_default():
+    frame = decode_frame(header(CONFIG) + CONFIG_BLOCK.pack(1, 600, 2, 4, 2))
+    assert frame.type == 'CONFIG'
+    assert frame.settings is None
+
+
+def test_bare_config_header_carries_no_settings():
+    assert decode_frame(header(CONFIG)).settings is None
+
+
+def test_config_frame_with_unknown_setting(config_settings):
+    with pytest.raises(FrameError):
+        decode_frame(header(CONFIG) + CONFIG_BLOCK.pack(7, 600, 2, 4, 0))
+
+
+def encode(frame):
+    """The frame's bytes rebuilt from its decoded fields with the traffic generator's encoders."""
+    data = traffic.header(UPLINK_TYPES.index(frame.type.split('_')[0]), frame.num_msg, frame.frag_num)
+    if frame.sensor:
+        data += traffic.sensor_block(*frame.sensor)
+    data += traffic.ap_records((bytes.fromhex(ap.mac.replace(':', '')), ap.rssi) for ap in frame.aps)
+    if frame.gnss:
+        data += traffic.gnss_info(*frame.gnss)
+    if frame.type in ('GNSS_F', 'GNSS_END'):
+        data += bytes.fromhex(frame.nav_frag)
+    if frame.settings:
+        settings = frame.settings
+        data += traffic.settings_block(
+            REPORTING_MODES.index(settings.reporting_mode), settings.report_interval, settings.wifi_fragments,
+            settings.gnss_fragments, RESOLVE_POLICIES.index(settings.resolve_policy))
+    return data
+
+
+@pytest.mark.parametrize('kind', ['NOLOC', 'WIFI', 'WIFI_F', 'GNSS', 'CONFIG'])
+def test_generated_frames_round_trip(kind, config_settings):
+    fleet = traffic.Fleet(4, random.Random(kind), motion=0.5)
+    for i in range(50):
+        for data in fleet.message(i % 4, kind):
+            assert encode(decode_frame(data)) == data
+    assert encode(decode_frame(header(CONFIG))) == header(CONFIG)
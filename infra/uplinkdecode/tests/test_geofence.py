@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from at_common.geofence import DETAIL_TYPE, GeofenceEventPublisher, GeofenceIndex, parse_geometry, transitions
+
+# a 0.02 degree square with a 0.01 degree hole in its middle
+SQUARE = {'Polygon': [[[0.0, 0.0], [0.02, 0.0], [0.02, 0.02], [0.0, 0.02], [0.0, 0.0]],
+                      [[0.005, 0.005], [0.015, 0.005], [0.015, 0.015], [0.005, 0.015], [0.005, 0.005]]]}
+CIRCLE = {'Circle': {'Center': [0.03, 0.01], 'Radius': 500}}
+WORLD = {'Polygon': [[[-180, -90], [180, -90], [180, 90], [-180, 90], [-180, -90]]]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Events:
+    def __init__(self, failed=0):
+        self.failed = failed
+        self.calls = []
+
+    def put_events(self, Entries):
+        self.calls.append(Entries)
+        return {'FailedEntryCount': self.failed}
+
+
+def test_polygon_with_a_hole_and_circle():
+    square, circle = parse_geometry(SQUARE), parse_geometry({'circle': {'center': [0.03, 0.01], 'radius': 500}})
+    assert square.contains(0.002, 0.002)
+    assert not square.contains(0.01, 0.01)
+    assert not square.contains(0.03, 0.01)
+    assert circle.contains(0.03, 0.014)
+    assert not circle.contains(0.03, 0.015)
+    with pytest.raises(ValueError):
+        parse_geometry({'Line': []})
+
+
+def test_index_finds_the_fences_containing_a_point():
+    index = GeofenceIndex(cell_size=0.01)
+    index.load([{'GeofenceId': 'square', 'Geometry': SQUARE}, {'GeofenceId': 'circle', 'Geometry': CIRCLE},
+                {'GeofenceId': 'world', 'Geometry': WORLD}, {'GeofenceId': 'broken', 'Geometry': {}}])
+    assert index.stats()['fences'] == 3
+    assert index.stats()['large'] == 1
+    assert index.containing(0.002, 0.002) == {'square', 'world'}
+    assert index.containing(0.01, 0.01) == {'world'}
+    assert index.containing(0.031, 0.01) == {'circle', 'world'}
+
+
+def test_fences_are_reloaded_after_the_ttl_and_kept_when_that_fails():
+    clock = Clock()
+    loads = [[{'GeofenceId': 'square', 'Geometry': SQUARE}], RuntimeError('unavailable'),
+             [{'GeofenceId': 'circle', 'Geometry': CIRCLE}]]
+
+    def source():
+        result = loads.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    index = GeofenceIndex(source=source, ttl=300, clock=clock)
+    assert index.containing(0.002, 0.002) == {'square'}
+    clock.now = 301
+    assert index.containing(0.002, 0.002) == {'square'}
+    clock.now = 500
+    assert index.containing(0.002, 0.002) == {'square'}
+    clock.now = 602
+    assert index.containing(0.031, 0.01) == {'circle'}
+
+
+def test_transitions_are_exits_then_enters():
+    events = transitions('dev', frozenset({'a', 'b'}), frozenset({'b', 'c', 'd'}), 0.5, 1.5, 1_700_000_000_000)
+    assert [(event['EventType'], event['GeofenceId']) for event in events] == \
+        [('EXIT', 'a'), ('ENTER', 'c'), ('ENTER', 'd')]
+    assert events[0]['Position'] == [0.5, 1.5]
+    assert events[0]['SampleTime'] == '2023-11-14T22:13:20+00:00'
+    assert transitions('dev', frozenset({'a'}), frozenset({'a'}), 0, 0, 0) == []
+
+
+def test_events_are_sent_in_calls_of_ten():
+    client = Events()
+    publisher = GeofenceEventPublisher(client, source='asset-tracker.uplink')
+    for i in range(12):
+        publisher.add({'EventType': 'ENTER', 'GeofenceId': str(i)})
+    assert [len(entries) for entries in client.calls] == [10]
+    publisher.flush()
+    assert [len(entries) for entries in client.calls] == [10, 2]
+    entry = client.calls[1][1]
+    assert (entry['Source'], entry['DetailType']) == ('asset-tracker.uplink', DETAIL_TYPE)
+    assert json.loads(entry['Detail']) == {'EventType': 'ENTER', 'GeofenceId': '11'}
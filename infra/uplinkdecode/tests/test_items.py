@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+import pytest
+
+from at_common.frames import AP_RECORD, GNSS, GNSS_INFO, GNSS_LAST_FRAG, NOLOC, SENSOR, WIFI, decode_frame
+from at_common.items import COMPACT, LEGACY, decode_image, decode_item, encode_item, fragment_key
+
+LOCATION = {'latitude': 47.6, 'longitude': -122.3, 'accuracy': {'horizontal': 25.0}, 'source': 'WIFI'}
+SENSOR_BLOCK = SENSOR.pack(87, -5, 40, 0x80 | 23)
+FRAMES = [
+    bytes([NOLOC << 6 | 1 << 3]) + SENSOR_BLOCK,
+    bytes([WIFI << 6 | 1 << 3]) + SENSOR_BLOCK + AP_RECORD.pack(-61, bytes.fromhex('aabbccddee01')),
+    bytes([WIFI << 6 | 2 << 3 | 1]) + AP_RECORD.pack(-75, bytes.fromhex('aabbccddee02')),
+    bytes([GNSS << 6 | 3 << 3]) + SENSOR_BLOCK + GNSS_INFO.pack(36, 0x0123, 0x456789AB),
+    bytes([GNSS << 6 | 3 << 3 | 1]) + bytes(range(18)),
+    bytes([GNSS << 6 | 3 << 3 | GNSS_LAST_FRAG]) + bytes(range(18, 36)),
+]
+
+
+def comparable(frame):
+    # legacy items keep the decoded fields, not the raw frame
+    return frame._replace(data=b'', frag_num=0) if frame.type == 'GNSS_F' else frame._replace(data=b'')
+
+
+@pytest.mark.parametrize('version', [COMPACT, LEGACY])
+@pytest.mark.parametrize('data', FRAMES, ids=lambda data: decode_frame(data).type)
+def test_items_read_back_in_either_format(version, data):
+    frame = decode_frame(data)
+    record = decode_image(encode_item('dev', 1_700_000_000_000, 42, frame, LOCATION, version))
+    assert (record.devid, record.timestamp, record.seq, record.version) == ('dev', 1_700_000_000_000, 42, version)
+    assert record.location == LOCATION
+    if version == COMPACT:
+        assert record.frame == frame
+    else:
+        assert comparable(record.frame) == comparable(frame)
+        if frame.type in ('GNSS_F', 'GNSS_END'):
+            assert record.frame.nav_frag == frame.nav_frag
+
+
+def test_legacy_item_written_before_the_compact_format():
+    # as the decoder wrote it: numbers as Decimal, 'location' as str() of a dict
+    record = decode_item({
+        'WirelessDeviceId': 'dev', 'timestamp': Decimal(1000), 'seq': Decimal(7), 'type': 'WIFI',
+        'frag cnt': Decimal(1), 'battery': Decimal(87), 'temperature': Decimal(-5), 'humidity': Decimal(40),
+        'motion': 'True', 'max accel': Decimal('2.3'),
+        'wifidata': '[{"MacAddress": "aa:bb:cc:dd:ee:01", "Rss": -61}]',
+        'location': str(LOCATION),
+    })
+    assert record.version == LEGACY
+    assert record.location == LOCATION
+    assert record.frame.sensor.motion is True
+    assert record.frame.wifi_data() == [{'MacAddress': 'aa:bb:cc:dd:ee:01', 'Rss': -61}]
+
+
+def test_legacy_location_is_not_evaluated_as_code():
+    with pytest.raises(ValueError):
+        decode_item({'WirelessDeviceId': 'dev', 'timestamp': 1, 'seq': 1, 'type': 'NOLOC', 'battery': 1,
+                     'temperature': 1, 'humidity': 1, 'motion': 'False', 'max accel': 0,
+                     'location': "__import__('os').getcwd()"})
+
+
+def test_only_fragments_carry_the_fragment_key():
+    keys = {decode_frame(data).type: encode_item('dev', 1_700_000_123_456, 65535, decode_frame(data)).get('fragkey')
+            for data in FRAMES}
+    assert keys['NOLOC'] is None
+    assert keys['WIFI'] is None
+    assert keys['GNSS_END'] == {'N': str(fragment_key(1_700_000_123_456, 65535))}
+    assert fragment_key(1_700_000_123_456, 65535) + 1 == fragment_key(1_700_000_123_456 + 300_000, 0)
@@ -0,0 +1,55 @@
+from at_common.poscache import PositionCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def scan(*aps):
+    return [{'MacAddress': mac, 'Rss': rss} for mac, rss in aps]
+
+
+def test_scan_key_ignores_order_case_and_rssi_jitter():
+    cache = PositionCache(rssi_bucket=10)
+    key = cache.scan_key(scan(('AA:00:00:00:00:01', -61), ('aa:00:00:00:00:02', -75)))
+    assert cache.scan_key(scan(('aa:00:00:00:00:02', -79), ('aa:00:00:00:00:01', -62))) == key
+    assert cache.scan_key(scan(('aa:00:00:00:00:01', -51), ('aa:00:00:00:00:02', -75))) != key
+
+
+def test_get_or_solve_solves_once():
+    cache = PositionCache()
+    solves = []
+    aps = scan(('aa:00:00:00:00:01', -60))
+    for _ in range(3):
+        assert cache.get_or_solve(aps, lambda: solves.append(1) or 'position') == 'position'
+    assert len(solves) == 1
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = PositionCache(ttl=300, clock=clock)
+    cache.put(('a',), 'position')
+    clock.now = 300
+    assert cache.get(('a',)) == 'position'
+    clock.now = 300.5
+    assert cache.get(('a',)) is None
+    assert len(cache) == 0
+    assert cache.stats()['expired'] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PositionCache(max_entries=2)
+    cache.put(('a',), 1)
+    cache.put(('b',), 2)
+    cache.get(('a',))
+    cache.put(('c',), 3)
+    assert cache.get(('b',)) is None
+    assert cache.get(('a',)) == 1
+    assert cache.get(('c',)) == 3
+    assert cache.stats()['evictions'] == 1
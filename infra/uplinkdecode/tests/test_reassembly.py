@@ -0,0 +1,95 @@
+import random
+
+from at_common.frames import AP_RECORD, GNSS, GNSS_INFO, GNSS_LAST_FRAG, SENSOR, WIFI, decode_frame
+from at_common.reassembly import SEQ_MODULUS, FragmentBuffer
+
+SENSOR_BLOCK = SENSOR.pack(90, 21, 40, 0)
+NAV = bytes(range(50))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def header(uplink_t, num_msg=1, frag_num=0):
+    return bytes([uplink_t << 6 | num_msg << 3 | frag_num])
+
+
+def gnss_message():
+    """GNSS, GNSS_F, GNSS_F, GNSS_END carrying NAV in fragments of 18 bytes."""
+    frames = [header(GNSS, 4, 0) + SENSOR_BLOCK + GNSS_INFO.pack(len(NAV), 0, 1_700_000_000)]
+    frames += [header(GNSS, 4, 1) + NAV[:18], header(GNSS, 4, 2) + NAV[18:36],
+               header(GNSS, 4, GNSS_LAST_FRAG) + NAV[36:]]
+    return [decode_frame(data) for data in frames]
+
+
+def test_gnss_message_in_order():
+    buffer = FragmentBuffer()
+    frames = gnss_message()
+    results = [buffer.add('dev', 100 + i, 1000 + i, frame) for i, frame in enumerate(frames)]
+    assert results[:-1] == [None] * (len(frames) - 1)
+    message = results[-1]
+    assert message.kind == 'GNSS'
+    assert message.first_seq == 100
+    assert message.first_timestamp == 1000
+    assert message.nav_msg() == NAV.hex()
+    assert message.capture_time == 1_700_000_000
+    assert len(buffer) == 0
+
+
+def test_gnss_message_out_of_order_across_the_wrap():
+    buffer = FragmentBuffer()
+    frames = gnss_message()
+    first_seq = SEQ_MODULUS - 2
+    arrivals = [((first_seq + i) % SEQ_MODULUS, frame) for i, frame in enumerate(frames[:-1])]
+    random.Random(7).shuffle(arrivals)
+    arrivals.append(((first_seq + len(frames) - 1) % SEQ_MODULUS, frames[-1]))
+    results = [buffer.add('dev', seq, 1000, frame) for seq, frame in arrivals]
+    message = results[-1]
+    assert results[:-1] == [None] * (len(frames) - 1)
+    assert message.first_seq == first_seq
+    assert message.frames == tuple(frames)
+    assert message.nav_msg() == NAV.hex()
+
+
+def test_wifi_message_across_the_wrap():
+    buffer = FragmentBuffer()
+    aps = [AP_RECORD.pack(-60 - i, bytes([0xaa, 0, 0, 0, 0, i])) for i in range(4)]
+    first = decode_frame(header(WIFI, 2, 0) + SENSOR_BLOCK + aps[0] + aps[1])
+    end = decode_frame(header(WIFI, 2, 1) + aps[2] + aps[3])
+    assert buffer.add('dev', SEQ_MODULUS - 1, 1000, first) is None
+    message = buffer.add('dev', 0, 1001, end)
+    assert message.kind == 'WIFI'
+    assert message.first_seq == SEQ_MODULUS - 1
+    assert [ap['MacAddress'] for ap in message.wifi_data()] == [f'aa:00:00:00:00:0{i}' for i in range(4)]
+
+
+def test_duplicate_fragment_does_not_complete_the_message():
+    buffer = FragmentBuffer()
+    frames = gnss_message()
+    assert buffer.add('dev', 10, 1000, frames[0]) is None
+    assert buffer.add('dev', 10, 1000, frames[0]) is None
+    assert buffer.stats()['pending'] == 1
+
+
+def test_partial_messages_expire_after_the_window():
+    clock = Clock()
+    buffer = FragmentBuffer(window=300, clock=clock)
+    frames = gnss_message()
+    buffer.add('dev', 10, 1000, frames[0])
+    clock.now = 301
+    assert buffer.add('dev', 10 + len(frames) - 1, 1000, frames[-1]) is None
+    assert buffer.stats() == {'pending': 1, 'completed': 0, 'expired': 1, 'handed_off': 0}
+
+
+def test_message_whose_end_arrived_first_is_left_to_defrag():
+    buffer = FragmentBuffer()
+    frames = gnss_message()
+    # the END item was written without a location, the defrag function solves the message
+    assert buffer.add('dev', 13, 1003, frames[-1]) is None
+    assert [buffer.add('dev', 10 + i, 1000 + i, frame) for i, frame in enumerate(frames[:-1])] == [None] * 3
+    assert buffer.stats() == {'pending': 0, 'completed': 0, 'expired': 0, 'handed_off': 1}
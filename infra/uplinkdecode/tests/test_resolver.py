@@ -0,0 +1,159 @@
+import random
+
+import pytest
+
+from at_common.resolver import CircuitBreaker, PositionResolver, ResolverUnavailable, TokenBucket, error_kind
+from fakes import FaultyIotWireless, ServiceError
+
+SCAN = {'WiFiAccessPoints': [{'MacAddress': 'aa:00:00:00:00:01', 'Rss': -60}]}
+
+
+class Clock:
+    """Simulated time, sleep() advances it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class Rejecting(FaultyIotWireless):
+    def get_position_estimate(self, **kwargs):
+        self._call('get_position_estimate')
+        raise ServiceError('ValidationException', 400, 'GetPositionEstimate')
+
+
+def resolver(client, clock, **kwargs):
+    return PositionResolver(client=client, rng=random.Random(0), clock=clock, sleep=clock.sleep,
+                            breaker=CircuitBreaker(threshold=kwargs.pop('threshold', 3), reset_timeout=30,
+                                                   clock=clock), **kwargs)
+
+
+def test_error_kinds():
+    assert error_kind(ServiceError('ThrottlingException', 400, 'op')) == 'throttled'
+    assert error_kind(ServiceError('Whatever', 429, 'op')) == 'throttled'
+    assert error_kind(ServiceError('InternalServerException', 500, 'op')) == 'server'
+    assert error_kind(ServiceError('ValidationException', 400, 'op')) == 'client'
+    assert error_kind(ConnectionError()) == 'server'
+
+
+def test_bucket_paces_calls_after_the_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=10, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() and bucket.acquire()
+    assert clock.slept == []
+    assert bucket.acquire()
+    assert clock.slept == [pytest.approx(0.1)]
+    # a wait longer than the timeout takes no token
+    assert not bucket.acquire(timeout=0.05)
+    clock.now += 0.1
+    assert bucket.acquire(timeout=0)
+
+
+def test_bucket_rate_decreases_multiplicatively_and_increases_additively():
+    bucket = TokenBucket(rate=10, min_rate=1, decrease=0.5, increase=0.1)
+    for _ in range(5):
+        bucket.throttled()
+    assert bucket.rate == 1
+    bucket.succeeded()
+    assert bucket.rate == pytest.approx(2)
+    for _ in range(20):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_breaker_half_opens_for_a_single_probe():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.now = 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    # a probe not made lets the next call probe
+    breaker.release()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_throttled_calls_are_retried_at_a_lower_rate():
+    clock = Clock()
+    wireless = FaultyIotWireless(quota=2, clock=clock)
+    positions = resolver(wireless, clock, rate=10, burst=10, max_attempts=8, base_delay=0.2)
+    for _ in range(4):
+        assert positions.estimate(**SCAN)['type'] == 'Point'
+    assert wireless.outcomes['ThrottlingException'] > 0
+    assert positions.throttled == wireless.outcomes['ThrottlingException']
+    assert positions.bucket.rate < 10
+    assert positions.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_outage_opens_the_circuit_and_refuses_without_calling():
+    clock = Clock()
+    wireless = FaultyIotWireless(outages=[(0, 60)], clock=clock)
+    positions = resolver(wireless, clock, max_attempts=2, threshold=2)
+    for _ in range(2):
+        with pytest.raises(ResolverUnavailable):
+            positions.estimate(**SCAN)
+    assert positions.breaker.state == CircuitBreaker.OPEN
+    calls = wireless.calls['get_position_estimate']
+    with pytest.raises(ResolverUnavailable, match='Circuit open'):
+        positions.estimate(**SCAN)
+    assert wireless.calls['get_position_estimate'] == calls
+    # the probe after the outage closes the circuit again
+    clock.now = 61
+    assert positions.estimate(**SCAN)['type'] == 'Point'
+    assert positions.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_errors_are_raised_as_is_and_do_not_open_the_circuit():
+    clock = Clock()
+    wireless = Rejecting(clock=clock)
+    positions = resolver(wireless, clock, threshold=1)
+    for _ in range(3):
+        with pytest.raises(ServiceError):
+            positions.estimate(**SCAN)
+    assert wireless.calls['get_position_estimate'] == 3
+    assert positions.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_rate_limited_solve_releases_the_probe():
+    clock = Clock()
+    positions = resolver(FaultyIotWireless(clock=clock), clock, rate=1, burst=1, max_wait=0.5)
+    positions.estimate(**SCAN)
+    with pytest.raises(ResolverUnavailable, match='Rate limited'):
+        positions.estimate(**SCAN)
+    assert positions.breaker.state == CircuitBreaker.CLOSED
+    assert positions.refused == 1
+
+
+def test_deadline_caps_backoff_and_refuses_out_of_time():
+    clock = Clock()
+    wireless = FaultyIotWireless(outages=[(0, 60)], clock=clock)
+    positions = resolver(wireless, clock, max_attempts=4, base_delay=1, max_delay=10)
+    positions.set_deadline(0.5)
+    with pytest.raises(ResolverUnavailable, match='Out of time'):
+        positions.estimate(**SCAN)
+    assert clock.now == pytest.approx(0.5)
+    with pytest.raises(ResolverUnavailable, match='Out of time'):
+        positions.estimate(**SCAN)
+    positions.set_deadline(None)
+    clock.now = 61
+    assert positions.estimate(**SCAN)['type'] == 'Point'
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from at_common.rollup import (
+    LATENESS, DynamoDBRollupStore, LocalRollupStore, Rollup, Rollups, Sample, chunk_start, series_key,
+)
+from fakes import FakeDynamoDB
+from handlers import load_handler
+
+HOUR = 3_600_000
+# 2024-01-31T22:00:00Z, two hours before the end of a day and of a month
+EVENING = int(datetime(2024, 1, 31, 22, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def sample(timestamp, battery=80.0):
+    return Sample(timestamp, (battery, 20.0, 40.0, 0.5))
+
+
+def test_buckets_aggregate_samples_once():
+    rollup = Rollup(HOUR)
+    assert rollup.add(EVENING + 60_000, (80.0, 20.0, 40.0, 0.5))
+    assert rollup.add(EVENING + 30_000, (90.0, 10.0, 40.0, 0.5))
+    assert not rollup.add(EVENING + 30_000, (90.0, 10.0, 40.0, 0.5))
+    assert rollup.add(EVENING + 2 * HOUR, (70.0, 20.0, 40.0, 0.5))
+    # behind the horizon
+    assert not rollup.add(EVENING + HOUR - LATENESS, (70.0, 20.0, 40.0, 0.5))
+    first, second = Rollup.from_bytes(rollup.to_bytes()).query(EVENING, EVENING + 3 * HOUR)
+    assert (first.start, first.count, second.start, second.count) == (EVENING, 2, EVENING + 2 * HOUR, 1)
+    assert first.stats['battery'] == (80.0, 90.0, 85.0, 80.0)
+    with pytest.raises(ValueError):
+        Rollup.from_bytes(b'\x01' + rollup.to_bytes()[1:])
+
+
+def test_samples_are_stored_per_day_and_per_month():
+    store = LocalRollupStore()
+    rollups = Rollups(store)
+    samples = [sample(EVENING + i * 600_000) for i in range(24)]
+    assert rollups.apply('dev', samples) == 24
+    next_day = EVENING + 2 * HOUR
+    assert sorted(key for _, key in store.items) == sorted([
+        series_key('hour', chunk_start('hour', EVENING)), series_key('hour', next_day),
+        series_key('day', chunk_start('day', EVENING)), series_key('day', next_day),
+    ])
+    assert chunk_start('day', EVENING) == int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    # a full day of hourly buckets
+    rollups.apply('dev', [sample(next_day + i * HOUR) for i in range(24)])
+    assert len(store.load('dev', series_key('hour', next_day))[0]) < 3000
+
+
+def test_chunks_changed_by_another_consumer_are_merged():
+    store = LocalRollupStore()
+    one, other = Rollups(store), Rollups(store)
+    assert one.apply('dev', [sample(EVENING)]) == 1
+    assert other.apply('dev', [sample(EVENING + 60_000), sample(EVENING + 2 * HOUR)]) == 2
+    # the chunk cached by `one` is stale, the samples are applied to the stored one
+    assert one.apply('dev', [sample(EVENING + 120_000), sample(EVENING + 2 * HOUR + 60_000)]) == 2
+    # a redelivered sample is not counted twice
+    assert other.apply('dev', [sample(EVENING)]) == 0
+    buckets = one.query('dev', 'hour', EVENING, EVENING + 3 * HOUR)
+    assert [(bucket.start, bucket.count) for bucket in buckets] == [(EVENING, 3), (EVENING + 2 * HOUR, 2)]
+    day, = one.query('dev', 'day', EVENING, EVENING + HOUR)
+    assert day.count == 3
+
+
+def test_range_query_reads_the_chunks_of_the_range():
+    db = FakeDynamoDB(hash_key='WirelessDeviceId', range_key='series')
+    db.page_size = 2
+    rollups = Rollups(DynamoDBRollupStore(client=db))
+    rollups.apply('dev', [sample(EVENING + i * 6 * HOUR) for i in range(12)])
+    rollups.apply('other', [sample(EVENING)])
+    db.calls.clear()
+    buckets = rollups.query('dev', 'hour', EVENING + 6 * HOUR, EVENING + 54 * HOUR)
+    assert [bucket.start for bucket in buckets] == [EVENING + i * 6 * HOUR for i in range(1, 9)]
+    # three days in pages of two
+    assert db.calls['query'] == 2
+    assert [bucket.count for bucket in rollups.query('dev', 'day', 0, EVENING + 100 * HOUR)] == [1, 4, 4, 3]
+    assert rollups.query('dev', 'hour', EVENING, EVENING) == []
+
+
+@pytest.mark.parametrize('event', [
+    {'deviceId': 'dev', 'start': 0},
+    {'deviceId': 'dev', 'start': 'yesterday', 'end': 1},
+    {'deviceId': 'dev', 'start': None, 'end': 1},
+    {'deviceId': 'dev', 'start': 2, 'end': 1},
+    {'deviceId': 'dev', 'resolution': 'minute', 'start': 0, 'end': 1},
+    {'start': 0, 'end': 1},
+])
+def test_query_handler_rejects_bad_requests(event, monkeypatch):
+    at_rollup = load_handler('rollup')
+    monkeypatch.setattr(at_rollup, 'rollups', Rollups(LocalRollupStore()))
+    assert at_rollup.query_handler(event, None)['statusCode'] == 400
+
+
+def test_query_handler_returns_the_buckets(monkeypatch):
+    at_rollup = load_handler('rollup')
+    monkeypatch.setattr(at_rollup, 'rollups', Rollups(LocalRollupStore()))
+    at_rollup.rollups.apply('dev', [sample(EVENING), sample(EVENING + HOUR)])
+    response = at_rollup.query_handler({'deviceId': 'dev', 'start': str(EVENING), 'end': EVENING + HOUR}, None)
+    assert response['statusCode'] == 200
+    assert [bucket['start'] for bucket in response['buckets']] == [EVENING]
+    assert response['buckets'][0]['battery']['mean'] == 80.0
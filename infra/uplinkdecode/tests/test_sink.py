@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from at_common.sink import PayloadSink
+
+
+class Client:
+    """batch_write_item leaving the first `unprocessed` items of each call unwritten, for `throttled` calls."""
+
+    def __init__(self, unprocessed=0, throttled=0, error=None):
+        self.unprocessed = unprocessed
+        self.throttled = throttled
+        self.error = error
+        self.calls = []
+        self.written = []
+
+    def batch_write_item(self, RequestItems):
+        (table, requests), = RequestItems.items()
+        assert len(requests) <= 25
+        self.calls.append(len(requests))
+        if self.error is not None:
+            raise self.error
+        kept = self.unprocessed if len(self.calls) <= self.throttled else 0
+        self.written += [request['PutRequest']['Item'] for request in requests[kept:]]
+        return {'UnprocessedItems': {table: requests[:kept]} if kept else {}}
+
+
+def item(devid, timestamp, value=0):
+    return {'WirelessDeviceId': {'S': devid}, 'timestamp': {'N': str(timestamp)}, 'value': {'N': str(value)}}
+
+
+def test_items_are_written_in_chunks_of_25():
+    client = Client()
+    sink = PayloadSink(client, 'at-payloads')
+    for i in range(60):
+        sink.put(item('dev', i))
+    assert client.calls == [25, 25]
+    assert len(sink) == 10
+    assert sink.flush() == []
+    assert client.calls == [25, 25, 10]
+    assert len(client.written) == 60
+
+
+def test_later_item_with_the_same_key_replaces_the_buffered_one():
+    client = Client()
+    sink = PayloadSink(client, 'at-payloads')
+    sink.put(item('dev', 1, 1))
+    sink.put(item('dev', 1, 2))
+    sink.flush()
+    assert client.written == [item('dev', 1, 2)]
+
+
+def test_unprocessed_items_are_redriven_with_backoff():
+    client = Client(unprocessed=3, throttled=2)
+    delays = []
+    sink = PayloadSink(client, 'at-payloads', sleep=delays.append)
+    for i in range(10):
+        sink.put(item('dev', i))
+    assert sink.flush() == []
+    assert client.calls == [10, 3, 3]
+    assert len(delays) == 2
+    assert all(0 <= delay <= sink.max_delay for delay in delays)
+    assert sorted(int(i['timestamp']['N']) for i in client.written) == list(range(10))
+
+
+def test_items_still_unprocessed_are_returned_as_failed():
+    client = Client(unprocessed=2, throttled=100)
+    sink = PayloadSink(client, 'at-payloads', max_attempts=3, sleep=lambda delay: None)
+    for i in range(5):
+        sink.put(item('dev', i))
+    assert sink.flush() == [item('dev', 0), item('dev', 1)]
+    assert client.calls == [5, 2, 2]
+    # the failed list is reset by the flush
+    assert sink.flush() == []
+
+
+def test_items_of_a_failed_call_are_returned_as_failed():
+    sink = PayloadSink(Client(error=RuntimeError('boom')), 'at-payloads')
+    sink.put(item('dev', 1))
+    assert sink.flush() == [item('dev', 1)]
+
+
+def test_flush_waits_for_background_writes():
+    client = Client(unprocessed=1, throttled=1)
+    with ThreadPoolExecutor(4) as executor:
+        sink = PayloadSink(client, 'at-payloads', batch_size=5, sleep=lambda delay: None, executor=executor)
+        for i in range(23):
+            sink.put(item('dev', i))
+        assert sink.flush() == []
+    assert len(client.written) == 23
@@ -0,0 +1,98 @@
+"""
+Adds 'fragkey' to the fragment items at-payloads already holds.
+
+at-decode writes 'fragkey' on every new fragment item, the key of the
+sparse 'fragments' index at-defrag reads fragments through (see
+at_common.fragments). Items written before that are not in the index, so
+messages still being sent while the new version is deployed would miss
+their first fragments. Run this once the index is ACTIVE:
+
+    python tools/backfill_fragkeys.py --dry-run
+    python tools/backfill_fragkeys.py --segments 8
+
+The table is scanned in parallel segments for fragment items without the
+attribute, which is then set with a conditional update so items deleted in
+the meantime are not recreated. Running it again only touches items it
+missed.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'lambda', 'at_common', 'python'))
+
+from at_common.items import FRAGMENT_KEY_ATTRIBUTE, fragment_key  # noqa: E402
+from at_common.reassembly import FRAGMENT_TYPES  # noqa: E402
+
+
+def backfill_segment(client, table_name: str, segment: int, segments: int, dry_run: bool = False,
+                     page_size: int = 1000) -> Dict[str, int]:
+    """Scans one segment of the table, returns the items scanned, found and updated."""
+    types = {f':t{i}': {'S': frame_type} for i, frame_type in enumerate(sorted(FRAGMENT_TYPES))}
+    kwargs = {
+        'TableName': table_name,
+        'Segment': segment,
+        'TotalSegments': segments,
+        'Limit': page_size,
+        'ProjectionExpression': 'WirelessDeviceId, #ts, seq',
+        'FilterExpression': f'#type IN ({", ".join(types)}) AND attribute_not_exists(#k)',
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#type': 'type', '#k': FRAGMENT_KEY_ATTRIBUTE},
+        'ExpressionAttributeValues': types,
+    }
+    counts = {'scanned': 0, 'found': 0, 'updated': 0}
+    while True:
+        response = client.scan(**kwargs)
+        counts['scanned'] += response.get('ScannedCount', 0)
+        for item in response.get('Items', []):
+            counts['found'] += 1
+            if dry_run:
+                continue
+            key = fragment_key(int(item['timestamp']['N']), int(item['seq']['N']))
+            try:
+                client.update_item(
+                    TableName=table_name,
+                    Key={'WirelessDeviceId': item['WirelessDeviceId'], 'timestamp': item['timestamp']},
+                    UpdateExpression='SET #k = :k',
+                    ConditionExpression='attribute_exists(WirelessDeviceId)',
+                    ExpressionAttributeNames={'#k': FRAGMENT_KEY_ATTRIBUTE},
+                    ExpressionAttributeValues={':k': {'N': str(key)}},
+                )
+            except Exception as e:
+                if getattr(e, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                    continue
+                raise
+            counts['updated'] += 1
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill(client, table_name: str = 'at-payloads', segments: int = 4, dry_run: bool = False,
+             page_size: int = 1000) -> Dict[str, int]:
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(
+            lambda segment: backfill_segment(client, table_name, segment, segments, dry_run, page_size),
+            range(segments)))
+    return {name: sum(counts[name] for counts in results) for name in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', default='at-payloads')
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--page-size', type=int, default=1000, help='items evaluated per scan page')
+    parser.add_argument('--dry-run', action='store_true', help='only count the items missing fragkey')
+    args = parser.parse_args()
+
+    counts = backfill(boto3.client('dynamodb'), args.table, args.segments, args.dry_run, args.page_size)
+    print(json.dumps(counts))
+
+
+if __name__ == '__main__':
+    main()
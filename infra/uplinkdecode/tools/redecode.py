@@ -0,0 +1,593 @@
+"""
+Re-decodes historical uplinks into at-payloads items, offline and in bulk.
+
+Inputs are JSON lines files, plain or gzipped, or directories of them:
+- a DynamoDB export of at-payloads ({"Item": {...}} per line, DYNAMODB_JSON).
+  Compact items are re-decoded from their raw frame; legacy items, which
+  no longer hold it, are carried over in the legacy format. GNSS messages of
+  legacy items are only reassembled when their items are in seq order.
+- recorded at_uplink events, e.g. from the IoT rule or bench/traffic.py.
+  The timestamp comes from WirelessMetadata.Sidewalk.Timestamp, else, given
+  --start, from 'arrival' (seconds after --start). Events with neither are
+  skipped and counted as untimed. Lines that cannot be parsed are counted
+  as invalid.
+
+Lines are dispatched to a pool of worker processes, sharded on
+WirelessDeviceId like the uplink service, so all fragments of a device reach
+the same worker. Workers run the decoder of the UplinkCommon layer: frames
+are decoded in batches (at_common.batch), duplicated events are dropped
+(at_common.dedupe), fragments are reassembled (at_common.reassembly) with
+the event time as clock, and items are built with at_common.items. Positions
+are not solved: messages completing without a location are written, with
+--solves, as deferred solve messages (see at_common.resolver), ready to be
+sent to the deferred solve queue.
+
+Items go to one of two sinks:
+- --out DIR: a part-NNN.jsonl file per worker, in the export format, which
+  DynamoDB can import from S3.
+- --table: written with BatchWriteItem (at_common.sink). Tables with a
+  stream enabled, such as the live at-payloads whose stream triggers the
+  defrag solves and publishes and the rollups, are refused.
+
+With --checkpoint, the input position is saved after every block of lines
+all workers have processed and flushed, and a later run with the same
+checkpoint resumes after it, with the same number of workers. SIGINT /
+SIGTERM stop reading, the blocks already dispatched are finished and
+checkpointed. On resume the part and solves files are cut back to their
+size at the checkpoint, without a checkpoint they are overwritten; table
+items of the blocks after the checkpoint are written again, under the same
+keys. Messages straddling the checkpoint are not reassembled on resume. A
+block whose writes failed stops the checkpoint from advancing.
+
+    python tools/redecode.py export/data --out redecoded --workers 8 --checkpoint redecode.json
+    python tools/redecode.py trace.jsonl --table at-payloads-redecoded --solves solves --start 1700000000000
+"""
+import argparse
+import base64
+import binascii
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'lambda', 'at_common', 'python'))
+
+from at_common.batch import decode_batch  # noqa: E402
+from at_common.dedupe import DuplicateFilter  # noqa: E402
+from at_common.frames import Frame, FrameError, decode_payload  # noqa: E402
+from at_common.items import ITEM_FORMAT, LEGACY, PayloadRecord, decode_image, encode_item  # noqa: E402
+from at_common.reassembly import FRAGMENT_TYPES, SEQ_MODULUS, FragmentBuffer  # noqa: E402
+
+# WirelessDeviceId of an export item or an event, read without parsing the line
+DEVICE_PATTERN = re.compile(r'"WirelessDeviceId"\s*:\s*(?:\{\s*"S"\s*:\s*)?"([^"]*)"')
+INPUT_SUFFIXES = ('.json', '.jsonl', '.json.gz', '.jsonl.gz')
+
+
+def input_files(paths: List[str]) -> List[str]:
+    """The JSON lines files given, directories expanded in name order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(root, name) for root, _, names in os.walk(path)
+                                for name in names if name.endswith(INPUT_SUFFIXES)))
+        else:
+            files.append(path)
+    return files
+
+
+def open_text(path: str, mode: str = 'rt'):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode.replace('t', ''))
+
+
+def shard(line: str, workers: int) -> int:
+    match = DEVICE_PATTERN.search(line)
+    return zlib.crc32(match.group(1).encode()) % workers if match else 0
+
+
+def event_timestamp(event: Dict, start: Optional[int]) -> Optional[int]:
+    """Timestamp (ms) of a recorded event, None when it has none."""
+    uplink = event.get('at_uplink', event)
+    stamp = ((uplink.get('WirelessMetadata') or {}).get('Sidewalk') or {}).get('Timestamp')
+    if stamp:
+        return int(datetime.fromisoformat(stamp.replace('Z', '+00:00')).timestamp() * 1000)
+    if 'arrival' in event and start is not None:
+        return start + int(event['arrival'] * 1000)
+    return None
+
+
+def dynamodb_json(item: Dict[str, Dict]) -> str:
+    """An item as a line of a DynamoDB export, binary values base64 encoded."""
+    return json.dumps({'Item': {
+        name: {'B': base64.b64encode(value['B']).decode()} if 'B' in value else value
+        for name, value in item.items()
+    }}, separators=(',', ':'))
+
+
+class JsonLinesSink:
+    """
+    Writes items to a JSON lines file in the DynamoDB export format. The
+    file is cut back to `offset` and appended to, or overwritten without one.
+    """
+
+    def __init__(self, path: str, offset: Optional[int] = None):
+        self.file = open(path, 'w' if offset is None else 'a')
+        if offset is not None:
+            self.file.truncate(offset)
+
+    def put(self, item: Dict[str, Dict]):
+        self.file.write(dynamodb_json(item) + '\n')
+
+    def write(self, message: Dict):
+        self.file.write(json.dumps(message, separators=(',', ':')) + '\n')
+
+    def flush(self) -> List[Dict]:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return []
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class TableSink:
+    """PayloadSink writing chunks on a few threads, for a worker process."""
+
+    def __init__(self, table_name: str, writers: int = 4):
+        import boto3
+        from at_common.sink import PayloadSink
+        self.executor = ThreadPoolExecutor(max_workers=writers)
+        self.sink = PayloadSink(boto3.client('dynamodb'), table_name, executor=self.executor)
+
+    def put(self, item: Dict[str, Dict]):
+        self.sink.put(item)
+
+    def flush(self) -> List[Dict]:
+        return self.sink.flush()
+
+    def tell(self) -> None:
+        return None
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def check_table(table_name: str, client=None):
+    """Raises ValueError for a table whose stream would pick up the items, e.g. the live at-payloads."""
+    if client is None:
+        import boto3
+        client = boto3.client('dynamodb')
+    table = client.describe_table(TableName=table_name)['Table']
+    if table.get('StreamSpecification', {}).get('StreamEnabled'):
+        raise ValueError(f'{table_name} has a stream enabled, its consumers would solve and publish the items '
+                         'again; write to a table without a stream, or to --out and import it')
+
+
+class Redecoder:
+    """
+    The decode state of one worker: duplicate filter, fragment buffer and
+    the END items of messages still being reassembled.
+    """
+
+    def __init__(self, sink, solves=None, start: Optional[int] = None, window: float = 300.0, max_pending: int = 4096,
+                 version: int = ITEM_FORMAT):
+        self.sink = sink
+        self.solves = solves
+        self.start = start
+        self.version = version
+        self.now = 0.0
+        self.uplink_filter = DuplicateFilter(max_devices=1 << 20)
+        self.fragment_buffer = FragmentBuffer(max_pending=max_pending, window=window, clock=lambda: self.now)
+        self.max_pending = max_pending
+        # (devid, seq) of END items without a location whose message is not complete yet,
+        # with their timestamp and format
+        self._ends: 'OrderedDict[Tuple[str, int], Tuple[int, int]]' = OrderedDict()
+        self._last_timestamps: Dict[str, int] = {}
+        self._gnss_starts: Dict[str, int] = {}
+        self.counts = Counter()
+
+    def records(self, lines: List[Tuple[int, str]], counts: Counter) -> Iterator[Tuple]:
+        """
+        (devid, timestamp, seq, payload, location, event) of each line; items
+        in the legacy format as a decoded PayloadRecord. Lines that cannot be
+        parsed are counted as invalid, events without a timestamp as untimed.
+        """
+        for _, line in lines:
+            try:
+                record = self._record(line)
+            except (ValueError, KeyError, TypeError, AttributeError, FrameError):
+                counts['invalid'] += 1
+                continue
+            if record is None:
+                counts['untimed'] += 1
+                continue
+            yield record
+
+    def _record(self, line: str):
+        data = json.loads(line)
+        item = data.get('Item')
+        if item is None:
+            uplink = data.get('at_uplink', data)
+            devid = uplink['WirelessDeviceId']
+            seq = int(uplink['WirelessMetadata']['Seq'])
+            timestamp = event_timestamp(data, self.start)
+            if timestamp is None:
+                return None
+            # uplinks of a device must not share the timestamp sort key
+            timestamp = max(timestamp, self._last_timestamps.get(devid, 0) + 1)
+            self._last_timestamps[devid] = timestamp
+            try:
+                payload = decode_payload(uplink.get('PayloadData'))
+            except FrameError:
+                payload = b''
+            return devid, timestamp, seq, payload, None, True
+        if 'f' in item:
+            location = item.get('location', {}).get('S')
+            return (item['WirelessDeviceId']['S'], int(item['timestamp']['N']), int(item['seq']['N']),
+                    binascii.a2b_base64(item['f']['B']), location and json.loads(location), False)
+        return decode_image(item)
+
+    def process(self, lines: List[Tuple[int, str]]) -> Counter:
+        """Decodes a block of lines and writes their items, returns the counts of the block."""
+        counts = Counter(lines=len(lines))
+        records = []
+        for record in self.records(lines, counts):
+            if not isinstance(record, PayloadRecord):
+                records.append(record)
+                continue
+            # legacy item, re-encoded as is
+            self.now = max(self.now, record.timestamp / 1000)
+            self.sink.put(encode_item(record.devid, record.timestamp, record.seq, record.frame, record.location,
+                                      LEGACY))
+            counts['legacy'] += 1
+            self._located(record.devid, record.timestamp, record.seq, self._legacy_frame(record), record.location,
+                          LEGACY, counts)
+
+        frames = decode_batch([record[3] for record in records])
+        for (devid, timestamp, seq, _, location, event), frame in zip(records, frames):
+            if isinstance(frame, FrameError):
+                counts['invalid'] += 1
+                continue
+            if event and not self.uplink_filter.check(devid, seq):
+                counts['duplicates'] += 1
+                continue
+            self.now = max(self.now, timestamp / 1000)
+            counts['frames'] += 1
+            if frame.type == 'CONFIG':
+                # settings live in at-config, see at_common.devconfig
+                continue
+            self.sink.put(encode_item(devid, timestamp, seq, frame, location, self.version))
+            counts['items'] += 1
+            self._located(devid, timestamp, seq, frame, location, self.version, counts)
+
+        failed = self.sink.flush()
+        if self.solves is not None:
+            self.solves.flush()
+        counts['failed'] += len(failed)
+        self.counts.update(counts)
+        return counts
+
+    def _legacy_frame(self, record: PayloadRecord) -> Frame:
+        """
+        The frame of a legacy item. Legacy items do not record the fragment
+        number of a GNSS_F frame, it is derived from the seq of the device's
+        last GNSS item.
+        """
+        frame = record.frame
+        if frame.type == 'GNSS':
+            self._gnss_starts[record.devid] = record.seq
+        elif frame.type == 'GNSS_F' and record.devid in self._gnss_starts:
+            index = (record.seq - self._gnss_starts[record.devid]) % SEQ_MODULUS
+            if 0 < index < frame.num_msg - 1:
+                frame = frame._replace(frag_num=index)
+        return frame
+
+    def _located(self, devid, timestamp, seq, frame: Frame, location, version: int, counts: Counter):
+        """Reassembles a fragment, queues the solve of a single frame without a location."""
+        if frame.type == 'WIFI' and location is None:
+            self._solve(devid, timestamp, seq, ('WIFI', frame.wifi_data()), timestamp, frame.sensor.battery,
+                        version, counts)
+        elif frame.type in FRAGMENT_TYPES:
+            self._reassemble(devid, timestamp, seq, frame, location, version, counts)
+
+    def _reassemble(self, devid, timestamp, seq, frame: Frame, location, version: int, counts: Counter):
+        if frame.type in ('WIFI_END', 'GNSS_END') and location is None:
+            self._ends[(devid, seq)] = (timestamp, version)
+            while len(self._ends) > self.max_pending:
+                self._ends.popitem(last=False)
+        message = self.fragment_buffer.add(devid, seq, timestamp, frame)
+        if message is None:
+            return
+        counts['messages'] += 1
+        end_seq = (message.first_seq + len(message.frames) - 1) % SEQ_MODULUS
+        end = self._ends.pop((devid, end_seq), None)
+        if end is None:
+            # the END item has a location already
+            return
+        if message.kind == 'WIFI':
+            solve = ('WIFI', message.wifi_data())
+        else:
+            solve = ('GNSS', message.nav_msg(), message.capture_time)
+        self._solve(devid, end[0], end_seq, solve, message.first_timestamp, message.sensor.battery, end[1], counts)
+
+    def _solve(self, devid, timestamp, seq, solve, location_timestamp, battery, version: int, counts: Counter):
+        if self.solves is None:
+            return
+        kind, *args = solve
+        self.solves.write({
+            'devid': devid, 'timestamp': timestamp, 'seq': seq, 'kind': kind, 'args': args,
+            'location_timestamp': location_timestamp, 'battery': battery, 'version': version,
+        })
+        counts['solves'] += 1
+
+    def stats(self) -> Dict:
+        buffer = self.fragment_buffer.stats()
+        return dict(self.counts, incomplete=buffer['pending'] + buffer['expired'])
+
+
+def run_worker(index: int, inbox, results, options: Dict):
+    """Worker process: decodes the blocks of its shard until it receives None."""
+    # the dispatcher handles the signals, workers stop on the None block
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # sizes of the worker's files at the checkpoint resumed from
+    part_offset, solves_offset = options.get('offsets', {}).get(str(index)) or (None, None)
+    if options.get('table'):
+        sink = TableSink(options['table'], options['writers'])
+    else:
+        sink = JsonLinesSink(os.path.join(options['out'], f'part-{index:03d}.jsonl'), part_offset)
+    solves = JsonLinesSink(os.path.join(options['solves'], f'solves-{index:03d}.jsonl'), solves_offset) \
+        if options.get('solves') else None
+    redecoder = Redecoder(sink, solves, options['start'], options['window'], version=options['version'])
+    seconds = 0.0
+    while True:
+        block = inbox.get()
+        if block is None:
+            break
+        block_id, lines = block
+        started = time.perf_counter()
+        try:
+            counts = redecoder.process(lines)
+        except Exception as e:
+            print(f'worker {index}: block {block_id} failed: {e}', file=sys.stderr)
+            counts = Counter(lines=len(lines), failed=len(lines))
+        seconds += time.perf_counter() - started
+        results.put(('ack', block_id, index, dict(counts), (sink.tell(), solves.tell() if solves else None)))
+    sink.close()
+    if solves is not None:
+        solves.close()
+    results.put(('done', index, dict(redecoder.stats(), worker=index, seconds=round(seconds, 3))))
+
+
+class CheckpointMismatch(ValueError):
+    """The checkpoint was saved by a run with another number of workers."""
+
+
+class Checkpoint:
+    """
+    Input position of a run: the files done and the lines done of the current
+    file, with the totals so far, the number of workers and the sizes of
+    their files.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: List[str] = []
+        self.current: Optional[str] = None
+        self.lines = 0
+        self.totals = Counter()
+        self.workers: Optional[int] = None
+        # worker index (str) -> [part file size, solves file size]
+        self.offsets: Dict[str, List[Optional[int]]] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.done = saved['done']
+            self.current = saved['current']
+            self.lines = saved['lines']
+            self.totals = Counter(saved['totals'])
+            self.workers = saved['workers']
+            self.offsets = saved['offsets']
+
+    def skip(self, path: str) -> int:
+        """Lines of a file processed already, -1 for a file done."""
+        if path in self.done:
+            return -1
+        return self.lines if path == self.current else 0
+
+    def advance(self, path: str, lines: int, last: bool, counts: Dict, offsets: Dict[str, List[Optional[int]]]):
+        self.totals.update(counts)
+        self.offsets = offsets
+        if last:
+            self.done.append(path)
+            self.current, self.lines = None, 0
+        else:
+            self.current, self.lines = path, lines
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'done': self.done, 'current': self.current, 'lines': self.lines,
+                       'totals': dict(self.totals), 'workers': self.workers, 'offsets': self.offsets}, f)
+        os.replace(temporary, self.path)
+
+
+def redecode(files: List[str], options: Dict, workers: int = os.cpu_count() or 1, block_size: int = 20000,
+             queue_size: int = 4, checkpoint: Optional[str] = None, progress: float = 10.0,
+             stopping: Optional[threading.Event] = None) -> Dict:
+    """
+    Runs the workers over the input files and returns the report as a dict.
+    Setting `stopping` stops reading, the blocks already dispatched are
+    finished and checkpointed.
+
+    Raises:
+    CheckpointMismatch: When the checkpoint was saved with another number
+    of workers, whose shards and files would not line up.
+    """
+    stopping = stopping or threading.Event()
+    state = Checkpoint(checkpoint)
+    if state.workers is not None and state.workers != workers:
+        raise CheckpointMismatch(f'{checkpoint} was saved by {state.workers} workers, not {workers}')
+    state.workers = workers
+    options = dict(options, offsets=state.offsets)
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    inboxes = [context.Queue(queue_size) for _ in range(workers)]
+    processes = [context.Process(target=run_worker, name=f'redecode-worker-{i}', daemon=True,
+                                 args=(i, inbox, results, options)) for i, inbox in enumerate(inboxes)]
+    for process in processes:
+        process.start()
+
+    blocks: 'OrderedDict[int, Dict]' = OrderedDict()  # blocks in flight, in input order
+    stats = []
+    stalled = False
+    started = last_report = time.perf_counter()
+
+    def receive(timeout: Optional[float] = None):
+        nonlocal stalled, last_report
+        try:
+            message = results.get(timeout=timeout) if timeout else results.get_nowait()
+        except queue.Empty:
+            return
+        if message[0] == 'done':
+            stats.append(message[2])
+            return
+        _, block_id, index, counts, offsets = message
+        block = blocks[block_id]
+        block['pending'] -= 1
+        block['counts'].update(counts)
+        block['offsets'][str(index)] = offsets
+        # the checkpoint advances over the leading blocks all workers acknowledged
+        while blocks and next(iter(blocks.values()))['pending'] == 0:
+            _, block = blocks.popitem(last=False)
+            stalled = stalled or block['counts']['failed'] > 0
+            if not stalled:
+                state.advance(block['path'], block['lines'], block['last'], block['counts'], block['offsets'])
+        if time.perf_counter() - last_report >= progress:
+            last_report = time.perf_counter()
+            frames = state.totals['frames']
+            print(f'{frames} frames, {frames / (last_report - started):.0f} frames/s, at {state.current} '
+                  f'line {state.lines}', file=sys.stderr)
+
+    def dispatch(block_id: int, path: str, lines: int, last: bool, shards: List[List]):
+        blocks[block_id] = {'path': path, 'lines': lines, 'last': last, 'pending': workers, 'counts': Counter(),
+                            'offsets': {}}
+        for inbox, lines_of_shard in zip(inboxes, shards):
+            while True:
+                try:
+                    inbox.put((block_id, lines_of_shard), timeout=0.1)
+                    break
+                except queue.Full:
+                    receive()
+            receive()
+
+    block_id = 0
+    for path in files:
+        skip = state.skip(path)
+        if skip < 0 or stopping.is_set():
+            continue
+        shards = [[] for _ in range(workers)]
+        size = 0
+        line_no = 0
+        with open_text(path) as f:
+            for line_no, line in enumerate(f, 1):
+                if line_no <= skip or not line.strip():
+                    continue
+                shards[shard(line, workers)].append((line_no, line))
+                size += 1
+                if size >= block_size:
+                    dispatch(block_id, path, line_no, False, shards)
+                    block_id += 1
+                    shards = [[] for _ in range(workers)]
+                    size = 0
+                    if stopping.is_set():
+                        break
+            else:
+                dispatch(block_id, path, line_no, True, shards)
+                block_id += 1
+
+    for inbox in inboxes:
+        inbox.put(None)
+    while len(stats) < workers:
+        if not any(process.is_alive() for process in processes) and results.empty():
+            print(f'{workers - len(stats)} workers exited without reporting', file=sys.stderr)
+            break
+        receive(1.0)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    frames = sum(s.get('frames', 0) + s.get('legacy', 0) for s in stats)
+    return {
+        'lines': sum(s.get('lines', 0) for s in stats),
+        'frames': frames,
+        'items': sum(s.get('items', 0) + s.get('legacy', 0) for s in stats),
+        'invalid': sum(s.get('invalid', 0) for s in stats),
+        'untimed': sum(s.get('untimed', 0) for s in stats),
+        'duplicates': sum(s.get('duplicates', 0) for s in stats),
+        'messages': sum(s.get('messages', 0) for s in stats),
+        'incomplete': sum(s.get('incomplete', 0) for s in stats),
+        'solves': sum(s.get('solves', 0) for s in stats),
+        'failed': sum(s.get('failed', 0) for s in stats),
+        'seconds': round(elapsed, 3),
+        'frames_per_second': round(frames / elapsed, 1) if elapsed else 0.0,
+        'stopped': stopping.is_set(),
+        'checkpoint': {'stalled': stalled, 'totals': dict(state.totals)},
+        'workers': sorted(stats, key=lambda s: s['worker']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='JSON lines files or directories, plain or gzipped')
+    sink = parser.add_mutually_exclusive_group(required=True)
+    sink.add_argument('--out', help='directory of the part-NNN.jsonl item files')
+    sink.add_argument('--table', help='DynamoDB table without a stream the items are written to')
+    parser.add_argument('--solves', help='directory of the solves-NNN.jsonl deferred solve messages')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--writers', type=int, default=4, help='BatchWriteItem threads per worker with --table')
+    parser.add_argument('--block-size', type=int, default=20000, help='lines per checkpointed block')
+    parser.add_argument('--checkpoint', help='file the input position is saved to and resumed from')
+    parser.add_argument('--start', type=int, help='ms timestamp of arrival 0 of recorded events without one')
+    parser.add_argument('--frag-window', type=float, default=300, help='seconds of event time fragments wait')
+    parser.add_argument('--item-format', type=int, default=ITEM_FORMAT, help='at-payloads item format written')
+    parser.add_argument('--progress', type=float, default=10, help='seconds between progress lines')
+    args = parser.parse_args()
+
+    if args.table:
+        try:
+            check_table(args.table)
+        except ValueError as e:
+            parser.error(str(e))
+    for directory in (args.out, args.solves):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    options = {'out': args.out, 'table': args.table, 'writers': args.writers, 'solves': args.solves,
+               'start': args.start, 'window': args.frag_window, 'version': args.item_format}
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+    try:
+        report = redecode(input_files(args.inputs), options, args.workers, args.block_size,
+                          checkpoint=args.checkpoint, progress=args.progress, stopping=stopping)
+    except CheckpointMismatch as e:
+        parser.error(str(e))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()